@@ -0,0 +1,195 @@
+"""
+Compares serving result polls through the WSGI and the ASGI application under many concurrent pollers.
+
+Every poller asks `rendering/results/new/` for its event again as soon as it gets an answer. Under WSGI
+the requests share a pool of --threads threads, like a threaded WSGI server; under ASGI they all run on one event loop,
+which only hands the blocking store reads to threads. Both applications are called in process, without a server
+or sockets in front of them, so the numbers are the application's share of the latency.
+
+--store-latency-ms adds the latency of a slow disk to every read of the store, which is what ASGI
+keeps from holding a thread. --cache puts the in-memory event cache in front of the store.
+
+Usage:
+    python -m benchmarks.bench_asgi --pollers 1000 --polls 5 --threads 32 --store-latency-ms 0 5
+"""
+import argparse
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fs_backend.settings")
+
+import django
+
+django.setup()
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.models import write_data
+from hairstyle_creation.stores.file_store import FileEventStore
+
+PATH = "/hair_try_on/rendering/results/new/"
+
+
+class SlowFileEventStore(FileEventStore):
+    """The file store on a disk that takes `latency` seconds to answer every read."""
+
+    def __init__(self, *args, latency: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+
+    def get(self, eventid):
+        time.sleep(self.latency)
+        return super().get(eventid)
+
+    def stamp(self, eventid):
+        time.sleep(self.latency)
+        return super().stamp(eventid)
+
+
+def wsgi_environ(eventid: str) -> dict:
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": PATH,
+        "QUERY_STRING": f"eventid={eventid}",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": "localhost",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def asgi_scope(eventid: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": PATH,
+        "raw_path": PATH.encode(),
+        "query_string": f"eventid={eventid}".encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+
+
+async def poll_wsgi(application, pool: ThreadPoolExecutor, eventid: str) -> int:
+    def call() -> int:
+        statuses = []
+        body = b"".join(application(wsgi_environ(eventid), lambda status, headers: statuses.append(status)))
+        return int(statuses[0].split()[0]) if body is not None else 500
+
+    return await asyncio.get_running_loop().run_in_executor(pool, call)
+
+
+async def poll_asgi(application, eventid: str) -> int:
+    messages = []
+    requested = False
+
+    async def receive() -> dict:
+        nonlocal requested
+        if requested:
+            # The client stays connected until the response is sent, after which Django stops listening
+            await asyncio.Future()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    await application(asgi_scope(eventid), receive, send)
+    return messages[0]["status"]
+
+
+async def run_pollers(mode: str, eventids: list[str], polls: int, threads: int) -> tuple[list[float], float]:
+    latencies: list[float] = []
+
+    if mode == "wsgi":
+        application = get_wsgi_application()
+        pool = ThreadPoolExecutor(max_workers=threads)
+        poll = lambda eventid: poll_wsgi(application, pool, eventid)
+    else:
+        application = get_asgi_application()
+        poll = lambda eventid: poll_asgi(application, eventid)
+
+    async def poller(eventid: str) -> None:
+        for _ in range(polls):
+            start = time.perf_counter()
+            status = await poll(eventid)
+            latencies.append(time.perf_counter() - start)
+            assert status == 200, status
+
+    start = time.perf_counter()
+    await asyncio.gather(*(poller(eventid) for eventid in eventids))
+    elapsed = time.perf_counter() - start
+
+    if mode == "wsgi":
+        pool.shutdown()
+    return latencies, elapsed
+
+
+def run(mode: str, pollers: int, polls: int, threads: int, latency: float, cache: bool) -> dict[str, float]:
+    directory = tempfile.mkdtemp(prefix="bench-asgi-")
+    try:
+        event_store = {
+            "BACKEND": "benchmarks.bench_asgi.SlowFileEventStore",
+            "OPTIONS": {"directory": directory, "latency": latency},
+        }
+        if cache:
+            event_store["CACHE"] = {"MAX_ENTRIES": pollers, "TTL": 60.0}
+
+        with override_settings(EVENT_STORE=event_store, ACCOUNT_INDEX_PATH=f"{directory}/accounts.sqlite3", DEBUG=False):
+            eventids = []
+            for _ in range(pollers):
+                event = make_event(account_identifier="")
+                write_data(event)
+                eventids.append(event.eventid)
+
+            latencies, elapsed = asyncio.run(run_pollers(mode, eventids, polls, threads))
+
+        latencies.sort()
+        return {
+            "rps": len(latencies) / elapsed,
+            "p50_ms": latencies[len(latencies) // 2] * 1e3,
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=1000, help="Clients polling at once, each for its own event")
+    parser.add_argument("--polls", type=int, default=5, help="Polls per client")
+    parser.add_argument("--threads", type=int, default=32, help="Threads of the WSGI server")
+    parser.add_argument("--store-latency-ms", type=float, nargs="+", default=[0.0, 5.0], help="Simulated latency of one store read")
+    parser.add_argument("--cache", action="store_true", help="Put the in-memory event cache in front of the store")
+    args = parser.parse_args()
+
+    print(f"{'latency ms':>10}  {'mode':<6}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for latency_ms in args.store_latency_ms:
+        for mode in ("wsgi", "asgi"):
+            result = run(mode, args.pollers, args.polls, args.threads, latency_ms / 1e3, args.cache)
+            print(f"{latency_ms:>10.1f}  {mode:<6}{result['rps']:>10.0f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the JSON and binary event codecs over a corpus of events at every stage of their life.
+
+Usage:
+    python -m benchmarks.bench_event_codec --events 1000 --max-blends 12
+"""
+import argparse
+import random
+import time
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.codec import CODECS, decode_event
+
+
+def make_corpus(events: int, max_blends: int, seed: int) -> list[HairstyleChangeEvent]:
+    """
+    Builds events the way production holds them: just created, waiting on the embedding,
+    waiting on some of the blends, and finished.
+    """
+    rng = random.Random(seed)
+    corpus = []
+
+    for _ in range(events):
+        event = make_event(blends=rng.randint(1, max_blends))
+        stage = rng.random()
+
+        if stage < 0.1:
+            event.uploaded_picture = event.hairstyles = event.embedding_inference = event.blend_inferences = None
+            event.uploaded_picture_timestamp = event.picked_hairstyles_timestamp = None
+        elif stage < 0.3:
+            event.embedding_inference.result = event.embedding_inference.finished_timestamp = None
+            event.hairstyles = event.blend_inferences = event.picked_hairstyles_timestamp = None
+        elif stage < 0.5:
+            for blend_inference in event.blend_inferences[rng.randint(0, len(event.blend_inferences)):]:
+                blend_inference.result = blend_inference.finished_timestamp = None
+
+        if stage < 0.5:
+            event.finished_timestamp = None
+        corpus.append(event)
+
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000)
+    parser.add_argument("--max-blends", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=5, help="Passes over the corpus, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.events, args.max_blends, args.seed)
+    results = {}
+
+    for name, codec in CODECS.items():
+        records = [codec.encode(event) for event in corpus]
+        assert [decode_event(raw) for raw in records] == corpus
+
+        encode_seconds = decode_seconds = float("inf")
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            for event in corpus:
+                codec.encode(event)
+            encode_seconds = min(encode_seconds, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for raw in records:
+                decode_event(raw)
+            decode_seconds = min(decode_seconds, time.perf_counter() - start)
+
+        results[name] = (
+            sum(len(raw) for raw in records) / len(records),
+            encode_seconds / len(corpus) * 1e6,
+            decode_seconds / len(corpus) * 1e6,
+        )
+
+    baseline = results["json"]
+    print(f"{'codec':<8}{'bytes':>10}{'smaller':>10}{'encode us':>12}{'speedup':>10}{'decode us':>12}{'speedup':>10}")
+    for name, (size, encode_us, decode_us) in results.items():
+        print(
+            f"{name:<8}{size:>10.0f}{baseline[0] / size:>9.2f}x"
+            f"{encode_us:>12.1f}{baseline[1] / encode_us:>9.2f}x"
+            f"{decode_us:>12.1f}{baseline[2] / decode_us:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
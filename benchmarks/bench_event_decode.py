@@ -0,0 +1,35 @@
+"""
+Compares loading stored events through Python dicts with validating them straight from the raw JSON.
+
+Usage:
+    python -m benchmarks.bench_event_decode --blends 10 25 50
+"""
+import argparse
+import json
+import timeit
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.models import HairstyleChangeEvent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blends", type=int, nargs="+", default=[10, 25, 50])
+    parser.add_argument("--number", type=int, default=2_000)
+    args = parser.parse_args()
+
+    print(f"{'blends':>8}{'bytes':>10}{'dict us':>12}{'raw us':>12}{'speedup':>10}")
+    for blends in args.blends:
+        raw = make_event(blends=blends).model_dump_json().encode()
+
+        # The previous load path: parse into dicts, then validate the dicts
+        dict_seconds = timeit.timeit(lambda: HairstyleChangeEvent(**json.loads(raw)), number=args.number)
+        raw_seconds = timeit.timeit(lambda: HairstyleChangeEvent.from_json(raw), number=args.number)
+
+        dict_us = dict_seconds / args.number * 1e6
+        raw_us = raw_seconds / args.number * 1e6
+        print(f"{blends:>8}{len(raw):>10}{dict_us:>12.1f}{raw_us:>12.1f}{dict_us / raw_us:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
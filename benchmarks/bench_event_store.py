@@ -0,0 +1,77 @@
+"""
+Compares the file and SQLite event stores as the number of stored events grows.
+
+Usage:
+    python -m benchmarks.bench_event_store --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.models import create_eventid
+from hairstyle_creation.stores.file_store import FileEventStore
+from hairstyle_creation.stores.sqlite_store import SQLiteEventStore
+
+STORES = {
+    "file": lambda directory: FileEventStore(directory=directory),
+    "sqlite": lambda directory: SQLiteEventStore(path=f"{directory}/events.sqlite3"),
+    "file-binary": lambda directory: FileEventStore(directory=directory, codec="binary"),
+    "sqlite-binary": lambda directory: SQLiteEventStore(path=f"{directory}/events.sqlite3", codec="binary"),
+}
+
+
+def run(store_name: str, size: int, samples: int) -> dict[str, float]:
+    directory = tempfile.mkdtemp(prefix=f"bench-{store_name}-")
+    try:
+        store = STORES[store_name](directory)
+        template = make_event()
+        eventids = []
+
+        start = time.perf_counter()
+        for _ in range(size):
+            event = template.model_copy()
+            event.eventid = create_eventid()
+            event.version = 0
+            store.put(event)
+            eventids.append(event.eventid)
+        put_seconds = time.perf_counter() - start
+
+        picked = random.sample(eventids, min(samples, size))
+
+        start = time.perf_counter()
+        loaded = [store.get(eventid) for eventid in picked]
+        get_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for event in loaded:
+            store.compare_and_swap(event, event.version)
+        cas_seconds = time.perf_counter() - start
+
+        return {
+            "put_us": put_seconds / size * 1e6,
+            "get_us": get_seconds / len(picked) * 1e6,
+            "cas_us": cas_seconds / len(picked) * 1e6,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--samples", type=int, default=2_000, help="Random reads and CAS writes per run")
+    parser.add_argument("--stores", nargs="+", default=list(STORES), choices=list(STORES))
+    args = parser.parse_args()
+
+    print(f"{'store':<16}{'events':>10}{'put us/op':>12}{'get us/op':>12}{'cas us/op':>12}")
+    for size in args.sizes:
+        for store_name in args.stores:
+            result = run(store_name, size, args.samples)
+            print(f"{store_name:<16}{size:>10}{result['put_us']:>12.1f}{result['get_us']:>12.1f}{result['cas_us']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
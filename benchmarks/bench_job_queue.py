@@ -0,0 +1,93 @@
+"""
+Compares enqueueing the blending jobs of a pick one message at a time and in one batch, on the local SQLite queue.
+
+The local queue has no network between the server and the queue, so --round-trip-ms adds
+the latency of one round trip to SQS to every send, which is what batching saves.
+
+Usage:
+    python -m benchmarks.bench_job_queue --styles 1 5 10 --picks 500 --round-trip-ms 0 5
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.models import InferenceJob
+from hairstyle_creation.queues.local import SQLiteJobQueue
+
+
+class RemoteJobQueue(SQLiteJobQueue):
+    """The local queue with the latency of a remote one."""
+
+    def __init__(self, *args, round_trip: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trip = round_trip
+
+    def _send_batch(self, messages: list[tuple[str, str]], delay: float) -> dict[str, str]:
+        time.sleep(self.round_trip)
+        return super()._send_batch(messages, delay)
+
+
+def make_messages(styles: int) -> list[tuple[str, str]]:
+    event = make_event(blends=styles)
+    embedding_result = event.embedding_inference.result
+
+    return [
+        (
+            blend_inference.inference_eventid,
+            InferenceJob(
+                inference_eventid=blend_inference.inference_eventid,
+                hairchange_eventid=event.eventid,
+                type="Blending",
+                embedded_file_location=embedding_result.embedded_file_location,
+                segmentation_file_location=embedding_result.segmentation_file_location,
+                hairstyle=blend_inference.hairstyle,
+            ).model_dump_json(),
+        )
+        for blend_inference in event.blend_inferences
+    ]
+
+
+def run(mode: str, styles: int, picks: int, round_trip: float) -> list[float]:
+    directory = tempfile.mkdtemp(prefix="bench-queue-")
+    try:
+        queue = RemoteJobQueue("blending", path=f"{directory}/queues.sqlite3", batch_size=10, round_trip=round_trip)
+        picks_messages = [make_messages(styles) for _ in range(picks)]
+
+        latencies = []
+        for messages in picks_messages:
+            start = time.perf_counter()
+            if mode == "batch":
+                queue.send_batch(messages)
+            else:
+                for message_id, body in messages:
+                    queue.send(message_id, body)
+            latencies.append(time.perf_counter() - start)
+
+        return latencies
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--styles", type=int, nargs="+", default=[1, 5, 10], help="Hairstyles picked at once")
+    parser.add_argument("--picks", type=int, default=500, help="Picks enqueued per run")
+    parser.add_argument("--round-trip-ms", type=float, nargs="+", default=[0.0, 5.0], help="Simulated latency of one send")
+    args = parser.parse_args()
+
+    print(f"{'rtt ms':>8}  {'mode':<10}{'styles':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for round_trip_ms in args.round_trip_ms:
+        for styles in args.styles:
+            for mode in ("single", "batch"):
+                latencies = sorted(run(mode, styles, args.picks, round_trip_ms / 1e3))
+                p50 = latencies[len(latencies) // 2] * 1e3
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3
+                mean = statistics.mean(latencies) * 1e3
+                print(f"{round_trip_ms:>8.1f}  {mode:<10}{styles:>8}{p50:>10.3f}{p99:>10.3f}{mean:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
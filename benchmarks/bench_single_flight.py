@@ -0,0 +1,77 @@
+"""
+Measures how much of a burst of concurrent reads of one event the single flight store absorbs.
+
+Every round, --readers threads read the same event at once, like the polls and worker callbacks that
+hit an event the moment it finishes. With coalescing, the reads that overlap share one load and each copy it.
+
+Usage:
+    python -m benchmarks.bench_single_flight --readers 1 8 32 --rounds 200
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import make_event
+from hairstyle_creation.stores.file_store import FileEventStore
+from hairstyle_creation.stores.single_flight import CoalescingEventStore
+
+
+def run(coalesce: bool, readers: int, rounds: int, blends: int) -> dict[str, float]:
+    directory = tempfile.mkdtemp(prefix="bench-single-flight-")
+    try:
+        store = FileEventStore(directory=directory)
+        if coalesce:
+            store = CoalescingEventStore(store)
+
+        event = make_event(blends=blends)
+        store.put(event)
+
+        latencies: list[float] = []
+        with ThreadPoolExecutor(max_workers=readers) as pool:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                barrier = threading.Barrier(readers)
+
+                def read() -> float:
+                    barrier.wait()
+                    read_start = time.perf_counter()
+                    store.get(event.eventid)
+                    return time.perf_counter() - read_start
+
+                latencies.extend(pool.map(lambda _: read(), range(readers)))
+            elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        stats = store.stats() if coalesce else {"loads": readers * rounds, "coalescing_ratio": 0.0}
+        return {
+            "reads_per_s": len(latencies) / elapsed,
+            "p99_us": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6,
+            "loads": stats["loads"],
+            "coalescing_ratio": stats["coalescing_ratio"],
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 8, 32], help="Concurrent reads of the event per round")
+    parser.add_argument("--rounds", type=int, default=200, help="Bursts of reads")
+    parser.add_argument("--blends", type=int, default=12, help="Finished blends in the event")
+    args = parser.parse_args()
+
+    print(f"{'readers':>8}  {'coalesce':<9}{'reads/s':>10}{'p99 us':>10}{'loads':>8}{'ratio':>8}")
+    for readers in args.readers:
+        for coalesce in (False, True):
+            result = run(coalesce, readers, args.rounds, args.blends)
+            print(
+                f"{readers:>8}  {str(coalesce):<9}{result['reads_per_s']:>10.0f}{result['p99_us']:>10.0f}"
+                f"{result['loads']:>8}{result['coalescing_ratio']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    EmbeddingInferenceResult,
+    Hairstyle,
+    HairstyleChangeEvent,
+    InferenceEvent,
+    UploadPicture,
+    create_eventid,
+)
+
+
+def make_event(blends: int = 6, account_identifier: str = "benchmark") -> HairstyleChangeEvent:
+    """
+    Builds a finished event shaped like the ones production writes.
+
+    Args:
+        blends (int): The number of picked hairstyles, each with a finished blend inference.
+        account_identifier (str): The account that owns the event.
+
+    Returns:
+        event (HairstyleChangeEvent): The finished event.
+    """
+    eventid = create_eventid()
+    bucket = f"s3://fusion-styles-inference/{eventid}"
+
+    embedding_inference = InferenceEvent(
+        inference_eventid=create_eventid(),
+        type="Embedding",
+        queue_timestamp=datetime.now(),
+    )
+    embedding_inference.set_result(EmbeddingInferenceResult(
+        inference_eventid=embedding_inference.inference_eventid,
+        hairchange_eventid=eventid,
+        embedded_file_location=f"{bucket}/embedding.npz",
+        segmentation_file_location=f"{bucket}/segmentation.png",
+        errored=False,
+    ))
+
+    hairstyles = [
+        Hairstyle(
+            hairstyle_id=i,
+            hairstyle_name=f"Preset hairstyle {i}",
+            color_id=i % 4,
+            color_name=["Black", "Brown", "Blonde", "Red"][i % 4],
+        )
+        for i in range(blends)
+    ]
+
+    blend_inferences = []
+    for hairstyle in hairstyles:
+        blend_inference = InferenceEvent(
+            inference_eventid=create_eventid(),
+            type="Blending",
+            hairstyle=hairstyle,
+            queue_timestamp=datetime.now(),
+        )
+        blend_inference.set_result(BlendInferenceResult(
+            inference_eventid=blend_inference.inference_eventid,
+            hairchange_eventid=eventid,
+            result_img_location=f"{bucket}/blend-{hairstyle.hairstyle_id}-{hairstyle.color_id}.png",
+            errored=False,
+        ))
+        blend_inferences.append(blend_inference)
+
+    return HairstyleChangeEvent(
+        eventid=eventid,
+        account_identifier=account_identifier,
+        uploaded_picture=UploadPicture(file_location=f"{bucket}/upload.jpg", bbox=(112, 64, 512, 512)),
+        hairstyles=hairstyles,
+        embedding_inference=embedding_inference,
+        blend_inferences=blend_inferences,
+        uploaded_picture_timestamp=datetime.now(),
+        picked_hairstyles_timestamp=datetime.now(),
+        finished_timestamp=datetime.now(),
+    )
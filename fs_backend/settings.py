@@ -122,3 +122,152 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Hairstyle change event storage
+# BACKEND is either hairstyle_creation.stores.file_store.FileEventStore (one JSON file per event)
+# or hairstyle_creation.stores.sqlite_store.SQLiteEventStore (one WAL database shared by all workers)
+# or hairstyle_creation.stores.log_store.EventLogStore (an append-only log of deltas per event plus snapshots)
+# CACHE keeps recently read events in memory, remove it to read every event from the store
+# COALESCE lets concurrent reads of the same event in a process share one load from the store
+
+EVENT_STORE = {
+    'BACKEND': 'hairstyle_creation.stores.file_store.FileEventStore',
+    'OPTIONS': {
+        'directory': BASE_DIR / 'database',
+        # Spreads events over hourly partition directories, see drop_event_partitions
+        'sharded': True,
+        # 'json' or 'binary' (about 4x smaller, slower to encode and decode), both are always readable
+        'codec': 'json',
+    },
+    'COALESCE': True,
+    'CACHE': {
+        'MAX_ENTRIES': 1024,
+        'TTL': 30.0,
+    },
+}
+
+# Sent as the X-Metrics-Token header by whatever scrapes /metrics/, which otherwise only staff users can read.
+# None leaves it to staff users alone
+METRICS_TOKEN = None
+
+# Index of event timeouts, shared by every worker on the machine
+DEADLINE_INDEX_PATH = BASE_DIR / 'database' / 'deadlines.sqlite3'
+
+# Index of every account's events for the history screen, see `python manage.py reindex_accounts`
+ACCOUNT_INDEX_PATH = BASE_DIR / 'database' / 'accounts.sqlite3'
+
+# Inference jobs for the GPU workers, one queue each for embedding and blending
+# BACKEND is either hairstyle_creation.queues.local.SQLiteJobQueue (a database shared by every process on the machine)
+# or hairstyle_creation.queues.sqs.SQSJobQueue (OPTIONS are queue_url, visibility_timeout and boto3 client options)
+JOB_QUEUES = {
+    'embedding': {
+        'BACKEND': 'hairstyle_creation.queues.local.SQLiteJobQueue',
+        'OPTIONS': {'name': 'embedding', 'path': BASE_DIR / 'database' / 'queues.sqlite3', 'visibility_timeout': 60.0},
+    },
+    'blending': {
+        'BACKEND': 'hairstyle_creation.queues.local.SQLiteJobQueue',
+        # Every blending job of a pick is sent in one round trip of up to batch_size jobs (at most 10 for SQS)
+        'OPTIONS': {'name': 'blending', 'path': BASE_DIR / 'database' / 'queues.sqlite3', 'visibility_timeout': 60.0, 'batch_size': 10},
+    },
+    # Blends of popular presets started before the user picked, see SPECULATIVE_BLENDING
+    'speculative': {
+        'BACKEND': 'hairstyle_creation.queues.local.SQLiteJobQueue',
+        'OPTIONS': {'name': 'speculative', 'path': BASE_DIR / 'database' / 'queues.sqlite3', 'visibility_timeout': 60.0, 'batch_size': 10},
+    },
+}
+
+# How workers take jobs off JOB_QUEUES: CLASSES in strict priority order, and within a class accounts take turns,
+# each earning QUANTUM GPU passes per turn (deficit round robin). PREFETCH jobs per class are received ahead to choose from
+JOB_SCHEDULER = {
+    'CLASSES': ['embedding', 'blending', 'speculative'],
+    'QUANTUM': 1,
+    'PREFETCH': 32,
+}
+
+# Inference jobs whose worker posted an errored result are queued again after a delay, chosen at random up to
+# BASE_DELAY seconds and doubled for every retry up to MAX_DELAY. After ATTEMPTS runs, or once a job was received
+# that often without an answer, it goes to the dead letters, see `python manage.py dead_letters`
+JOB_RETRIES = {
+    'ATTEMPTS': 5,
+    'BASE_DELAY': 2.0,
+    'MAX_DELAY': 300.0,
+}
+
+DEAD_LETTER_PATH = BASE_DIR / 'database' / 'dead_letters.sqlite3'
+
+# Workers lease the jobs they run and renew the lease every DURATION / 3 seconds. The jobs of leases that lapse,
+# because their worker died, are queued again by a reaper, either in a thread of every server process (IN_PROCESS)
+# or with `python manage.py reap_leases`. Keep DURATION well below the queues' visibility_timeout
+JOB_LEASES = {
+    'DURATION': 30.0,
+    'IN_PROCESS': False,
+    'INTERVAL': 5.0,
+}
+
+# Cancelled and timed out events withdraw their queued jobs and revoke the leases of running ones, whose workers
+# stop at their next heartbeat. GPU_SECONDS is how long a job of each type is taken to run until some have been
+# timed in this process, and is what the reclaimed GPU time in the "cancellation" metrics is estimated from
+JOB_CANCELLATION = {
+    'GPU_SECONDS': {'Embedding': 10.0, 'Blending': 5.0},
+}
+
+# Clients wait for their results with `rendering/wait/` (long polling) or `rendering/stream/` (server-sent events),
+# served from asgi.py. A request waits at most MAX_WAIT seconds, is woken by the results posted to its own process,
+# and looks at the store every RECHECK_INTERVAL seconds for results posted to the others
+RESULT_NOTIFICATIONS = {
+    'MAX_WAIT': 30.0,
+    'RECHECK_INTERVAL': 5.0,
+}
+
+# Finished embeddings keyed by the content hash and bbox of the uploaded picture, so repeat uploads
+# of the same photo skip the embedding pass. Remove it to embed every upload
+EMBEDDING_CACHE = {
+    'PATH': BASE_DIR / 'database' / 'embeddings.sqlite3',
+    'MAX_ENTRIES': 10_000,
+}
+
+# Finished blends keyed by the embedding and the hairstyle and color, so re-running a preset against the same
+# photo attaches the earlier image instead of queueing the blend. TTL is in seconds. Remove it to blend every pick
+BLEND_MEMO = {
+    'PATH': BASE_DIR / 'database' / 'blends.sqlite3',
+    'MAX_ENTRIES': 100_000,
+    'TTL': 7 * 24 * 3600,
+}
+
+# With ENABLED on, an event whose embedding finishes before the user picked starts blending the TOP_N most picked
+# presets (counted in PATH) on the speculative queue, and a pick takes over the blends it matches. Only done while
+# at most MAX_BACKLOG embedding and blending jobs wait and fewer than MAX_QUEUED speculative ones do
+SPECULATIVE_BLENDING = {
+    'ENABLED': False,
+    'PATH': BASE_DIR / 'database' / 'presets.sqlite3',
+    'TOP_N': 4,
+    'MAX_QUEUED': 16,
+    'MAX_BACKLOG': 0,
+}
+
+# COALESCE puts up to MAX_TARGETS hairstyles of a pick into one blending job, so a worker loads the embedding
+# once for all of them. Workers answer those jobs with one BlendJobResult, see inference_handler.post_blend_result
+BLEND_JOBS = {
+    'COALESCE': False,
+    'MAX_TARGETS': 8,
+}
+
+# Expires timed out events, either in a thread of every server process (IN_PROCESS)
+# or with `python manage.py sweep_timeouts`
+TIMEOUT_SWEEPER = {
+    'IN_PROCESS': False,
+    'INTERVAL': 5.0,
+}
+
+# Old events are moved out of EVENT_STORE into compressed segment files by `python manage.py archive_events`,
+# get_event still finds them there. Remove it to keep every event in the live store
+EVENT_ARCHIVE = {
+    'OPTIONS': {
+        'directory': BASE_DIR / 'database' / 'archive',
+        'segment_bytes': 64 * 1024 * 1024,
+        # Archived events are still read by get_event, and JSON reads faster. Once compressed, binary is only about 20% smaller
+        'codec': 'json',
+    },
+    'MAX_AGE_DAYS': 7,
+}
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class HairstyleCreationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hairstyle_creation'
+
+    def ready(self):
+        sweeper = getattr(settings, "TIMEOUT_SWEEPER", {})
+        
+        if sweeper.get("IN_PROCESS", False):
+            from hairstyle_creation.handlers.timeout_handler import TimeoutSweeper
+            TimeoutSweeper().start_thread(interval=sweeper.get("INTERVAL", 5.0))
+        
+        leases = getattr(settings, "JOB_LEASES", {})
+        
+        if leases.get("IN_PROCESS", False):
+            from hairstyle_creation.handlers.lease_handler import LeaseReaper
+            LeaseReaper().start_thread(interval=leases.get("INTERVAL", 5.0))
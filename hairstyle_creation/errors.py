@@ -5,4 +5,13 @@ class AlreadyExists(Exception):
     pass
 
 class EmbeddingNotFinished(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class VersionConflict(Exception):
+    pass
+
+class LeaseSuperseded(AlreadyExists):
+    pass
+
+class EventCancelled(Exception):
+    pass
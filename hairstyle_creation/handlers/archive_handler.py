@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import typing
+from typing import Optional
+
+from django.core.exceptions import ImproperlyConfigured
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import HairstyleChangeEvent, get_archive, get_store
+from hairstyle_creation.stores.archive import EventArchive
+from hairstyle_creation.stores.base import EventStore
+from hairstyle_creation.stores.layout import eventid_created
+
+_stats_lock = threading.Lock()
+_stats = {
+    "archived": 0,
+    # Written again between being archived and being removed, so left in the live store
+    "changed": 0,
+    "runs": 0,
+    "last_run_seconds": 0.0,
+}
+
+def _archive_stats() -> dict[str, typing.Any]:
+    with _stats_lock:
+        return dict(_stats)
+
+metrics.register("archive", _archive_stats)
+
+def is_archivable(event: HairstyleChangeEvent, cutoff: datetime, now: datetime) -> bool:
+    """
+    Whether an event is done with and old enough to leave the live store.
+
+    Args:
+        event (HairstyleChangeEvent): The event.
+        cutoff (datetime): Events started after this are kept.
+        now (datetime): The current time.
+
+    Returns:
+        bool: True if the event finished, errored or timed out, and started before the cutoff.
+    """
+    done = event.finished_timestamp is not None or event.errored or now > event.event_timeout
+    return done and event.start_timestamp <= cutoff
+
+def _move(events: list[HairstyleChangeEvent], store: EventStore, archive: EventArchive) -> int:
+    archive.append(events)
+
+    # Only removed once the archive has them, and only if nothing wrote them in the meantime
+    moved = 0
+    for event in events:
+        if store.delete(event.eventid, event.version):
+            moved += 1
+
+    with _stats_lock:
+        _stats["archived"] += moved
+        _stats["changed"] += len(events) - moved
+    return moved
+
+def archive_events(max_age: timedelta, now: Optional[datetime] = None, batch_size: int = 500) -> int:
+    """
+    Moves finished and timed out events older than `max_age` from the live store into the archive.
+
+    Args:
+        max_age (timedelta): How long events stay in the live store after they start.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+        batch_size (int): Events appended to the archive at a time.
+
+    Returns:
+        archived (int): The number of events moved.
+
+    Raises:
+        ImproperlyConfigured: If `settings.EVENT_ARCHIVE` is not set.
+    """
+    archive = get_archive()
+    if archive is None:
+        raise ImproperlyConfigured("EVENT_ARCHIVE is not configured")
+
+    started = time.perf_counter()
+    now = now or datetime.now()
+    cutoff = now - max_age
+
+    store = get_store()
+    # Reads skip the in-memory cache so old events do not push out the ones in use
+    backing_store = getattr(store, "store", store)
+
+    archived = 0
+    batch: list[HairstyleChangeEvent] = []
+
+    for eventid in store.iter_eventids():
+        # Event IDs start with their creation time, so most recent events are skipped without loading them
+        created = eventid_created(eventid)
+        if created is not None and created > cutoff:
+            continue
+
+        event = backing_store.get(eventid)
+        if event is None or not is_archivable(event, cutoff, now):
+            continue
+
+        batch.append(event)
+        if len(batch) >= batch_size:
+            archived += _move(batch, store, archive)
+            batch = []
+
+    if batch:
+        archived += _move(batch, store, archive)
+
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["last_run_seconds"] = time.perf_counter() - started
+
+    return archived
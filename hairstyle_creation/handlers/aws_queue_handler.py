@@ -1,14 +1,592 @@
 from datetime import datetime
+import random
+import threading
+import time
+import typing
+from typing import Optional
 
-from hairstyle_creation.models import HairstyleChangeEvent
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
 
+from hairstyle_creation import metrics
+from hairstyle_creation.errors import EventCancelled
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    BlendTarget,
+    DeadLetter,
+    EmbeddingInferenceResult,
+    HairstyleChangeEvent,
+    InferenceEvent,
+    InferenceJob,
+    after_write,
+    create_eventid,
+    update_event
+)
+from hairstyle_creation.queues.base import JobQueue, QueueMessage
+from hairstyle_creation.queues.scheduler import JobScheduler
+from hairstyle_creation.stores.dead_letters import DeadLetterStore
+
+# How many times an inference job is run before it goes to the dead letters, see `settings.JOB_RETRIES`
 ATTEMPTS = 5
+# Seconds before the first retry, doubled for every retry after it up to RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+# How many times sending jobs is tried before giving up on them
+SEND_ATTEMPTS = 5
+
+EMBEDDING_QUEUE = "embedding"
+BLENDING_QUEUE = "blending"
+# Blends started before the user picked, only run when nothing else is waiting
+SPECULATIVE_QUEUE = "speculative"
+
+_QUEUE_NAMES = {"Embedding": EMBEDDING_QUEUE, "Blending": BLENDING_QUEUE}
+
+_queues: dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+def _default_queue(name: str) -> dict[str, typing.Any]:
+    return {
+        "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+        "OPTIONS": {"name": name, "path": "database/queues.sqlite3"},
+    }
+
+def get_queue(name: str) -> JobQueue:
+    """
+    Returns a job queue configured by `settings.JOB_QUEUES`.
+
+    Args:
+        name (str): `EMBEDDING_QUEUE` or `BLENDING_QUEUE`.
+
+    Returns:
+        queue (JobQueue): The process wide queue, created on first use.
+    """
+    queue = _queues.get(name)
+
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(name)
+            if queue is None:
+                config = getattr(settings, "JOB_QUEUES", {}).get(name) or _default_queue(name)
+                backend = import_string(config["BACKEND"])
+                queue = backend(**config.get("OPTIONS", {}))
+                _queues[name] = queue
+
+    return queue
+
+_scheduler: Optional[JobScheduler] = None
+
+def get_scheduler() -> JobScheduler:
+    """
+    Returns the scheduler the GPU workers of this process take their jobs from, configured by `settings.JOB_SCHEDULER`.
+
+    Returns:
+        scheduler (JobScheduler): The process wide scheduler, created on first use.
+    """
+    global _scheduler
+
+    if _scheduler is None:
+        config = getattr(settings, "JOB_SCHEDULER", {})
+        # Embedding is on the critical path of every event, blending can wait, speculation only fills idle GPUs
+        classes = config.get("CLASSES", [EMBEDDING_QUEUE, BLENDING_QUEUE, SPECULATIVE_QUEUE])
+        queues = [(name, get_queue(name)) for name in classes]
+
+        with _queues_lock:
+            if _scheduler is None:
+                _scheduler = JobScheduler(
+                    queues,
+                    quantum=config.get("QUANTUM", 1),
+                    prefetch=config.get("PREFETCH", 32),
+                    # A job received that often was never answered, its workers crash or time out on it
+                    max_receives=_retry_config()["ATTEMPTS"],
+                    dead_letter=dead_letter_job,
+                )
+
+    return _scheduler
+
+DEFAULT_DEAD_LETTERS = "database/dead_letters.sqlite3"
+
+_dead_letters: Optional[DeadLetterStore] = None
+
+def get_dead_letters() -> DeadLetterStore:
+    """
+    Returns the store of jobs that ran out of attempts configured by `settings.DEAD_LETTER_PATH`.
+
+    Returns:
+        store (DeadLetterStore): The process wide store, created on first use.
+    """
+    global _dead_letters
+
+    if _dead_letters is None:
+        with _queues_lock:
+            if _dead_letters is None:
+                path = getattr(settings, "DEAD_LETTER_PATH", DEFAULT_DEAD_LETTERS)
+                _dead_letters = DeadLetterStore(path=str(path))
+
+    return _dead_letters
+
+def _reset_queues(setting: str, **kwargs: typing.Any) -> None:
+    global _scheduler, _dead_letters
+
+    if setting in ("JOB_QUEUES", "JOB_SCHEDULER", "JOB_RETRIES"):
+        with _queues_lock:
+            _queues.clear()
+            _scheduler = None
+    elif setting == "DEAD_LETTER_PATH":
+        _dead_letters = None
+
+setting_changed.connect(_reset_queues)
+
+def _queue_stats() -> dict[str, typing.Any]:
+    with _queues_lock:
+        queues = dict(_queues)
+
+    stats = {}
+    for name, queue in queues.items():
+        stats[name] = queue.stats()
+        try:
+            stats[name].update(queue.depth().model_dump())
+        except Exception as e:
+            stats[name]["depth_error"] = str(e)
+
+    return stats
+
+metrics.register("queues", _queue_stats)
+
+def _scheduler_stats() -> dict[str, typing.Any]:
+    scheduler = _scheduler
+    return scheduler.stats() if scheduler is not None else {}
+
+metrics.register("scheduler", _scheduler_stats)
+
+_retry_stats_lock = threading.Lock()
+_retry_stats = {
+    "retried": 0,
+    "dead_lettered": 0,
+    "replayed": 0,
+}
+
+def _count_retries(name: str, count: int) -> None:
+    with _retry_stats_lock:
+        _retry_stats[name] += count
+
+def _retries_stats() -> dict[str, typing.Any]:
+    with _retry_stats_lock:
+        return dict(_retry_stats)
+
+metrics.register("retries", _retries_stats)
+
+def _retry_config() -> dict[str, typing.Any]:
+    config = getattr(settings, "JOB_RETRIES", {})
+    return {
+        "ATTEMPTS": config.get("ATTEMPTS", ATTEMPTS),
+        "BASE_DELAY": config.get("BASE_DELAY", RETRY_BASE_DELAY),
+        "MAX_DELAY": config.get("MAX_DELAY", RETRY_MAX_DELAY),
+    }
+
+def retry_delay(attempt: int, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY) -> float:
+    """
+    Exponential backoff with full jitter, so jobs that failed together are not all retried together.
+
+    Args:
+        attempt (int): The attempt the job is sent for, 2 for the first retry.
+        base_delay (float): The longest delay of the first retry in seconds.
+        max_delay (float): The longest delay of any retry in seconds.
+
+    Returns:
+        delay (float): Seconds to wait before the job can be received, anywhere up to `base_delay * 2 ** (attempt - 2)`.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** max(0, attempt - 2)))
+
+def job_message_id(inference_eventid: str, attempt: int) -> str:
+    """
+    Args:
+        inference_eventid (str): The inference event ID, or the job ID of a coalesced blending job.
+        attempt (int): Which run of the job it is.
+
+    Returns:
+        message_id (str): The ID the job is queued with. Every retry gets its own, since it is sent
+            while the worker that failed still holds the message of the attempt before.
+    """
+    return inference_eventid if attempt <= 1 else f"{inference_eventid}-{attempt}"
+
+def send_jobs(name: str, jobs: list[InferenceJob], delay: float = 0.0) -> None:
+    """
+    Sends inference jobs to a queue in batches, sending only the jobs that failed again on every retry.
+
+    Args:
+        name (str): The queue to send to.
+        jobs (list[InferenceJob]): The jobs to send.
+        delay (float): Seconds before the jobs can be received.
+
+    Raises:
+        RuntimeError: If some of the jobs were still not sent after `SEND_ATTEMPTS` tries.
+    """
+    messages = [(job_message_id(job.inference_eventid, job.attempt), job.model_dump_json()) for job in jobs]
+
+    for attempt in range(SEND_ATTEMPTS):
+        result = get_queue(name).send_batch(messages, delay=delay)
+        if not result.failed:
+            return
+
+        messages = [message for message in messages if message[0] in result.failed]
+        if attempt < SEND_ATTEMPTS - 1:
+            # The local queue keys messages by their ID, so a retry of a send that did go through is ignored there
+            time.sleep(0.05 * 2 ** attempt)
+
+    raise RuntimeError(f"{len(messages)} jobs were not sent to the {name} queue: {next(iter(result.failed.values()))}")
+
+def _embedding_job(event: HairstyleChangeEvent) -> InferenceJob:
+    inference_event = event.embedding_inference
+
+    return InferenceJob(
+        inference_eventid=inference_event.inference_eventid,
+        hairchange_eventid=event.eventid,
+        type="Embedding",
+        attempt=inference_event.attempts,
+        account_identifier=event.account_identifier,
+        queue_timestamp=inference_event.queue_timestamp,
+        uploaded_picture=event.uploaded_picture,
+    )
+
+def add_to_embedding_queue(event: HairstyleChangeEvent, delay: float = 0.0) -> None:
+    inference_event = event.embedding_inference
+    inference_event.queue_timestamp = datetime.now()
+    inference_event.attempts += 1
+
+    job = _embedding_job(event)
+    # Inside update_event the job is only sent once the event that references it is written
+    after_write(lambda: send_jobs(EMBEDDING_QUEUE, [job], delay=delay))
+
+def _blend_job(event: HairstyleChangeEvent, blending_events: list[InferenceEvent]) -> InferenceJob:
+    embedding_result = event.embedding_inference.result
+
+    if len(blending_events) == 1 and blending_events[0].job_id is None:
+        return InferenceJob(
+            inference_eventid=blending_events[0].inference_eventid,
+            hairchange_eventid=event.eventid,
+            type="Blending",
+            attempt=blending_events[0].attempts,
+            account_identifier=event.account_identifier,
+            queue_timestamp=blending_events[0].queue_timestamp,
+            embedded_file_location=embedding_result.embedded_file_location,
+            segmentation_file_location=embedding_result.segmentation_file_location,
+            hairstyle=blending_events[0].hairstyle,
+        )
 
-def add_to_embedding_queue(event: HairstyleChangeEvent) -> None:
-    event.embedding_inference.queue_timestamp = datetime.now()
-    ...
+    return InferenceJob(
+        inference_eventid=blending_events[0].job_id,
+        hairchange_eventid=event.eventid,
+        type="Blending",
+        attempt=max(blending_event.attempts for blending_event in blending_events),
+        account_identifier=event.account_identifier,
+        queue_timestamp=blending_events[0].queue_timestamp,
+        embedded_file_location=embedding_result.embedded_file_location,
+        segmentation_file_location=embedding_result.segmentation_file_location,
+        targets=[
+            BlendTarget(inference_eventid=blending_event.inference_eventid, hairstyle=blending_event.hairstyle)
+            for blending_event in blending_events
+        ],
+    )
+
+def _job_groups(blending_events: list[InferenceEvent]) -> list[list[InferenceEvent]]:
+    # Blends that share a coalesced job are one job
+    groups: dict[str, list[InferenceEvent]] = {}
+    for blending_event in blending_events:
+        groups.setdefault(blending_event.job_id or blending_event.inference_eventid, []).append(blending_event)
+    return list(groups.values())
+
+def _send_blends(
+    event: HairstyleChangeEvent,
+    blending_events: list[InferenceEvent],
+    delay: float = 0.0,
+    name: str = BLENDING_QUEUE,
+    ) -> None:
+    config = getattr(settings, "BLEND_JOBS", {})
+    now = datetime.now()
+
+    for blending_event in blending_events:
+        blending_event.queue_timestamp = now
+        blending_event.attempts += 1
+        blending_event.speculative = name == SPECULATIVE_QUEUE
+
+    # Speculative blends are never coalesced, so the job of each one that is not picked can be cancelled on its own
+    if config.get("COALESCE", False) and name != SPECULATIVE_QUEUE:
+        # Each job carries up to MAX_TARGETS blends, so a worker loads the embedding once for all of them
+        max_targets = max(1, config.get("MAX_TARGETS", len(blending_events) or 1))
+        groups = [blending_events[start:start + max_targets] for start in range(0, len(blending_events), max_targets)]
+
+        for group in groups:
+            job_id = create_eventid()
+            for blending_event in group:
+                blending_event.job_id = job_id
+    else:
+        groups = [[blending_event] for blending_event in blending_events]
+        for blending_event in blending_events:
+            blending_event.job_id = None
+
+    jobs = [_blend_job(event, group) for group in groups]
+    if jobs:
+        after_write(lambda: send_jobs(name, jobs, delay=delay))
 
 def add_to_blending_queue(event: HairstyleChangeEvent) -> None:
-    for blending_event in event.blend_inferences:
-        blending_event.queue_timestamp = datetime.now()
-    ...
\ No newline at end of file
+    # Jobs that were sent before are not sent again, and blends that already have a result need none
+    unsent = [
+        blending_event for blending_event in event.blend_inferences
+        if blending_event.queue_timestamp is None and blending_event.result is None
+    ]
+    _send_blends(event, unsent)
+
+def add_to_speculative_queue(event: HairstyleChangeEvent, blending_events: list[InferenceEvent]) -> None:
+    """
+    Queues blends the user has not picked yet on the speculative queue, one job each.
+
+    Args:
+        event (HairstyleChangeEvent): The event, changed in place inside `update_event`.
+        blending_events (list[InferenceEvent]): The speculative blends.
+    """
+    _send_blends(event, blending_events, name=SPECULATIVE_QUEUE)
+
+def speculation_capacity(max_queued: int, max_backlog: int = 0) -> int:
+    """
+    How many speculative jobs can be queued without holding up real work.
+
+    Args:
+        max_queued (int): The most speculative jobs waiting at a time.
+        max_backlog (int): The most embedding and blending jobs waiting for speculation to go ahead.
+
+    Returns:
+        capacity (int): The number of speculative jobs that can be queued now, 0 while real work is waiting.
+    """
+    backlog = sum(get_queue(name).depth().visible for name in (EMBEDDING_QUEUE, BLENDING_QUEUE))
+    if backlog > max_backlog:
+        return 0
+
+    return max(0, max_queued - get_queue(SPECULATIVE_QUEUE).depth().visible)
+
+def _fail_inferences(
+    event: HairstyleChangeEvent,
+    failed: list[tuple[InferenceEvent, Optional[EmbeddingInferenceResult | BlendInferenceResult]]],
+    ) -> None:
+    for inference_event, result in failed:
+        if inference_event.result is not None:
+            continue
+
+        if result is None and inference_event.type == "Embedding":
+            result = EmbeddingInferenceResult(
+                inference_eventid=inference_event.inference_eventid,
+                hairchange_eventid=event.eventid,
+                embedded_file_location="",
+                segmentation_file_location="",
+                errored=True,
+            )
+        elif result is None:
+            result = BlendInferenceResult(
+                inference_eventid=inference_event.inference_eventid,
+                hairchange_eventid=event.eventid,
+                result_img_location="",
+                errored=True,
+            )
+        inference_event.set_result(result)
+
+        # Without an embedding nothing can be blended
+        if inference_event.type == "Embedding":
+            event.errored = True
+
+    if event.blend_inferences and all(blending_event.result is not None for blending_event in event.blend_inferences):
+        event.finished_timestamp = datetime.now()
+
+def _record_dead_letters(name: str, jobs: list[InferenceJob], reason: str) -> None:
+    store = get_dead_letters()
+    for job in jobs:
+        store.add(DeadLetter(
+            message_id=job_message_id(job.inference_eventid, job.attempt),
+            queue=name,
+            job=job,
+            reason=reason,
+            attempts=job.attempt,
+        ))
+
+    _count_retries("dead_lettered", len(jobs))
+    print(f"Gave up on {len(jobs)} {name} jobs: {reason}")
+
+def retry_inferences(
+    event: HairstyleChangeEvent,
+    failed: list[tuple[InferenceEvent, Optional[EmbeddingInferenceResult | BlendInferenceResult]]],
+    reason: str,
+    ) -> None:
+    """
+    Queues the jobs of failed inferences again after a backoff, and gives up on the ones that ran out of attempts.
+
+    Args:
+        event (HairstyleChangeEvent): The event, changed in place inside `update_event`.
+        failed (list[tuple[InferenceEvent, Optional[EmbeddingInferenceResult | BlendInferenceResult]]]):
+            The failed inferences of the event, with the errored result the worker posted if there is one.
+        reason (str): Why they failed, kept with the dead letters.
+
+    Inferences that ran out of attempts keep an errored result, their jobs go to the dead letters
+    and an event whose embedding failed is marked as errored. Nothing is retried for an event that
+    has errored or was cancelled already.
+    """
+    if event.errored:
+        return
+
+    config = _retry_config()
+
+    retried = [
+        inference_event for inference_event, _ in failed
+        if inference_event.result is None and _counted_attempts(inference_event) < config["ATTEMPTS"]
+    ]
+    exhausted = [
+        (inference_event, result) for inference_event, result in failed
+        if inference_event.result is None and _counted_attempts(inference_event) >= config["ATTEMPTS"]
+    ]
+
+    if retried:
+        # A result still posted under the lease of the failed run is discarded
+        for inference_event in retried:
+            inference_event.lease_id = None
+
+        attempt = max(_counted_attempts(inference_event) for inference_event in retried) + 1
+        delay = retry_delay(attempt, config["BASE_DELAY"], config["MAX_DELAY"])
+
+        if any(inference_event.type == "Embedding" for inference_event in retried):
+            add_to_embedding_queue(event, delay=delay)
+        _send_blends(event, [inference_event for inference_event in retried if inference_event.type == "Blending"], delay=delay)
+        after_write(lambda: _count_retries("retried", len(retried)))
+
+    if exhausted:
+        embedding = [inference_event for inference_event, _ in exhausted if inference_event.type == "Embedding"]
+        blends = [inference_event for inference_event, _ in exhausted if inference_event.type == "Blending"]
+
+        # The jobs are built before the results are set, as they were last sent
+        if embedding:
+            after_write(lambda job=_embedding_job(event): _record_dead_letters(EMBEDDING_QUEUE, [job], reason))
+        if blends:
+            jobs = [_blend_job(event, group) for group in _job_groups(blends)]
+            after_write(lambda: _record_dead_letters(BLENDING_QUEUE, jobs, reason))
+
+        _fail_inferences(event, exhausted)
+
+def _counted_attempts(inference_event: InferenceEvent) -> int:
+    return inference_event.attempts - inference_event.uncounted_attempts
+
+def job_inferences(event: HairstyleChangeEvent, job: InferenceJob) -> list[InferenceEvent]:
+    """
+    Args:
+        event (HairstyleChangeEvent): The event of the job.
+        job (InferenceJob): A queued job.
+
+    Returns:
+        inference_events (list[InferenceEvent]): The inferences of the event the job runs.
+    """
+    inference_eventids = {target.inference_eventid for target in job.targets} if job.targets else {job.inference_eventid}
+    inference_events = [event.embedding_inference] + (event.blend_inferences or []) + (event.speculative_inferences or [])
+    return [
+        inference_event for inference_event in inference_events
+        if inference_event is not None and inference_event.inference_eventid in inference_eventids
+    ]
+
+def dead_letter_job(name: str, message: QueueMessage, job: InferenceJob) -> None:
+    """
+    Gives up on a job that was received too many times without being answered, see `JobScheduler`.
+
+    Args:
+        name (str): The queue the job came from.
+        message (QueueMessage): The message of the job.
+        job (InferenceJob): The job.
+
+    Raises:
+        Exception: If the job could not be kept with the dead letters, so it must stay on its queue.
+    """
+    reason = f"Received {message.receive_count} times without an answer"
+    _record_dead_letters(name, [job], reason)
+
+    def fail(event: HairstyleChangeEvent) -> None:
+        _fail_inferences(event, [(inference_event, None) for inference_event in job_inferences(event, job)])
+
+    try:
+        update_event(job.hairchange_eventid, fail)
+    except Exception as e:
+        # The event expired or is gone, so there is nothing left to mark
+        print(f"Could not mark the inferences of job {message.message_id} as errored: {e}")
+
+def replay_dead_letter(message_id: str) -> bool:
+    """
+    Runs a job from the dead letters again, with a fresh attempt budget.
+
+    Args:
+        message_id (str): The ID the job was queued with.
+
+    Returns:
+        bool: False if there is no dead letter with that ID.
+
+    Raises:
+        KeyError: If the event no longer has the inferences of the job.
+        EventCancelled: If the event was cancelled.
+        TimeoutError: If the event has timed out.
+
+    The replayed job is queued as the next attempt, so a late delivery of an earlier run is still told
+    apart from it, and only the attempts made from now on count against the budget.
+    """
+    store = get_dead_letters()
+    letter = store.get(message_id)
+    if letter is None:
+        return False
+
+    job = letter.job
+
+    def reset(event: HairstyleChangeEvent) -> None:
+        # Errored events are read past their timeout, but the user gave up on these ones
+        if event.cancelled_timestamp is not None:
+            raise EventCancelled(f"Event {event.eventid} was cancelled")
+        if datetime.now() > event.event_timeout:
+            raise TimeoutError("Event has timed out")
+
+        inference_events = job_inferences(event, job)
+        if not inference_events:
+            raise KeyError(f"Event {event.eventid} has no inferences of job {message_id}")
+
+        for inference_event in inference_events:
+            inference_event.result = None
+            inference_event.result_version = None
+            inference_event.finished_timestamp = None
+            inference_event.uncounted_attempts = inference_event.attempts
+            inference_event.job_id = None
+            inference_event.lease_id = None
+
+        event.errored = False
+        event.finished_timestamp = None
+
+        if job.type == "Embedding":
+            add_to_embedding_queue(event)
+        else:
+            _send_blends(event, inference_events)
+
+        after_write(lambda: store.remove(message_id))
+        after_write(lambda: _count_retries("replayed", 1))
+
+    update_event(job.hairchange_eventid, reset)
+    return True
+
+def remove_from_queue(inference_events: list[InferenceEvent]) -> int:
+    """
+    Discards the queued jobs of inferences that are no longer needed, where the queue allows it.
+
+    Args:
+        inference_events (list[InferenceEvent]): The inferences whose jobs to discard.
+
+    Returns:
+        discarded (int): The number of queued jobs removed, see `JobQueue.discard`.
+    """
+    message_ids: dict[str, list[str]] = {}
+    for inference_event in inference_events:
+        # Blends that share a coalesced job are queued as that one job
+        queued_id = job_message_id(inference_event.job_id or inference_event.inference_eventid, inference_event.attempts)
+        name = SPECULATIVE_QUEUE if inference_event.speculative else _QUEUE_NAMES[inference_event.type]
+        ids = message_ids.setdefault(name, [])
+        if queued_id not in ids:
+            ids.append(queued_id)
+
+    return sum(get_queue(name).discard(ids) for name, ids in message_ids.items())
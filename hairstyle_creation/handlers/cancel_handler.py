@@ -0,0 +1,181 @@
+from datetime import datetime
+import threading
+import typing
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import HairstyleChangeEvent, InferenceEvent, update_event
+from hairstyle_creation.handlers.aws_queue_handler import remove_from_queue
+from hairstyle_creation.handlers.lease_handler import get_lease_index
+from hairstyle_creation.notifications import get_notifier
+
+# Seconds a job of each type is taken to run until some have been timed, see `settings.JOB_CANCELLATION`
+GPU_SECONDS = {"Embedding": 10.0, "Blending": 5.0}
+
+# Weight of the latest timed job in the running average of its type
+RUN_SMOOTHING = 0.1
+
+_stats_lock = threading.Lock()
+_stats = {
+    "cancelled": 0,
+    "skipped": 0,
+    "discarded_jobs": 0,
+    "aborted_jobs": 0,
+    "reclaimed_gpu_seconds": 0.0,
+}
+
+# Running average of how long the jobs of each type took, timed from their lease to their result
+_run_seconds: dict[str, float] = {}
+
+def _cancellation_stats() -> dict[str, typing.Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["gpu_seconds"] = {job_type: gpu_seconds(job_type) for job_type in GPU_SECONDS}
+        return stats
+
+metrics.register("cancellation", _cancellation_stats)
+
+def gpu_seconds(job_type: str) -> float:
+    """
+    Args:
+        job_type (str): "Embedding" or "Blending".
+
+    Returns:
+        seconds (float): How long a job of the type runs on a GPU, as timed in this process
+            or from `settings.JOB_CANCELLATION` before any was.
+    """
+    if job_type in _run_seconds:
+        return _run_seconds[job_type]
+
+    configured = getattr(settings, "JOB_CANCELLATION", {}).get("GPU_SECONDS", GPU_SECONDS)
+    return configured.get(job_type, GPU_SECONDS[job_type])
+
+def record_runs(inference_events: list[InferenceEvent], now: Optional[datetime] = None) -> None:
+    """
+    Times the jobs whose results were just written, from when their lease was taken.
+
+    Args:
+        inference_events (list[InferenceEvent]): Inferences that got their results, those run without a lease are skipped.
+        now (Optional[datetime]): When the results came, defaults to `datetime.now()`.
+
+    Blends of one coalesced job share a lease, so each is taken to have used an equal part of its time.
+    """
+    now = now or datetime.now()
+
+    leases: dict[str, list[InferenceEvent]] = {}
+    for inference_event in inference_events:
+        if inference_event.lease_id is not None and inference_event.lease_timestamp is not None:
+            leases.setdefault(inference_event.lease_id, []).append(inference_event)
+
+    with _stats_lock:
+        for leased in leases.values():
+            seconds = max(0.0, (now - leased[0].lease_timestamp).total_seconds()) / len(leased)
+            for inference_event in leased:
+                previous = _run_seconds.get(inference_event.type)
+                _run_seconds[inference_event.type] = (
+                    seconds if previous is None else previous + RUN_SMOOTHING * (seconds - previous)
+                )
+
+def pending_inferences(event: HairstyleChangeEvent) -> list[InferenceEvent]:
+    """
+    Args:
+        event (HairstyleChangeEvent): The event.
+
+    Returns:
+        inference_events (list[InferenceEvent]): The inferences of the event that have no result yet, speculative ones included.
+    """
+    inference_events = [event.embedding_inference] + (event.blend_inferences or []) + (event.speculative_inferences or [])
+    return [
+        inference_event for inference_event in inference_events
+        if inference_event is not None and inference_event.result is None
+    ]
+
+def release_inferences(inference_events: list[InferenceEvent], now: Optional[datetime] = None) -> float:
+    """
+    Withdraws the jobs of inferences whose event was cancelled or timed out.
+
+    Queued jobs are discarded, and the leases of running ones are revoked so their workers find
+    the lease lost at the next heartbeat and stop. Call it once the event is written as errored,
+    so a worker receiving a job that could not be discarded gets no lease for it either.
+
+    Args:
+        inference_events (list[InferenceEvent]): The inferences without a result, see `pending_inferences`.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+
+    Returns:
+        reclaimed (float): The GPU seconds the withdrawn jobs would have run for, estimated with `gpu_seconds`.
+    """
+    now = now or datetime.now()
+    index = get_lease_index()
+
+    discarded = remove_from_queue(inference_events)
+
+    running = set()
+    for lease_id in {inference_event.lease_id for inference_event in inference_events if inference_event.lease_id is not None}:
+        # Leases that lapsed but were not reaped yet are taken as running too, the reaper would requeue nothing for them
+        if index.deadline(lease_id) is not None:
+            index.remove(lease_id)
+            running.add(lease_id)
+
+    reclaimed = 0.0
+    for inference_event in inference_events:
+        expected = gpu_seconds(inference_event.type)
+        # A running job only gives back what it had left to run
+        if inference_event.lease_id in running and inference_event.lease_timestamp is not None:
+            expected = max(0.0, expected - (now - inference_event.lease_timestamp).total_seconds())
+        reclaimed += expected
+
+    with _stats_lock:
+        _stats["discarded_jobs"] += discarded
+        _stats["aborted_jobs"] += len(running)
+        _stats["reclaimed_gpu_seconds"] += reclaimed
+
+    return reclaimed
+
+def cancel_event(eventid: str, account_identifier: Optional[str] = None, now: Optional[datetime] = None) -> bool:
+    """
+    Cancels an event the user abandoned, marking it as errored and withdrawing its inference jobs.
+
+    Args:
+        eventid (str): The ID of the event.
+        account_identifier (Optional[str]): The account the event must belong to, None to skip the check.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+
+    Returns:
+        bool: True if the event was cancelled, False if it had already finished, errored or been cancelled.
+
+    Raises:
+        Exception: If the event does not exist.
+        PermissionError: If the event belongs to another account.
+    """
+    now = now or datetime.now()
+
+    def mark_cancelled(event: HairstyleChangeEvent) -> Optional[list[InferenceEvent]]:
+        if event.errored or event.finished_timestamp is not None:
+            return None
+
+        event.errored = True
+        event.cancelled_timestamp = now
+        return pending_inferences(event)
+
+    # A timed out event is cancelled all the same, the sweeper skips it then
+    pending = update_event(eventid, mark_cancelled, account_identifier, check_timeout=False)
+    if pending is None:
+        with _stats_lock:
+            _stats["skipped"] += 1
+        return False
+
+    # Only released once the event is written, so a lost write race can not release them twice
+    release_inferences(pending, now)
+    get_notifier().publish(eventid)
+
+    with _stats_lock:
+        _stats["cancelled"] += 1
+
+    return True
+
+# For views served from asgi.py, the cancel writes the event and the queues so it runs in a thread of the shared pool
+acancel_event = sync_to_async(cancel_event, thread_sensitive=False)
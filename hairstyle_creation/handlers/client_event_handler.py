@@ -1,6 +1,11 @@
+import asyncio
+from contextlib import aclosing
 from datetime import datetime
 import typing
-from typing import Optional
+from typing import AsyncIterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 
 from hairstyle_creation.errors import AlreadyExists, EmbeddingNotFinished
 from hairstyle_creation.models import (
@@ -8,14 +13,32 @@ from hairstyle_creation.models import (
     Hairstyle,
     HairstyleChangeEvent,
     BlendInferenceResult,
+    EventSummary,
+    after_write,
+    aget_event,
     create_eventid,
     write_data,
-    get_event
+    get_account_index,
+    get_event,
+    update_event
 )
 from hairstyle_creation.handlers.inference_handler import (
+    get_preset_popularity,
     start_embedding_inference,
     start_blending_inference
 )
+from hairstyle_creation.handlers.timeout_handler import schedule_timeout
+from hairstyle_creation.notifications import get_notifier
+
+# The most events one page of the history returns
+MAX_HISTORY_PAGE = 100
+
+# Statuses after which the results of an event do not change any more
+FINAL_STATUSES = ("finished", "errored", "cancelled")
+
+# The longest a request waits for results, and how often it looks at the store meanwhile, see `settings.RESULT_NOTIFICATIONS`
+MAX_WAIT = 30.0
+RECHECK_INTERVAL = 5.0
 
 def create_new_hairstyle_event(
     account_identifier: str,
@@ -42,6 +65,9 @@ def create_new_hairstyle_event(
     # Uploads the event to the database
     write_data(event)
     
+    # So the event is cleaned up if the user abandons it
+    schedule_timeout(event)
+    
     return eventid
 
 
@@ -60,11 +86,6 @@ def add_hairstyles(account_identifier: str, eventid: str, hairstyles_dict: list[
     Raises:
         Exception: If the account does not have an event with the provided eventid.
     """
-    event = get_event(eventid, account_identifier)
-    
-    if event.picked_hairstyles_timestamp is not None:
-        return AlreadyExists("Already picked hairstyles for this event")
-    
     hairstyles: list[Hairstyle] = []
     
     for style_dict in hairstyles_dict:
@@ -72,17 +93,33 @@ def add_hairstyles(account_identifier: str, eventid: str, hairstyles_dict: list[
         assert hairstyle not in hairstyles
         hairstyles.append(hairstyle)
     
-    event.hairstyles = hairstyles
-    event.picked_hairstyles_timestamp = datetime.now()
+    def pick_hairstyles(event: HairstyleChangeEvent) -> None:
+        if event.picked_hairstyles_timestamp is not None:
+            raise AlreadyExists("Already picked hairstyles for this event")
+        
+        event.hairstyles = hairstyles
+        event.picked_hairstyles_timestamp = datetime.now()
+        
+        # Blends attached from the memo can finish the event right away
+        after_write(lambda: get_notifier().publish(event.eventid))
+        
+        # Decides which presets are blended speculatively for the next users
+        popularity = get_preset_popularity()
+        if popularity is not None:
+            after_write(lambda: popularity.record(hairstyles))
+        
+        # Starts the blending inference if embedding has finished
+        # If embedding has not finished then blending will start automatically when embedding is finished
+        try:
+            start_blending_inference(event)
+        except (EmbeddingNotFinished, ValueError):
+            pass
     
-    # Starts the blending inference if embedding has finished
-    # If embedding has not finished then blending will start automatically when embedding is finished
+    # The embedding result can be posted at the same time, so this retries instead of overwriting it
     try:
-        start_blending_inference(event)
-    except EmbeddingNotFinished:
-        pass
-    finally:
-        write_data(event)
+        update_event(eventid, pick_hairstyles, account_identifier)
+    except AlreadyExists as e:
+        return e
    
  
 def add_uploaded_picture(account_identifier: str, eventid: str, picture: dict[str, typing.Any]) -> Optional[Exception]:
@@ -100,18 +137,22 @@ def add_uploaded_picture(account_identifier: str, eventid: str, picture: dict[st
     Raises:
         Exception: If the account does not have an event with the provided eventid.
     """
-    event = get_event(eventid, account_identifier)
+    uploaded_picture = UploadPicture(**picture)
     
-    if event.uploaded_picture_timestamp is not None:
-        return AlreadyExists("Already uploaded a picture for this event")
-    
-    event.uploaded_picture = UploadPicture(**picture)
-    event.uploaded_picture_timestamp = datetime.now()
-    
-    # Starts the embedding event immediately the picture is uploaded to reduce customer waiting time
-    start_embedding_inference(event)
+    def upload_picture(event: HairstyleChangeEvent) -> None:
+        if event.uploaded_picture_timestamp is not None:
+            raise AlreadyExists("Already uploaded a picture for this event")
+        
+        event.uploaded_picture = uploaded_picture
+        event.uploaded_picture_timestamp = datetime.now()
+        
+        # Starts the embedding event immediately the picture is uploaded to reduce customer waiting time
+        start_embedding_inference(event)
     
-    write_data(event)
+    try:
+        update_event(eventid, upload_picture, account_identifier)
+    except AlreadyExists as e:
+        return e
     
 
 def get_results(account_identifier: str, eventid: str) -> list[BlendInferenceResult] | None:
@@ -127,6 +168,24 @@ def get_results(account_identifier: str, eventid: str) -> list[BlendInferenceRes
     """
     event = get_event(eventid, account_identifier)
     
+    return _finished_results(event)
+
+async def aget_results(account_identifier: str, eventid: str) -> list[BlendInferenceResult] | None:
+    """
+    The async `get_results`, for views served from asgi.py.
+
+    Args:
+        account_identifier (str): The identifier of the account associated with the change event.
+        eventid (str): The unique identifier of the change event.
+
+    Returns:
+        list[BlendInferenceResult] | None: The list of hair inference results for the event, or None if the event is not finished.
+    """
+    event = await aget_event(eventid, account_identifier)
+    
+    return _finished_results(event)
+
+def _finished_results(event: HairstyleChangeEvent) -> list[BlendInferenceResult] | None:
     # If it has not started, return False
     if (event.start_timestamp is None or
         event.uploaded_picture is None or
@@ -154,3 +213,189 @@ def get_results(account_identifier: str, eventid: str) -> list[BlendInferenceRes
     return blend_results
 
 
+def get_history(
+    account_identifier: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    ) -> tuple[list[EventSummary], Optional[str]]:
+    """
+    Lists an account's events, newest first, one page at a time.
+
+    Args:
+        account_identifier (str): The identifier of the account.
+        limit (int): The most events to return, capped at `MAX_HISTORY_PAGE`.
+        cursor (Optional[str]): The `next_cursor` of the previous page, None for the first page.
+
+    Returns:
+        summaries (list[EventSummary]): The summaries of the events on the page.
+        next_cursor (Optional[str]): Fetches the next page, None if this is the last page.
+
+    Raises:
+        ValueError: If the limit is not positive or the cursor is malformed.
+
+    The summaries come from the account index, the events themselves are not loaded.
+    """
+    if limit < 1:
+        raise ValueError("The limit must be positive")
+    
+    return get_account_index().page(account_identifier, min(limit, MAX_HISTORY_PAGE), cursor)
+
+
+def get_new_results(
+    account_identifier: str,
+    eventid: str,
+    cursor: Optional[int] = None,
+    ) -> tuple[str, list[BlendInferenceResult], int]:
+    """
+    Get the blend results of an event as they come in, instead of all of them once the last one is in.
+
+    Args:
+        account_identifier (str): The identifier of the account associated with the change event.
+        eventid (str): The unique identifier of the change event.
+        cursor (Optional[int]): The `next_cursor` of the previous call, None for every result so far.
+
+    Returns:
+        status (str): The status of the event, see `EventSummary.status`. Results stop coming once it is
+            finished, errored or cancelled.
+        results (list[BlendInferenceResult]): The results written since the cursor, in the order they were written.
+            A blend whose job was replayed from the dead letters comes again with its new result.
+        next_cursor (int): Passed with the next call to get only the results written after this one.
+
+    Raises:
+        Exception: If the account does not have an event with the provided eventid.
+    """
+    try:
+        event = get_event(eventid, account_identifier)
+    except TimeoutError:
+        # It was expired by the lookup, the blends that finished before still go out
+        event = get_event(eventid, account_identifier, check_timeout=False)
+    
+    return _new_results(event, cursor)
+
+async def aget_new_results(
+    account_identifier: str,
+    eventid: str,
+    cursor: Optional[int] = None,
+    ) -> tuple[str, list[BlendInferenceResult], int]:
+    """
+    The async `get_new_results`, for views served from asgi.py.
+
+    Args:
+        account_identifier (str): The identifier of the account associated with the change event.
+        eventid (str): The unique identifier of the change event.
+        cursor (Optional[int]): The `next_cursor` of the previous call, None for every result so far.
+
+    Returns:
+        status (str): The status of the event, see `EventSummary.status`.
+        results (list[BlendInferenceResult]): The results written since the cursor, in the order they were written.
+        next_cursor (int): Passed with the next call to get only the results written after this one.
+    """
+    try:
+        event = await aget_event(eventid, account_identifier)
+    except TimeoutError:
+        event = await aget_event(eventid, account_identifier, check_timeout=False)
+    
+    return _new_results(event, cursor)
+
+def _new_results(event: HairstyleChangeEvent, cursor: Optional[int]) -> tuple[str, list[BlendInferenceResult], int]:
+    # Results written before they were stamped count as written at the start
+    new = [
+        inference_event for inference_event in event.blend_inferences or []
+        if inference_event.result is not None and (cursor is None or (inference_event.result_version or 0) > cursor)
+    ]
+    new.sort(key=lambda inference_event: inference_event.result_version or 0)
+    
+    return EventSummary.from_event(event).status, [inference_event.result for inference_event in new], event.version
+
+
+def _notification_config() -> dict[str, float]:
+    config = getattr(settings, "RESULT_NOTIFICATIONS", {})
+    return {
+        "MAX_WAIT": config.get("MAX_WAIT", MAX_WAIT),
+        "RECHECK_INTERVAL": config.get("RECHECK_INTERVAL", RECHECK_INTERVAL),
+    }
+
+
+async def watch_results(
+    account_identifier: str,
+    eventid: str,
+    cursor: Optional[int] = None,
+    timeout: Optional[float] = None,
+    ) -> AsyncIterator[tuple[str, list[BlendInferenceResult], int]]:
+    """
+    Follows an event as its results come in, woken by the writes of this process instead of polling the store.
+
+    Args:
+        account_identifier (str): The identifier of the account associated with the change event.
+        eventid (str): The unique identifier of the change event.
+        cursor (Optional[int]): Where to start, see `get_new_results`.
+        timeout (Optional[float]): The most seconds to follow it, capped at and defaulting to `MAX_WAIT`.
+
+    Yields:
+        status (str): The status of the event, first as it is and then every time it or the results change.
+        results (list[BlendInferenceResult]): The results written since the last yield.
+        next_cursor (int): Where the next yield starts.
+
+    It stops once the event is finished, errored or cancelled, or the timeout passes. Results posted to
+    another process are seen when the store is looked at again, every `RECHECK_INTERVAL` seconds.
+
+    Raises:
+        Exception: If the account does not have an event with the provided eventid.
+    """
+    config = _notification_config()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(timeout if timeout is not None else config["MAX_WAIT"], config["MAX_WAIT"])
+    
+    # Subscribed before the event is read, so a write in between still wakes it
+    with get_notifier().subscribe(eventid) as subscription:
+        last_status = None
+        while True:
+            status, results, cursor = await aget_new_results(account_identifier, eventid, cursor)
+            if status != last_status or results:
+                last_status = status
+                yield status, results, cursor
+            
+            remaining = deadline - loop.time()
+            if status in FINAL_STATUSES or remaining <= 0:
+                return
+            
+            await subscription.wait(min(remaining, config["RECHECK_INTERVAL"]))
+
+
+async def wait_for_results(
+    account_identifier: str,
+    eventid: str,
+    cursor: Optional[int] = None,
+    timeout: Optional[float] = None,
+    ) -> tuple[str, list[BlendInferenceResult], int]:
+    """
+    Long polls for the next results of an event, see `watch_results`.
+
+    Args:
+        account_identifier (str): The identifier of the account associated with the change event.
+        eventid (str): The unique identifier of the change event.
+        cursor (Optional[int]): The `next_cursor` of the previous call, None for every result so far.
+        timeout (Optional[float]): The most seconds to wait, capped at and defaulting to `MAX_WAIT`.
+
+    Returns:
+        status (str): The status of the event.
+        results (list[BlendInferenceResult]): The results written since the cursor, returned as soon as there are any,
+            or once the event is finished, errored or cancelled, or the timeout passed.
+        next_cursor (int): Passed with the next call to wait for the results after these.
+    """
+    # Closed right away so it stops listening for the event
+    async with aclosing(watch_results(account_identifier, eventid, cursor, timeout)) as updates:
+        async for status, results, cursor in updates:
+            if results or status in FINAL_STATUSES:
+                break
+    
+    return status, results, cursor
+
+
+# The async versions of the handlers that write. Writing looks up caches and queues jobs, and stores only know
+# the stamp of a write in the thread that made it, so each runs whole in a thread of the pool shared by every request
+acreate_new_hairstyle_event = sync_to_async(create_new_hairstyle_event, thread_sensitive=False)
+aadd_hairstyles = sync_to_async(add_hairstyles, thread_sensitive=False)
+aadd_uploaded_picture = sync_to_async(add_uploaded_picture, thread_sensitive=False)
+# The account index is a SQLite database
+aget_history = sync_to_async(get_history, thread_sensitive=False)
@@ -1,18 +1,192 @@
 from datetime import datetime
+import threading
 import typing
 from typing import Optional
 
-from hairstyle_creation.errors import AlreadyExists, EmbeddingNotFinished
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from pydantic import ValidationError
+
+from hairstyle_creation import metrics
+from hairstyle_creation.errors import AlreadyExists, EmbeddingNotFinished, EventCancelled, LeaseSuperseded
 from hairstyle_creation.models import (
     HairstyleChangeEvent,
     InferenceEvent,
     EmbeddingInferenceResult,
     BlendInferenceResult,
+    BlendJobResult,
+    Hairstyle,
+    after_write,
     create_eventid,
-    write_data,
-    get_event
+    update_event
+)
+from hairstyle_creation.handlers.aws_queue_handler import (
+    add_to_blending_queue,
+    add_to_embedding_queue,
+    add_to_speculative_queue,
+    remove_from_queue,
+    retry_inferences,
+    speculation_capacity
 )
-from hairstyle_creation.handlers.aws_queue_handler import add_to_embedding_queue, add_to_blending_queue
+from hairstyle_creation.handlers.cancel_handler import record_runs
+from hairstyle_creation.handlers.lease_handler import is_superseded, release_lease
+from hairstyle_creation.notifications import get_notifier
+from hairstyle_creation.stores.blend_memo import BlendMemo
+from hairstyle_creation.stores.embedding_cache import EmbeddingCache, picture_key
+from hairstyle_creation.stores.preset_popularity import PresetPopularity
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_caches_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Returns the cache of finished embeddings configured by `settings.EMBEDDING_CACHE`.
+
+    Returns:
+        Optional[EmbeddingCache]: The process wide cache, created on first use, or None if it is not configured.
+    """
+    global _embedding_cache
+
+    config = getattr(settings, "EMBEDDING_CACHE", None)
+    if config is None:
+        return None
+
+    if _embedding_cache is None:
+        with _caches_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    path=str(config.get("PATH", "database/embeddings.sqlite3")),
+                    max_entries=config.get("MAX_ENTRIES", 10_000),
+                )
+
+    return _embedding_cache
+
+def _reset_embedding_cache(setting: str, **kwargs: typing.Any) -> None:
+    global _embedding_cache
+
+    if setting == "EMBEDDING_CACHE":
+        _embedding_cache = None
+
+setting_changed.connect(_reset_embedding_cache)
+
+def _embedding_cache_stats() -> dict[str, typing.Any]:
+    cache = _embedding_cache
+    return cache.stats() if cache is not None else {}
+
+metrics.register("embedding_cache", _embedding_cache_stats)
+
+_blend_memo: Optional[BlendMemo] = None
+
+def get_blend_memo() -> Optional[BlendMemo]:
+    """
+    Returns the memo of finished blends configured by `settings.BLEND_MEMO`.
+
+    Returns:
+        Optional[BlendMemo]: The process wide memo, created on first use, or None if it is not configured.
+    """
+    global _blend_memo
+
+    config = getattr(settings, "BLEND_MEMO", None)
+    if config is None:
+        return None
+
+    if _blend_memo is None:
+        with _caches_lock:
+            if _blend_memo is None:
+                _blend_memo = BlendMemo(
+                    path=str(config.get("PATH", "database/blends.sqlite3")),
+                    max_entries=config.get("MAX_ENTRIES", 100_000),
+                    ttl=config.get("TTL", 7 * 24 * 3600),
+                )
+
+    return _blend_memo
+
+def _reset_blend_memo(setting: str, **kwargs: typing.Any) -> None:
+    global _blend_memo
+
+    if setting == "BLEND_MEMO":
+        _blend_memo = None
+
+setting_changed.connect(_reset_blend_memo)
+
+def _blend_memo_stats() -> dict[str, typing.Any]:
+    memo = _blend_memo
+    return memo.stats() if memo is not None else {}
+
+metrics.register("blend_memo", _blend_memo_stats)
+
+_preset_popularity: Optional[PresetPopularity] = None
+
+def get_preset_popularity() -> Optional[PresetPopularity]:
+    """
+    Returns the pick counts of the presets configured by `settings.SPECULATIVE_BLENDING`.
+
+    Returns:
+        Optional[PresetPopularity]: The process wide pick counts, created on first use, or None if speculative blending is off.
+    """
+    global _preset_popularity
+
+    config = getattr(settings, "SPECULATIVE_BLENDING", None)
+    if not config or not config.get("ENABLED", False):
+        return None
+
+    if _preset_popularity is None:
+        with _caches_lock:
+            if _preset_popularity is None:
+                _preset_popularity = PresetPopularity(path=str(config.get("PATH", "database/presets.sqlite3")))
+
+    return _preset_popularity
+
+def _reset_preset_popularity(setting: str, **kwargs: typing.Any) -> None:
+    global _preset_popularity
+
+    if setting == "SPECULATIVE_BLENDING":
+        _preset_popularity = None
+
+setting_changed.connect(_reset_preset_popularity)
+
+_speculation_stats_lock = threading.Lock()
+_speculation_stats = {
+    "launched": 0,
+    "no_capacity": 0,
+    "adopted": 0,
+    "reused": 0,
+    "cancelled": 0,
+}
+
+def _count_speculation(name: str, count: int) -> None:
+    with _speculation_stats_lock:
+        _speculation_stats[name] += count
+
+def _speculation_stats_snapshot() -> dict[str, typing.Any]:
+    with _speculation_stats_lock:
+        stats = dict(_speculation_stats)
+
+    used = stats["adopted"] + stats["reused"]
+    stats["use_rate"] = used / (used + stats["cancelled"]) if used + stats["cancelled"] else 0.0
+    return stats
+
+metrics.register("speculation", _speculation_stats_snapshot)
+
+def _cached_embedding(event: HairstyleChangeEvent, inference_eventid: str) -> Optional[EmbeddingInferenceResult]:
+    cache = get_embedding_cache()
+    key = picture_key(event.uploaded_picture)
+    if cache is None or key is None:
+        return None
+
+    cached = cache.get(key)
+    if cached is None:
+        return None
+
+    embedded_file_location, segmentation_file_location = cached
+    return EmbeddingInferenceResult(
+        inference_eventid=inference_eventid,
+        hairchange_eventid=event.eventid,
+        embedded_file_location=embedded_file_location,
+        segmentation_file_location=segmentation_file_location,
+        errored=False,
+    )
 
 
 def start_embedding_inference(event: HairstyleChangeEvent) -> Optional[Exception]:
@@ -45,6 +219,17 @@ def start_embedding_inference(event: HairstyleChangeEvent) -> Optional[Exception
     )
     
     event.embedding_inference = inference_event
+    
+    # The same photo was embedded before, so blending can start without another embedding pass
+    cached_result = _cached_embedding(event, inference_eventid)
+    if cached_result is not None:
+        inference_event.set_result(cached_result)
+        try:
+            start_blending_inference(event)
+        except KeyError:
+            start_speculative_blending(event)
+        return
+    
     add_to_embedding_queue(event)
         
     
@@ -57,10 +242,24 @@ def post_embed_result(result: dict[str, typing.Any]) -> None:
 
     Returns:
         None
+        
+    Raises:
+        LeaseSuperseded: If the result comes from a lease that was superseded, it is discarded then.
+        EventCancelled: If the event was cancelled, the result is discarded then.
     """
     embedding_results = EmbeddingInferenceResult(**result)
     
-    event = get_event(embedding_results.hairchange_eventid)
+    # Retries on a freshly loaded event if another request wrote it in the meantime
+    update_event(embedding_results.hairchange_eventid, lambda event: _set_embedding_result(event, embedding_results))
+
+def _set_embedding_result(event: HairstyleChangeEvent, embedding_results: EmbeddingInferenceResult) -> None:
+    _check_embedding_result(event, embedding_results)
+    _apply_embedding_result(event, embedding_results)
+
+def _check_embedding_result(event: HairstyleChangeEvent, embedding_results: EmbeddingInferenceResult) -> None:
+    # Raises before anything is changed, so a rejected post leaves the event as it was
+    if event.cancelled_timestamp is not None:
+        raise EventCancelled("The event was cancelled")
     
     if event.embedding_inference is None:
         raise KeyError("Embedding has not started")
@@ -71,17 +270,134 @@ def post_embed_result(result: dict[str, typing.Any]) -> None:
     if event.embedding_inference.result is not None:
         raise AlreadyExists("Embedding results have already been posted")
     
+    # A worker whose lease lapsed posts late, after the job was queued again for another one
+    if is_superseded(event.embedding_inference, embedding_results.lease_id):
+        raise LeaseSuperseded("The lease of this embedding result was superseded")
+
+def _apply_embedding_result(event: HairstyleChangeEvent, embedding_results: EmbeddingInferenceResult) -> None:
+    # An embedding that ran out of attempts errors the event, which the waiting clients are told about
+    after_write(lambda: get_notifier().publish(event.eventid))
+    
+    lease_id = event.embedding_inference.lease_id
+    if lease_id is not None:
+        after_write(lambda: release_lease(lease_id))
+        after_write(lambda timed=event.embedding_inference.model_copy(): record_runs([timed]))
+    
+    # The job is queued again after a backoff until it runs out of attempts
+    if embedding_results.errored:
+        retry_inferences(event, [(event.embedding_inference, embedding_results)], "The embedding errored")
+        return
+    
     event.embedding_inference.set_result(embedding_results)
     
+    cache = get_embedding_cache()
+    key = picture_key(event.uploaded_picture) if event.uploaded_picture is not None else None
+    if cache is not None and key is not None:
+        after_write(lambda: cache.put(
+            key,
+            embedding_results.embedded_file_location,
+            embedding_results.segmentation_file_location,
+        ))
+    
     try:
         # When embedding is finished trys to start blending
         # If embedding finished before user has picked hairstyles then user will start blending when they pick hairstyles
         start_blending_inference(event)
-    except KeyError as e:
-        pass
-    finally:
-        write_data(event)
+    except KeyError:
+        # The GPUs would sit idle while the user browses the presets
+        start_speculative_blending(event)
+
+
+def start_speculative_blending(event: HairstyleChangeEvent) -> None:
+    """
+    Blends the most picked presets while the user is still picking, if `settings.SPECULATIVE_BLENDING` is on.
+
+    Args:
+        event (HairstyleChangeEvent): An event whose embedding has finished and that has no hairstyles yet.
+
+    Only as many jobs are queued as `speculation_capacity` allows, so nothing is speculated while real
+    work is waiting. They go to the speculative queue, which workers only take from when the others are empty.
+    """
+    popularity = get_preset_popularity()
+    embedding_inference = event.embedding_inference
+    if (
+        popularity is None
+        or event.hairstyles is not None
+        or event.speculative_inferences is not None
+        or embedding_inference is None
+        or embedding_inference.result is None
+        or embedding_inference.result.errored
+    ):
+        return
+
+    config = settings.SPECULATIVE_BLENDING
+    capacity = min(config.get("TOP_N", 4), speculation_capacity(config.get("MAX_QUEUED", 16), config.get("MAX_BACKLOG", 0)))
+    if capacity <= 0:
+        after_write(lambda: _count_speculation("no_capacity", 1))
+        return
 
+    hairstyles = popularity.top(capacity)
+
+    # Presets blended before from this embedding are attached when they are picked anyway
+    memo = get_blend_memo()
+    if memo is not None:
+        known = memo.lookup(embedding_inference.result.embedded_file_location, hairstyles)
+        hairstyles = [hairstyle for hairstyle in hairstyles if (hairstyle.hairstyle_id, hairstyle.color_id) not in known]
+
+    event.speculative_inferences = [
+        InferenceEvent(inference_eventid=create_eventid(), type="Blending", hairstyle=hairstyle)
+        for hairstyle in hairstyles
+    ]
+    add_to_speculative_queue(event, event.speculative_inferences)
+    after_write(lambda: _count_speculation("launched", len(hairstyles)))
+
+def _adopt_speculative_blends(event: HairstyleChangeEvent) -> list[InferenceEvent]:
+    speculative = {
+        (inference_event.hairstyle.hairstyle_id, inference_event.hairstyle.color_id): inference_event
+        for inference_event in event.speculative_inferences or []
+        if inference_event.result is None or not inference_event.result.errored
+    }
+
+    adopted = []
+    for hairstyle in event.hairstyles:
+        inference_event = speculative.pop((hairstyle.hairstyle_id, hairstyle.color_id), None)
+        if inference_event is None:
+            continue
+
+        # Its job is running or already done, and posts into the blend either way
+        inference_event.hairstyle = hairstyle
+        adopted.append(inference_event)
+    
+    # Picked blends whose job no worker leased yet would wait behind all the real work on the speculative
+    # queue, so they are withdrawn from it and sent again on the blending queue by `add_to_blending_queue`
+    promoted = [inference_event for inference_event in adopted if inference_event.result is None and inference_event.lease_id is None]
+    if promoted:
+        withdrawn = [inference_event.model_copy() for inference_event in promoted]
+        after_write(lambda: remove_from_queue(withdrawn))
+        for inference_event in promoted:
+            inference_event.queue_timestamp = None
+            inference_event.speculative = False
+            # Sent again as a new attempt, so a late delivery of the speculative job is stale, but not one the user's retries pay for
+            inference_event.uncounted_attempts = inference_event.attempts
+
+    adopted_ids = {inference_event.inference_eventid for inference_event in adopted}
+    event.speculative_inferences = [
+        inference_event for inference_event in event.speculative_inferences or []
+        if inference_event.inference_eventid not in adopted_ids
+    ] or None
+
+    # The blends that were not picked stay, so a job already running can still post into them
+    cancelled = [inference_event for inference_event in event.speculative_inferences or [] if inference_event.result is None]
+    if cancelled:
+        after_write(lambda: remove_from_queue(cancelled))
+
+    reused = sum(1 for inference_event in adopted if inference_event.result is not None)
+    after_write(lambda: [
+        _count_speculation("reused", reused),
+        _count_speculation("adopted", len(adopted) - reused),
+        _count_speculation("cancelled", len(cancelled)),
+    ])
+    return adopted
 
 def start_blending_inference(event: HairstyleChangeEvent) -> Optional[Exception]:
     """
@@ -120,15 +436,43 @@ def start_blending_inference(event: HairstyleChangeEvent) -> Optional[Exception]
             if blend_hairstyle == hairstyle:
                 raise AlreadyExists("Already started Blending")
         
+    # Blends of presets started before the user picked them are taken over
+    adopted = {
+        (inference_event.hairstyle.hairstyle_id, inference_event.hairstyle.color_id): inference_event
+        for inference_event in _adopt_speculative_blends(event)
+    }
+    
     for hairstyle in event.hairstyles:
-        inference_eventid = create_eventid()
-        inference_event = InferenceEvent(
-            inference_eventid = inference_eventid,
-            type = "Blending",
-            hairstyle = hairstyle
-        )
+        inference_event = adopted.get((hairstyle.hairstyle_id, hairstyle.color_id))
+        if inference_event is None:
+            inference_eventid = create_eventid()
+            inference_event = InferenceEvent(
+                inference_eventid = inference_eventid,
+                type = "Blending",
+                hairstyle = hairstyle
+            )
         event.blend_inferences.append(inference_event)
     
+    # Blends made before from the same embedding are attached right away, only the rest are queued
+    memo = get_blend_memo()
+    if memo is not None:
+        embedded_file_location = event.embedding_inference.result.embedded_file_location
+        blends = memo.lookup(embedded_file_location, event.hairstyles)
+        
+        for blend_inference_event in event.blend_inferences:
+            hairstyle = blend_inference_event.hairstyle
+            result_img_location = blends.get((hairstyle.hairstyle_id, hairstyle.color_id))
+            if blend_inference_event.result is None and result_img_location is not None:
+                blend_inference_event.set_result(BlendInferenceResult(
+                    inference_eventid=blend_inference_event.inference_eventid,
+                    hairchange_eventid=event.eventid,
+                    result_img_location=result_img_location,
+                    errored=False,
+                ))
+        
+        if all(blend_inference_event.result is not None for blend_inference_event in event.blend_inferences):
+            event.finished_timestamp = datetime.now()
+    
     add_to_blending_queue(event)        
     
 
@@ -137,39 +481,274 @@ def post_blend_result(result: dict[str, typing.Any]):
     Update the blending result for a given inference event.
 
     Args:
-        result (dict[str, typing.Any]): A dictionary containing the blending result.
+        result (dict[str, typing.Any]): A dictionary containing the blending result, or for a coalesced
+            blending job a `BlendJobResult` with the result of each of its hairstyles.
+
+    Returns:
+        rejected (list[dict[str, typing.Any]]): The results of a coalesced job that are not its own, each with its
+            `inference_eventid`, the "invalid" `status` and an `error`. The others are posted without them.
 
     Raises:
-        AssertionError: If the inference event ID is not found in the inference database.
+        KeyError: If no result matches a blending inference event of the hairchange event.
+        AlreadyExists: If every result has already been posted.
+        LeaseSuperseded: If no result was new and some came from a lease that was superseded.
+        EventCancelled: If the event was cancelled, the results are discarded then.
     """
-    blending_results = BlendInferenceResult(**result)
+    hairchange_eventid, job_id, blending_results = _parse_blend_results(result)
     
-    event = get_event(blending_results.hairchange_eventid)
+    # Workers post blends of the same event concurrently, so this retries on a freshly
+    # loaded event instead of overwriting the results the other workers just wrote
+    return update_event(hairchange_eventid, lambda event: _set_blend_results(event, blending_results, job_id))
+
+def _parse_blend_results(result: dict[str, typing.Any]) -> tuple[str, Optional[str], list[BlendInferenceResult]]:
+    # The event and, for a coalesced job, the job the results are posted for
+    if "results" in result:
+        job_result = BlendJobResult(**result)
+        blending_results = [
+            blending_result if blending_result.lease_id is not None else blending_result.model_copy(update={"lease_id": job_result.lease_id})
+            for blending_result in job_result.results
+        ]
+        return job_result.hairchange_eventid, job_result.job_id, blending_results
     
-    if event.blend_inferences is None:
-        raise KeyError("This hairchange event does not match the blending inference event")
+    blending_result = BlendInferenceResult(**result)
+    return blending_result.hairchange_eventid, None, [blending_result]
+
+def _blend_targets(
+    event: HairstyleChangeEvent,
+    blending_results: list[BlendInferenceResult],
+    job_id: Optional[str],
+    ) -> tuple[list[tuple[InferenceEvent, BlendInferenceResult]], list[dict[str, typing.Any]], int]:
+    # Sorts the results into the ones to post, the ones that are not the job's and the superseded ones, without changing the event
+    blend_inference_events = {
+        blend_inference_event.inference_eventid: blend_inference_event
+        for blend_inference_event in (event.blend_inferences or []) + (event.speculative_inferences or [])
+    }
     
-    for blend_inference_event in event.blend_inferences:
-        if blend_inference_event.inference_eventid != blending_results.inference_eventid:
-            continue
+    pending = []
+    rejected = []
+    superseded = 0
+    for blending_result in blending_results:
+        blend_inference_event = blend_inference_events.get(blending_result.inference_eventid)
+        if blending_result.hairchange_eventid != event.eventid:
+            error = f"The result is for event {blending_result.hairchange_eventid}, not {event.eventid}"
+        elif blend_inference_event is None:
+            error = "This hairchange event does not match the blending inference event"
+        elif job_id is not None and job_id not in (blend_inference_event.job_id, blend_inference_event.inference_eventid):
+            error = f"The blending inference event is not part of job {job_id}"
+        else:
+            error = None
         
+        if error is not None:
+            rejected.append({"inference_eventid": blending_result.inference_eventid, "status": "invalid", "error": error})
+        # A redelivered job may post results some of which were already written
+        elif blend_inference_event.result is not None:
+            continue
+        # The blend was queued again for another worker after this result's lease lapsed
+        elif is_superseded(blend_inference_event, blending_result.lease_id):
+            superseded += 1
+        else:
+            pending.append((blend_inference_event, blending_result))
+    
+    return pending, rejected, superseded
+
+def _check_blend_results(
+    event: HairstyleChangeEvent,
+    blending_results: list[BlendInferenceResult],
+    job_id: Optional[str] = None,
+    ) -> list[dict[str, typing.Any]]:
+    # Raises before anything is changed, so a rejected post leaves the event as it was
+    if event.cancelled_timestamp is not None:
+        raise EventCancelled("The event was cancelled")
+    
+    pending, rejected, superseded = _blend_targets(event, blending_results, job_id)
+    
+    if len(rejected) == len(blending_results):
+        raise KeyError(rejected[0]["error"])
+    if not pending and superseded > 0:
+        raise LeaseSuperseded("The lease of these blending results was superseded")
+    if not pending:
+        raise AlreadyExists("Blending result have already been posted")
+    
+    return rejected
+
+def _set_blend_results(
+    event: HairstyleChangeEvent,
+    blending_results: list[BlendInferenceResult],
+    job_id: Optional[str] = None,
+    ) -> list[dict[str, typing.Any]]:
+    rejected = _check_blend_results(event, blending_results, job_id)
+    _apply_blend_results(event, blending_results, job_id)
+    return rejected
+
+def _apply_blend_results(event: HairstyleChangeEvent, blending_results: list[BlendInferenceResult], job_id: Optional[str]) -> None:
+    speculative_ids = {
+        blend_inference_event.inference_eventid for blend_inference_event in event.speculative_inferences or []
+    }
+    
+    memo = get_blend_memo()
+    leases: set[str] = set()
+    timed: list[InferenceEvent] = []
+    failed: list[tuple[InferenceEvent, BlendInferenceResult]] = []
+    memoized: list[tuple[Hairstyle, str]] = []
+    for blend_inference_event, blending_result in _blend_targets(event, blending_results, job_id)[0]:
+        # A job that posts the same blend twice only has the first one written
         if blend_inference_event.result is not None:
-            raise AlreadyExists("Blending result have already been posted")
-        
-        blend_inference_event.set_result(blending_results)
-        
-        # Checks if all blending inferences are finished
-        all_done = True
-        for blend_inference_event in event.blend_inferences:
-            if blend_inference_event.result is None:
-                all_done = False
-                break
-        
-        if all_done:
-            event.finished_timestamp = datetime.now()
+            continue
         
-        write_data(event)
-        return
+        if blend_inference_event.lease_id is not None:
+            leases.add(blend_inference_event.lease_id)
+            timed.append(blend_inference_event.model_copy())
+        # Speculative blends nobody picked yet are not worth retrying
+        if blending_result.errored and blending_result.inference_eventid not in speculative_ids:
+            failed.append((blend_inference_event, blending_result))
+            continue
         
-    raise KeyError("This hairchange event does not match the blending inference event")
+        blend_inference_event.set_result(blending_result)
+        if memo is not None and not blending_result.errored:
+            memoized.append((blend_inference_event.hairstyle, blending_result.result_img_location))
+    
+    # Wakes the clients waiting on the results, see `client_event_handler.watch_results`
+    after_write(lambda: get_notifier().publish(event.eventid))
     
+    if leases:
+        after_write(lambda: [release_lease(lease_id) for lease_id in leases])
+        after_write(lambda: record_runs(timed))
+    
+    # Errored blends are queued again after a backoff until they run out of attempts
+    if failed:
+        retry_inferences(event, failed, "The blend errored")
+    
+    # Blends can only be reused for an embedding the event knows the location of
+    if memoized and event.embedding_inference is not None and event.embedding_inference.result is not None:
+        embedded_file_location = event.embedding_inference.result.embedded_file_location
+        after_write(lambda: [
+            memo.put(embedded_file_location, hairstyle, result_img_location)
+            for hairstyle, result_img_location in memoized
+        ])
+    
+    # Checks if all blending inferences are finished
+    if event.blend_inferences and all(blend_inference_event.result is not None for blend_inference_event in event.blend_inferences):
+        event.finished_timestamp = datetime.now()
+
+
+_bulk_stats_lock = threading.Lock()
+_bulk_stats = {
+    "batches": 0,
+    "results": 0,
+    "writes": 0,
+}
+
+def _count_bulk(batches: int, results: int, writes: int) -> None:
+    with _bulk_stats_lock:
+        _bulk_stats["batches"] += batches
+        _bulk_stats["results"] += results
+        _bulk_stats["writes"] += writes
+
+def _bulk_stats_snapshot() -> dict[str, typing.Any]:
+    with _bulk_stats_lock:
+        stats = dict(_bulk_stats)
+
+    stats["results_per_write"] = stats["results"] / stats["writes"] if stats["writes"] else 0.0
+    return stats
+
+metrics.register("bulk_results", _bulk_stats_snapshot)
+
+# What each rejected result is reported as, subclasses before the classes they extend
+_REJECTED_STATUSES: list[tuple[type[Exception], str]] = [
+    (LeaseSuperseded, "superseded"),
+    (AlreadyExists, "already_posted"),
+    (EventCancelled, "cancelled"),
+    (KeyError, "unknown_inference"),
+]
+
+def _rejected_status(error: Exception) -> dict[str, typing.Any]:
+    status = next(status for error_type, status in _REJECTED_STATUSES if isinstance(error, error_type))
+    return {"status": status, "error": error.args[0] if error.args else str(error)}
+
+class _NothingPosted(Exception):
+    # Leaves an event whose results were all rejected unwritten
+    def __init__(self, statuses: dict[int, dict[str, typing.Any]]):
+        super().__init__("No result was posted")
+        self.statuses = statuses
+
+def post_results(results: list[dict[str, typing.Any]]) -> list[dict[str, typing.Any]]:
+    """
+    Posts many embedding and blending results at once, writing every event they belong to once.
+
+    Args:
+        results (list[dict[str, typing.Any]]): Each one is `{"type": "Embedding" | "Blending", "result": ...}`
+            where the result is what `post_embed_result` or `post_blend_result` takes.
+
+    Returns:
+        statuses (list[dict[str, typing.Any]]): For each result in the same order, its `status` and, unless it is
+            "posted", an `error`. Results the event rejected are "superseded", "already_posted", "cancelled" or
+            "unknown_inference", results that could not be read are "invalid" and the results of an event that
+            could not be written at all, for example because it timed out, are "errored". A posted coalesced job
+            whose results were not all its own lists those under `rejected`, see `post_blend_result`.
+
+    The results of an event are applied in the order they were sent, in one `update_event`, so a worker that
+    finished a batch of jobs pays one load and one write per event instead of one per result. Each result is
+    checked against the event before it changes anything, so a rejected one leaves no trace in the write.
+    """
+    statuses: list[dict[str, typing.Any]] = [{"status": "invalid"} for _ in results]
+    groups: dict[str, list[tuple[int, typing.Callable, typing.Callable]]] = {}
+
+    for index, item in enumerate(results):
+        try:
+            kind = item.get("type") if isinstance(item, dict) else None
+            if kind == "Embedding":
+                embedding_results = EmbeddingInferenceResult(**item["result"])
+                hairchange_eventid = embedding_results.hairchange_eventid
+                check = lambda event, embedding_results=embedding_results: _check_embedding_result(event, embedding_results) or []
+                apply = lambda event, embedding_results=embedding_results: _apply_embedding_result(event, embedding_results)
+            elif kind == "Blending":
+                hairchange_eventid, job_id, blending_results = _parse_blend_results(item["result"])
+                check = lambda event, blending_results=blending_results, job_id=job_id: _check_blend_results(event, blending_results, job_id)
+                apply = lambda event, blending_results=blending_results, job_id=job_id: _apply_blend_results(event, blending_results, job_id)
+            else:
+                raise ValueError(f"Unknown result type {kind!r}")
+        except (ValidationError, TypeError, ValueError, KeyError, IndexError) as e:
+            statuses[index]["error"] = str(e)
+            continue
+
+        groups.setdefault(hairchange_eventid, []).append((index, check, apply))
+
+    def set_results(event: HairstyleChangeEvent, group: list[tuple[int, typing.Callable, typing.Callable]]) -> dict[int, dict[str, typing.Any]]:
+        group_statuses = {}
+        for index, check, apply in group:
+            try:
+                rejected = check(event)
+            except (AlreadyExists, EventCancelled, KeyError) as e:
+                group_statuses[index] = _rejected_status(e)
+                continue
+
+            apply(event)
+            group_statuses[index] = {"status": "posted", "rejected": rejected} if rejected else {"status": "posted"}
+
+        if all(status["status"] != "posted" for status in group_statuses.values()):
+            raise _NothingPosted(group_statuses)
+        return group_statuses
+
+    writes = 0
+    for hairchange_eventid, group in groups.items():
+        try:
+            group_statuses = update_event(hairchange_eventid, lambda event, group=group: set_results(event, group))
+            writes += 1
+        except _NothingPosted as e:
+            group_statuses = e.statuses
+        except Exception as e:
+            print(f"Could not post the results of event {hairchange_eventid}: {e}")
+            for index, *_ in group:
+                statuses[index] = {"status": "errored", "error": str(e)}
+            continue
+
+        for index, status in group_statuses.items():
+            statuses[index] = status
+
+    _count_bulk(1, len(results), writes)
+    return statuses
+
+# For views served from asgi.py, posting a result writes the event and queues the next jobs, so each runs in a thread of the shared pool
+apost_embed_result = sync_to_async(post_embed_result, thread_sensitive=False)
+apost_blend_result = sync_to_async(post_blend_result, thread_sensitive=False)
+apost_results = sync_to_async(post_results, thread_sensitive=False)
@@ -0,0 +1,352 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import threading
+import typing
+from typing import Callable, Iterator, Optional
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import (
+    HairstyleChangeEvent,
+    InferenceEvent,
+    InferenceJob,
+    JobLease,
+    after_write,
+    update_event
+)
+from hairstyle_creation.handlers.aws_queue_handler import job_inferences, retry_inferences
+from hairstyle_creation.stores.deadline_index import DeadlineIndex
+
+DEFAULT_LEASE_INDEX = "database/deadlines.sqlite3"
+
+# Seconds a lease lasts without a heartbeat, see `settings.JOB_LEASES`
+LEASE_DURATION = 30.0
+
+_lease_index: Optional[DeadlineIndex] = None
+_lease_index_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "acquired": 0,
+    "busy": 0,
+    "stale": 0,
+    "renewed": 0,
+    "lost": 0,
+    "reaped": 0,
+}
+
+def _count(name: str, count: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += count
+
+def _lease_stats() -> dict[str, typing.Any]:
+    with _stats_lock:
+        return dict(_stats)
+
+metrics.register("leases", _lease_stats)
+
+def get_lease_index() -> DeadlineIndex:
+    """
+    Returns the index of lease expiries, kept next to the event timeouts in `settings.DEADLINE_INDEX_PATH`.
+
+    Returns:
+        index (DeadlineIndex): The process wide lease index, created on first use.
+    """
+    global _lease_index
+
+    if _lease_index is None:
+        with _lease_index_lock:
+            if _lease_index is None:
+                path = getattr(settings, "DEADLINE_INDEX_PATH", DEFAULT_LEASE_INDEX)
+                _lease_index = DeadlineIndex(path=str(path), table="leases")
+
+    return _lease_index
+
+def _reset_lease_index(setting: str, **kwargs: typing.Any) -> None:
+    global _lease_index
+
+    if setting == "DEADLINE_INDEX_PATH":
+        _lease_index = None
+
+setting_changed.connect(_reset_lease_index)
+
+def lease_duration() -> float:
+    """
+    Returns:
+        duration (float): Seconds a lease lasts without a heartbeat.
+    """
+    return getattr(settings, "JOB_LEASES", {}).get("DURATION", LEASE_DURATION)
+
+def _lease_eventid(lease_id: str) -> str:
+    # Lease IDs start with the event ID, so the reaper knows which event to load
+    return lease_id.rpartition(":")[0]
+
+def acquire_lease(job: InferenceJob, now: Optional[datetime] = None) -> Optional[JobLease]:
+    """
+    Claims a received job for a worker, which must renew the lease with `renew_lease` until it posts the results.
+
+    Args:
+        job (InferenceJob): The received job.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+
+    Returns:
+        Optional[JobLease]: The lease, or None if the job must not be run: its inferences already have results,
+            it was queued again since, its event errored or was cancelled, or another worker holds a lease on it that has not lapsed.
+            The worker acks the message and drops the job then.
+
+    Raises:
+        Exception: If the event does not exist.
+        TimeoutError: If the event has timed out.
+    """
+    now = now or datetime.now()
+    index = get_lease_index()
+    lease_id = f"{job.hairchange_eventid}:{uuid4().hex}"
+    expires = now + timedelta(seconds=lease_duration())
+
+    def take(event: HairstyleChangeEvent) -> tuple[str, list[str]]:
+        # A job that could not be discarded when its event was cancelled or expired
+        if event.errored:
+            return "stale", []
+
+        pending = [inference_event for inference_event in job_inferences(event, job) if inference_event.result is None]
+
+        # A redelivered message of an attempt that has been retried since
+        if not pending or any(inference_event.attempts > job.attempt for inference_event in pending):
+            return "stale", []
+
+        held = {inference_event.lease_id for inference_event in pending if inference_event.lease_id is not None}
+        for held_id in held:
+            deadline = index.deadline(held_id)
+            if deadline is not None and deadline > now:
+                return "busy", []
+
+        for inference_event in pending:
+            inference_event.lease_id = lease_id
+            inference_event.lease_timestamp = now
+
+        def schedule() -> None:
+            index.schedule(lease_id, expires)
+            for held_id in held:
+                index.remove(held_id)
+
+        after_write(schedule)
+        return "acquired", [inference_event.inference_eventid for inference_event in pending]
+
+    status, inference_eventids = update_event(job.hairchange_eventid, take)
+    _count(status)
+    if status != "acquired":
+        return None
+
+    return JobLease(
+        lease_id=lease_id,
+        hairchange_eventid=job.hairchange_eventid,
+        inference_eventids=inference_eventids,
+        expires=expires,
+    )
+
+def renew_lease(lease_id: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    The heartbeat of a worker, keeps its lease from lapsing for another `lease_duration()` seconds.
+
+    Args:
+        lease_id (str): The lease.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+
+    Returns:
+        Optional[datetime]: When the lease lapses now, or None if it was lost. The job was queued again then
+            or its event was cancelled, and the results of this lease will be discarded, so the worker can stop.
+    """
+    now = now or datetime.now()
+    expires = now + timedelta(seconds=lease_duration())
+
+    if not get_lease_index().reschedule(lease_id, expires):
+        _count("lost")
+        return None
+
+    _count("renewed")
+    return expires
+
+# For views served from asgi.py, leases are kept in SQLite so they are taken and renewed in a thread of the shared pool
+aacquire_lease = sync_to_async(acquire_lease, thread_sensitive=False)
+arenew_lease = sync_to_async(renew_lease, thread_sensitive=False)
+
+def release_lease(lease_id: str) -> None:
+    """
+    Ends a lease once its results are written, so the reaper does not look at it.
+
+    Args:
+        lease_id (str): The lease.
+    """
+    get_lease_index().remove(lease_id)
+
+def is_superseded(inference_event: InferenceEvent, lease_id: Optional[str]) -> bool:
+    """
+    Args:
+        inference_event (InferenceEvent): The inference a result was posted for.
+        lease_id (Optional[str]): The lease the result was posted under.
+
+    Returns:
+        bool: True if the result comes from a lease that lapsed or was taken over, and must be discarded.
+            Results posted without a lease are always kept.
+    """
+    return lease_id is not None and inference_event.lease_id != lease_id
+
+def reap_lease(lease_id: str, now: datetime) -> int:
+    """
+    Queues the jobs of a lapsed lease again, see `retry_inferences`.
+
+    Args:
+        lease_id (str): The lapsed lease.
+        now (datetime): The current time.
+
+    Returns:
+        reaped (int): The number of inferences queued again or given up on.
+    """
+    index = get_lease_index()
+
+    def requeue(event: HairstyleChangeEvent) -> int:
+        # Renewed since it was found to be due
+        deadline = index.deadline(lease_id)
+        if deadline is not None and deadline > now:
+            return 0
+
+        inference_events = [event.embedding_inference] + (event.blend_inferences or []) + (event.speculative_inferences or [])
+        lapsed = [
+            inference_event for inference_event in inference_events
+            if inference_event is not None and inference_event.lease_id == lease_id and inference_event.result is None
+        ]
+        for inference_event in lapsed:
+            inference_event.lease_id = None
+
+        # Speculative blends nobody picked yet are dropped instead, they are blended anew if they are picked
+        lapsed_ids = {inference_event.inference_eventid for inference_event in lapsed}
+        speculative_ids = {inference_event.inference_eventid for inference_event in event.speculative_inferences or []}
+        if event.speculative_inferences is not None:
+            event.speculative_inferences = [
+                inference_event for inference_event in event.speculative_inferences
+                if inference_event.inference_eventid not in lapsed_ids
+            ]
+
+        retried = [inference_event for inference_event in lapsed if inference_event.inference_eventid not in speculative_ids]
+        if retried:
+            retry_inferences(event, [(inference_event, None) for inference_event in retried], "The lease lapsed")
+        return len(lapsed)
+
+    reaped = update_event(_lease_eventid(lease_id), requeue)
+    _count("reaped", reaped)
+    return reaped
+
+
+class LeaseReaper:
+    """
+    Queues the jobs of workers that stopped renewing their leases again, driven by the lease index.
+
+    The queue hands out a job again as well once its visibility timeout runs out, but leases are
+    kept short by heartbeats, so a crashed worker's job is back in the queue well before that.
+    """
+
+    def __init__(
+        self,
+        index: Optional[DeadlineIndex] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        batch_size: int = 100,
+        ):
+        self.index = index or get_lease_index()
+        self.clock = clock
+        self.batch_size = batch_size
+
+    def sweep(self) -> int:
+        """
+        Reaps every lease that has lapsed.
+
+        Returns:
+            reaped (int): The number of inferences queued again or given up on.
+        """
+        reaped = 0
+
+        while True:
+            now = self.clock()
+            due = self.index.due(now, limit=self.batch_size)
+
+            for lease_id, _ in due:
+                try:
+                    reaped += reap_lease(lease_id, now)
+                except Exception as e:
+                    # The event is gone or has timed out, which releases its jobs anyway
+                    print(f"Could not reap lease {lease_id}: {e}")
+
+                if (deadline := self.index.deadline(lease_id)) is not None and deadline <= now:
+                    self.index.remove(lease_id)
+
+            if len(due) < self.batch_size:
+                return reaped
+
+    def run(self, interval: float = 5.0, stop: Optional[threading.Event] = None) -> None:
+        """
+        Reaps every `interval` seconds until `stop` is set.
+
+        Args:
+            interval (float): Seconds between sweeps.
+            stop (Optional[threading.Event]): Stops the loop when set.
+        """
+        stop = stop or threading.Event()
+
+        while not stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Lease sweep failed: {e}")
+            stop.wait(interval)
+
+    def start_thread(self, interval: float = 5.0) -> threading.Event:
+        """
+        Runs the reaper in a daemon thread of this process.
+
+        Args:
+            interval (float): Seconds between sweeps.
+
+        Returns:
+            stop (threading.Event): Set it to stop the thread.
+        """
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run, args=(interval, stop), name="lease-reaper", daemon=True)
+        thread.start()
+        return stop
+
+@contextmanager
+def heartbeat(lease: JobLease, interval: Optional[float] = None) -> Iterator[threading.Event]:
+    """
+    Renews a lease in a background thread while the job runs.
+
+    Args:
+        lease (JobLease): The lease.
+        interval (Optional[float]): Seconds between renewals, defaults to a third of `lease_duration()`.
+
+    Yields:
+        lost (threading.Event): Set once the lease was lost, the job's results will be discarded then.
+    """
+    interval = interval or lease_duration() / 3
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(interval):
+            try:
+                if renew_lease(lease.lease_id) is None:
+                    lost.set()
+                    return
+            except Exception as e:
+                # Tried again on the next beat, the lease lasts for several of them
+                print(f"Heartbeat of lease {lease.lease_id} failed: {e}")
+
+    thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+import threading
+import typing
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import (
+    HairstyleChangeEvent,
+    InferenceEvent,
+    get_data,
+    update_event
+)
+from hairstyle_creation.handlers.cancel_handler import pending_inferences, release_inferences
+from hairstyle_creation.notifications import get_notifier
+from hairstyle_creation.stores.deadline_index import DeadlineIndex
+
+DEFAULT_DEADLINE_INDEX = "database/deadlines.sqlite3"
+
+_deadline_index: Optional[DeadlineIndex] = None
+_deadline_index_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "expired": 0,
+    "skipped": 0,
+    "failed": 0,
+    "released_jobs": 0,
+    "max_lag_seconds": 0.0,
+}
+
+def _timeout_stats() -> dict[str, typing.Any]:
+    with _stats_lock:
+        return dict(_stats)
+
+metrics.register("timeouts", _timeout_stats)
+
+def get_deadline_index() -> DeadlineIndex:
+    """
+    Returns the index of event timeouts configured by `settings.DEADLINE_INDEX_PATH`.
+
+    Returns:
+        index (DeadlineIndex): The process wide deadline index, created on first use.
+    """
+    global _deadline_index
+
+    if _deadline_index is None:
+        with _deadline_index_lock:
+            if _deadline_index is None:
+                path = getattr(settings, "DEADLINE_INDEX_PATH", DEFAULT_DEADLINE_INDEX)
+                _deadline_index = DeadlineIndex(path=str(path))
+
+    return _deadline_index
+
+def _reset_deadline_index(setting: str, **kwargs: typing.Any) -> None:
+    global _deadline_index
+
+    if setting == "DEADLINE_INDEX_PATH":
+        _deadline_index = None
+
+setting_changed.connect(_reset_deadline_index)
+
+def schedule_timeout(event: HairstyleChangeEvent) -> None:
+    """
+    Adds an event to the deadline index so the sweeper expires it at its `event_timeout`.
+
+    Args:
+        event (HairstyleChangeEvent): The event to schedule.
+    """
+    get_deadline_index().schedule(event.eventid, event.event_timeout)
+
+def expire_event(eventid: str, now: Optional[datetime] = None) -> bool:
+    """
+    Marks a timed out event as errored and withdraws its inference jobs, see `cancel_handler.release_inferences`.
+
+    Args:
+        eventid (str): The ID of the event.
+        now (Optional[datetime]): The current time, defaults to `datetime.now()`.
+
+    Returns:
+        bool: True if the event was expired, False if it does not exist, had already finished, errored or not timed out yet.
+    """
+    now = now or datetime.now()
+
+    event = get_data(eventid)
+    if event is None or event.errored or event.finished_timestamp is not None or now <= event.event_timeout:
+        with _stats_lock:
+            _stats["skipped"] += 1
+        return False
+
+    def mark_errored(event: HairstyleChangeEvent) -> Optional[list[InferenceEvent]]:
+        # Another request may have finished or expired the event since it was checked
+        if event.errored or event.finished_timestamp is not None:
+            return None
+
+        event.errored = True
+        return pending_inferences(event)
+
+    pending = update_event(eventid, mark_errored, check_timeout=False)
+    if pending is None:
+        with _stats_lock:
+            _stats["skipped"] += 1
+        return False
+
+    # Only released once the event is written, so a lost write race can not release them twice
+    release_inferences(pending, now)
+    get_notifier().publish(eventid)
+
+    with _stats_lock:
+        _stats["expired"] += 1
+        _stats["released_jobs"] += len(pending)
+        _stats["max_lag_seconds"] = max(_stats["max_lag_seconds"], (now - event.event_timeout).total_seconds())
+
+    return True
+
+
+class TimeoutSweeper:
+    """
+    Expires events as their timeouts pass, driven by the deadline index instead of scanning the store.
+    """
+
+    def __init__(
+        self,
+        index: Optional[DeadlineIndex] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        batch_size: int = 100,
+        retry_delay: float = 60.0,
+        ):
+        self.index = index or get_deadline_index()
+        self.clock = clock
+        self.batch_size = batch_size
+        # Seconds until an event that could not be expired is tried again
+        self.retry_delay = retry_delay
+
+    def sweep(self) -> int:
+        """
+        Expires every event whose timeout has passed.
+
+        Returns:
+            expired (int): The number of events that were expired.
+        """
+        expired = 0
+
+        while True:
+            now = self.clock()
+            due = self.index.due(now, limit=self.batch_size)
+
+            for eventid, _ in due:
+                try:
+                    if expire_event(eventid, now=now):
+                        expired += 1
+                except Exception as e:
+                    # Tried again after retry_delay, so it does not hold up the events due after it
+                    print(f"Could not expire event {eventid}: {e}")
+                    self.index.reschedule(eventid, now + timedelta(seconds=self.retry_delay))
+                    with _stats_lock:
+                        _stats["failed"] += 1
+                    continue
+
+                # Finished events are removed lazily here rather than on every finish
+                self.index.remove(eventid)
+
+            if len(due) < self.batch_size:
+                return expired
+
+    def run(self, interval: float = 5.0, stop: Optional[threading.Event] = None) -> None:
+        """
+        Sweeps every `interval` seconds until `stop` is set.
+
+        Args:
+            interval (float): Seconds between sweeps.
+            stop (Optional[threading.Event]): Stops the loop when set.
+        """
+        stop = stop or threading.Event()
+
+        while not stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                # Whatever failed is still in the index, so it is retried on the next sweep
+                print(f"Timeout sweep failed: {e}")
+            stop.wait(interval)
+
+    def start_thread(self, interval: float = 5.0) -> threading.Event:
+        """
+        Runs the sweeper in a daemon thread of this process.
+
+        Args:
+            interval (float): Seconds between sweeps.
+
+        Returns:
+            stop (threading.Event): Set it to stop the thread.
+        """
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run, args=(interval, stop), name="timeout-sweeper", daemon=True)
+        thread.start()
+        return stop
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from hairstyle_creation.handlers.archive_handler import archive_events
+
+
+class Command(BaseCommand):
+    help = "Moves old finished and timed out hairstyle change events from the live store into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=float,
+            default=(getattr(settings, "EVENT_ARCHIVE", None) or {}).get("MAX_AGE_DAYS", 7),
+            help="Age of the events to archive",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Events appended to the archive at a time")
+
+    def handle(self, *args, **options):
+        try:
+            archived = archive_events(
+                max_age=timedelta(days=options["older_than_days"]),
+                batch_size=options["batch_size"],
+            )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Archived {archived} events")
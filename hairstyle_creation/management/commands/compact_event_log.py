@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hairstyle_creation.models import get_store
+from hairstyle_creation.stores.log_store import EventLogStore
+
+
+class Command(BaseCommand):
+    help = "Folds the delta records of every event in the event log store into snapshots"
+
+    def handle(self, *args, **options):
+        store = get_store()
+        # Unwraps the in-memory cache and the read coalescing if they are configured
+        while hasattr(store, "store"):
+            store = store.store
+        
+        if not isinstance(store, EventLogStore):
+            raise CommandError(f"EVENT_STORE is a {type(store).__name__}, not an EventLogStore")
+        
+        compacted = store.compact_all()
+        self.stdout.write(f"Compacted {compacted} events")
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from hairstyle_creation.handlers.aws_queue_handler import get_dead_letters, replay_dead_letter
+
+
+class Command(BaseCommand):
+    help = "Lists, replays or drops the inference jobs that ran out of attempts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", help="Only the jobs of this queue")
+        parser.add_argument("--limit", type=int, default=100, help="The most jobs to list or replay")
+        parser.add_argument("--replay", nargs="*", metavar="MESSAGE_ID", help="Runs these jobs again, or every listed job if none are given")
+        parser.add_argument("--drop", nargs="+", metavar="MESSAGE_ID", help="Forgets these jobs")
+
+    def handle(self, *args, **options):
+        store = get_dead_letters()
+
+        if options["drop"]:
+            dropped = sum(store.remove(message_id) for message_id in options["drop"])
+            self.stdout.write(f"Dropped {dropped} jobs")
+            return
+
+        if options["replay"] is not None:
+            message_ids = options["replay"] or [
+                letter.message_id for letter in store.list(queue=options["queue"], limit=options["limit"])
+            ]
+
+            replayed = 0
+            for message_id in message_ids:
+                try:
+                    found = replay_dead_letter(message_id)
+                except Exception as e:
+                    # The event is gone or timed out, so the job can never finish
+                    self.stderr.write(f"Could not replay {message_id}: {e}")
+                    continue
+
+                if not found:
+                    self.stderr.write(f"There is no dead letter {message_id}")
+                    continue
+                replayed += 1
+
+            self.stdout.write(f"Replayed {replayed} jobs")
+            return
+
+        letters = store.list(queue=options["queue"], limit=options["limit"])
+        for letter in letters:
+            self.stdout.write(
+                f"{letter.dead_timestamp.isoformat(timespec='seconds')} {letter.queue} {letter.message_id} "
+                f"event {letter.job.hairchange_eventid}, {letter.attempts} attempts: {letter.reason}"
+            )
+        self.stdout.write(f"{len(store)} dead letters")
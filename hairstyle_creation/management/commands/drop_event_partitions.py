@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hairstyle_creation.models import get_account_index, get_store
+from hairstyle_creation.handlers.timeout_handler import get_deadline_index
+from hairstyle_creation.stores.file_store import FileEventStore
+from hairstyle_creation.stores.layout import partition_eventids
+
+
+class Command(BaseCommand):
+    help = "Removes whole hourly partitions of old events from the sharded file event store, and their index entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=float, required=True, help="Age of the partitions to remove")
+        parser.add_argument("--migrate", action="store_true", help="Move events left by the flat layout into partitions first")
+
+    def handle(self, *args, **options):
+        store = get_store()
+        # Unwraps the in-memory cache and the read coalescing if they are configured
+        while hasattr(store, "store"):
+            store = store.store
+        
+        if not isinstance(store, FileEventStore) or not store.sharded:
+            raise CommandError(f"EVENT_STORE is a {type(store).__name__}, not a sharded FileEventStore")
+        
+        if options["migrate"]:
+            migrated = store.migrate_flat_layout()
+            self.stdout.write(f"Migrated {migrated} events")
+        
+        account_index = get_account_index()
+        deadline_index = get_deadline_index()
+        removed = 0
+
+        # The dropped events would otherwise stay in the account history and be swept for timeouts
+        def remove_from_indexes(start: datetime) -> None:
+            nonlocal removed
+            low, high = partition_eventids(start)
+            removed += account_index.remove_range(low, high)
+            deadline_index.remove_range(low, high)
+
+        before = datetime.now() - timedelta(days=options["older_than_days"])
+        dropped = store.drop_partitions(before, remove_from_indexes)
+        self.stdout.write(f"Dropped {dropped} partitions")
+        self.stdout.write(f"Removed {removed} events from the account index")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hairstyle_creation.handlers.lease_handler import LeaseReaper
+
+
+class Command(BaseCommand):
+    help = "Queues the inference jobs of workers that stopped renewing their leases again"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Reap once and exit instead of looping")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=getattr(settings, "JOB_LEASES", {}).get("INTERVAL", 5.0),
+            help="Seconds between sweeps",
+        )
+
+    def handle(self, *args, **options):
+        reaper = LeaseReaper()
+
+        if options["once"]:
+            reaped = reaper.sweep()
+            self.stdout.write(f"Queued {reaped} inferences again")
+            return
+
+        reaper.run(interval=options["interval"])
@@ -0,0 +1,25 @@
+import itertools
+
+from django.core.management.base import BaseCommand
+
+from hairstyle_creation.models import get_account_index, get_archive, get_store
+
+
+class Command(BaseCommand):
+    help = "Records every live and archived hairstyle change event in the account index"
+
+    def handle(self, *args, **options):
+        store = get_store()
+        # Unwraps the in-memory cache if there is one
+        store = getattr(store, "store", store)
+
+        live_events = (store.get(eventid) for eventid in store.iter_eventids())
+        events = (event for event in live_events if event is not None)
+
+        archive = get_archive()
+        if archive is not None:
+            # Live events come last so they win over older archived copies
+            events = itertools.chain(archive.iter_events(), events)
+
+        recorded = get_account_index().rebuild(events)
+        self.stdout.write(f"Recorded {recorded} events")
@@ -0,0 +1,85 @@
+from typing import Optional
+
+from django.core.management.base import BaseCommand
+
+from hairstyle_creation.errors import VersionConflict
+from hairstyle_creation.handlers.aws_queue_handler import get_scheduler
+from hairstyle_creation.handlers.inference_handler import post_blend_result, post_embed_result
+from hairstyle_creation.handlers.lease_handler import acquire_lease, heartbeat
+from hairstyle_creation.models import InferenceJob
+
+
+def run_job(job: InferenceJob, lease_id: Optional[str] = None) -> None:
+    # Posts made up file locations instead of running a model
+    if job.type == "Embedding":
+        post_embed_result({
+            "inference_eventid": job.inference_eventid,
+            "hairchange_eventid": job.hairchange_eventid,
+            "embedded_file_location": f"stub/{job.inference_eventid}.npy",
+            "segmentation_file_location": f"stub/{job.inference_eventid}.png",
+            "errored": False,
+            "lease_id": lease_id,
+        })
+    elif job.targets is not None:
+        post_blend_result({
+            "job_id": job.inference_eventid,
+            "hairchange_eventid": job.hairchange_eventid,
+            "results": [
+                {
+                    "inference_eventid": target.inference_eventid,
+                    "hairchange_eventid": job.hairchange_eventid,
+                    "result_img_location": f"stub/{target.inference_eventid}.jpg",
+                    "errored": False,
+                }
+                for target in job.targets
+            ],
+            "lease_id": lease_id,
+        })
+    else:
+        post_blend_result({
+            "inference_eventid": job.inference_eventid,
+            "hairchange_eventid": job.hairchange_eventid,
+            "result_img_location": f"stub/{job.inference_eventid}.jpg",
+            "errored": False,
+            "lease_id": lease_id,
+        })
+
+
+class Command(BaseCommand):
+    help = "Answers queued inference jobs with made up results, to run and load test the pipeline without GPUs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wait", type=float, default=1.0, help="Seconds to wait for a job")
+        parser.add_argument("--once", action="store_true", help="Exit once the queues are empty")
+
+    def handle(self, *args, **options):
+        scheduler = get_scheduler()
+        done = 0
+
+        while True:
+            scheduled = scheduler.next_job(wait_time=options["wait"])
+            if scheduled is None:
+                if options["once"]:
+                    break
+                continue
+
+            try:
+                # None for a job another worker holds or that was queued again since, which is dropped
+                lease = acquire_lease(scheduled.job)
+                if lease is not None:
+                    with heartbeat(lease) as lost:
+                        # A worker running a model checks this between steps, and stops once its event is cancelled
+                        if not lost.is_set():
+                            run_job(scheduled.job, lease_id=lease.lease_id)
+            except VersionConflict:
+                # Tried again once the event is less contended
+                scheduler.nack(scheduled, delay=1.0)
+                continue
+            except Exception as e:
+                # The event expired, errored or already has the result, so there is nothing to retry
+                print(f"Job {scheduled.message.message_id} failed: {e}")
+
+            scheduler.ack(scheduled)
+            done += 1
+
+        self.stdout.write(f"Answered {done} jobs")
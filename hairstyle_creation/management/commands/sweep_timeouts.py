@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hairstyle_creation.handlers.timeout_handler import TimeoutSweeper
+
+
+class Command(BaseCommand):
+    help = "Expires timed out hairstyle change events and releases their queued inference jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Sweep once and exit instead of looping")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=getattr(settings, "TIMEOUT_SWEEPER", {}).get("INTERVAL", 5.0),
+            help="Seconds between sweeps",
+        )
+
+    def handle(self, *args, **options):
+        sweeper = TimeoutSweeper()
+        
+        if options["once"]:
+            expired = sweeper.sweep()
+            self.stdout.write(f"Expired {expired} events")
+            return
+        
+        sweeper.run(interval=options["interval"])
@@ -0,0 +1,29 @@
+import threading
+import typing
+from typing import Callable
+
+_collectors: dict[str, Callable[[], dict[str, typing.Any]]] = {}
+_collectors_lock = threading.Lock()
+
+def register(name: str, collector: Callable[[], dict[str, typing.Any]]) -> None:
+    """
+    Registers a component's counters so they are reported by `collect`.
+
+    Args:
+        name (str): The name the counters are reported under. Registering a name again replaces it.
+        collector (Callable[[], dict[str, typing.Any]]): Returns the component's current counters.
+    """
+    with _collectors_lock:
+        _collectors[name] = collector
+
+def collect() -> dict[str, dict[str, typing.Any]]:
+    """
+    Collects the counters of every registered component in this process.
+
+    Returns:
+        metrics (dict[str, dict[str, typing.Any]]): The counters of each component keyed by its name.
+    """
+    with _collectors_lock:
+        collectors = list(_collectors.items())
+
+    return {name: collector() for name, collector in collectors}
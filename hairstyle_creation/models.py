@@ -1,13 +1,25 @@
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+import random
+import time
 import typing
-from typing import Literal, Optional
+from typing import Callable, Literal, Optional, TypeVar
 from uuid import uuid4
 
-from pydantic import BaseModel
+from asgiref.sync import sync_to_async
+from pydantic import BaseModel, ConfigDict, Field
+
+from hairstyle_creation.errors import VersionConflict
 
 EVENT_TIMEOUT = timedelta(hours=1)
 
+# How many times update_event reloads and retries an event after losing a write race
+UPDATE_ATTEMPTS = 64
+
 class Hairstyle(BaseModel):
+    # Leaf models are frozen so cached events can share them between readers
+    model_config = ConfigDict(frozen=True)
+    
     hairstyle_id: int
     hairstyle_name: str
     
@@ -15,10 +27,17 @@ class Hairstyle(BaseModel):
     color_name: str
     
 class UploadPicture(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     file_location: str
     bbox: tuple[int, int, int, int]
+    
+    # Hex SHA-256 of the image, lets a repeat upload of the same photo reuse its embedding
+    content_hash: Optional[str] = Field(default=None, pattern=r"^[0-9a-f]{64}$")
 
 class EmbeddingInferenceResult(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     inference_eventid: str
     hairchange_eventid: str
     
@@ -27,7 +46,12 @@ class EmbeddingInferenceResult(BaseModel):
         
     errored: bool
     
+    # The lease the worker held on the job, see `lease_handler.acquire_lease`
+    lease_id: Optional[str] = None
+    
 class BlendInferenceResult(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     inference_eventid: str
     hairchange_eventid: str
     
@@ -35,12 +59,14 @@ class BlendInferenceResult(BaseModel):
     
     errored: bool
     
+    lease_id: Optional[str] = None
+    
 class InferenceEvent(BaseModel):
     inference_eventid: str
     
     type: Literal["Embedding", "Blending"]
     
-    start_timestamp: Optional[datetime] = None
+    start_timestamp: Optional[datetime] = Field(default_factory=datetime.now)
     
     hairstyle: Optional[Hairstyle] = None
     
@@ -48,15 +74,111 @@ class InferenceEvent(BaseModel):
 
     queue_timestamp: Optional[datetime] = None
     finished_timestamp: Optional[datetime] = None
-        
-    def __init__(self, **data: typing.Any) -> None:
-        data["start_timestamp"] = datetime.now()
-        super().__init__(**data)
+    
+    # The queued job this blend is part of, when several blends of the event share one job
+    job_id: Optional[str] = None
+    
+    # How many times the job of this inference was queued, retries included
+    attempts: int = 0
+    
+    # The lease of the worker running the job, only results posted under it are kept
+    lease_id: Optional[str] = None
+    
+    # Whether the job was queued on the speculative queue, before the user picked the hairstyle
+    speculative: bool = False
+    
+    # When the worker holding `lease_id` took the job, to tell how long the GPUs spend on it
+    lease_timestamp: Optional[datetime] = None
+    
+    # The version of the event the result was written in, the cursor of `client_event_handler.get_new_results`
+    result_version: Optional[int] = None
+    
+    # Attempts that do not count against the retry budget, those made before the job was replayed from the dead letters
+    # or, for a picked speculative blend, on the speculative queue. `attempts` itself only ever grows,
+    # so every run of the job is queued under its own message ID
+    uncounted_attempts: int = 0
         
     def set_result(self, result: EmbeddingInferenceResult | BlendInferenceResult):
         self.result = result
         self.finished_timestamp = datetime.now()
 
+class BlendTarget(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    inference_eventid: str
+    hairstyle: Hairstyle
+
+class InferenceJob(BaseModel):
+    """
+    What a GPU worker receives from the job queue, everything it needs to run one inference.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    inference_eventid: str
+    hairchange_eventid: str
+
+    type: Literal["Embedding", "Blending"]
+
+    # Which run of the inference this is, counting from 1, see `aws_queue_handler.ATTEMPTS`
+    attempt: int = 1
+
+    # Who the job is for, so workers share out the GPUs fairly between accounts
+    account_identifier: Optional[str] = None
+    queue_timestamp: Optional[datetime] = None
+
+    # Set for embedding jobs
+    uploaded_picture: Optional[UploadPicture] = None
+
+    # Set for blending jobs
+    embedded_file_location: Optional[str] = None
+    segmentation_file_location: Optional[str] = None
+    hairstyle: Optional[Hairstyle] = None
+
+    # Set instead of `hairstyle` for coalesced blending jobs, which blend every target against the
+    # embedding loaded once. `inference_eventid` is then the job ID
+    targets: Optional[list[BlendTarget]] = None
+
+class BlendJobResult(BaseModel):
+    """
+    What a worker posts back for a coalesced blending job, one result per target.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    job_id: str
+    hairchange_eventid: str
+
+    # A job has at least one target, so an empty list is rejected rather than matched to no event
+    results: list[BlendInferenceResult] = Field(min_length=1)
+
+    # Set on every result that does not have its own
+    lease_id: Optional[str] = None
+
+class JobLease(BaseModel):
+    """
+    A worker's claim on a job, which lapses unless it is renewed, see `lease_handler.acquire_lease`.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    lease_id: str
+    hairchange_eventid: str
+    inference_eventids: list[str]
+
+    expires: datetime
+
+class DeadLetter(BaseModel):
+    """
+    A job that ran out of attempts, kept so it can be looked into and replayed.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    message_id: str
+    queue: str
+    job: InferenceJob
+
+    reason: str
+    attempts: int
+    dead_timestamp: datetime = Field(default_factory=datetime.now)
+
 class HairstyleChangeEvent(BaseModel):
     eventid: str
     account_identifier: str
@@ -67,22 +189,89 @@ class HairstyleChangeEvent(BaseModel):
     embedding_inference: Optional[InferenceEvent] = None
     blend_inferences: Optional[list[InferenceEvent]] = None
     
-    start_timestamp: datetime
+    start_timestamp: datetime = Field(default_factory=datetime.now)
     
     uploaded_picture_timestamp: Optional[datetime] = None
     picked_hairstyles_timestamp: Optional[datetime] = None
     
     finished_timestamp: Optional[datetime] = None
     
-    event_timeout: datetime
+    event_timeout: datetime = Field(default_factory=lambda: datetime.now() + EVENT_TIMEOUT)
     
     errored: bool = False
+    
+    # Bumped by the event store on every write, used for compare-and-swap
+    version: int = 0
+    
+    # Blends of popular presets started before the user picked, see `inference_handler.start_speculative_blending`
+    speculative_inferences: Optional[list[InferenceEvent]] = None
+    
+    # Set along with `errored` when the user cancels the event, see `cancel_handler.cancel_event`
+    cancelled_timestamp: Optional[datetime] = None
+    
+    @classmethod
+    def from_json(cls, raw: bytes | str) -> "HairstyleChangeEvent":
+        """
+        Loads a stored event, keeping every stored field (including its timestamps) as it is.
+
+        Args:
+            raw (bytes | str): The event as written by `model_dump_json`.
 
+        Returns:
+            event (HairstyleChangeEvent): The loaded event.
+            
+        The JSON is validated straight from the raw bytes by pydantic-core,
+        so no intermediate dicts are built in Python.
+        """
+        return cls.model_validate_json(raw)
+
+class EventSummary(BaseModel):
+    """
+    What a history screen shows for an event, small enough to be kept in the account index.
+    """
+    model_config = ConfigDict(frozen=True)
+    
+    eventid: str
+    status: Literal["created", "uploaded", "embedding", "blending", "finished", "errored", "cancelled"]
+    
+    start_timestamp: datetime
+    finished_timestamp: Optional[datetime] = None
+    
+    hairstyles: int = 0
+    results: int = 0
+    
+    @classmethod
+    def from_event(cls, event: HairstyleChangeEvent) -> "EventSummary":
+        """
+        Args:
+            event (HairstyleChangeEvent): The event to summarize.
+
+        Returns:
+            summary (EventSummary): The summary of the event.
+        """
+        if event.cancelled_timestamp is not None:
+            status = "cancelled"
+        elif event.errored:
+            status = "errored"
+        elif event.finished_timestamp is not None:
+            status = "finished"
+        elif event.blend_inferences:
+            status = "blending"
+        elif event.embedding_inference is not None:
+            status = "embedding"
+        elif event.uploaded_picture is not None:
+            status = "uploaded"
+        else:
+            status = "created"
         
-    def __init__(self, **data: typing.Any) -> None:
-        data["start_timestamp"] = datetime.now()
-        data["event_timeout"] = datetime.now() + EVENT_TIMEOUT
-        super().__init__(**data)
+        return cls(
+            eventid=event.eventid,
+            status=status,
+            start_timestamp=event.start_timestamp,
+            finished_timestamp=event.finished_timestamp,
+            hairstyles=len(event.hairstyles or []),
+            results=sum(1 for inference in event.blend_inferences or [] if inference.result is not None),
+        )
 
 def create_eventid() -> str:
     """
@@ -97,7 +286,12 @@ def create_eventid() -> str:
     eventid = datetime.now().strftime('%Y%m-%d%H-%M%S-') + str(uuid4())
     return eventid
 
-def get_event(eventid: str, account_identifier: Optional[str] = None) -> HairstyleChangeEvent:
+def get_event(
+    eventid: str,
+    account_identifier: Optional[str] = None,
+    check_timeout: bool = True,
+    include_archived: bool = True,
+    ) -> HairstyleChangeEvent:
     """
     Asserts that the given account identifier has a change event with the specified event ID.
 
@@ -105,6 +299,9 @@ def get_event(eventid: str, account_identifier: Optional[str] = None) -> Hairsty
         eventid (str): The ID of the event.
         account_identifier (Optional[str]): The identifier of the account.
             If it is supplied, the account must have an event with the specified ID.
+        check_timeout (bool): Whether to raise for an event that timed out before it finished or errored.
+            Archived events are never checked.
+        include_archived (bool): Whether to look in the archive for events no longer in the live store.
 
     Returns:
         None
@@ -114,6 +311,13 @@ def get_event(eventid: str, account_identifier: Optional[str] = None) -> Hairsty
         Exception: If the account does not have an event with the specified ID.
     """
     event = get_data(eventid)
+    archived = False
+    
+    if event is None and include_archived:
+        archive = get_archive()
+        if archive is not None:
+            event = archive.get(eventid)
+            archived = event is not None
     
     if event is None:
         raise Exception(f"The event with id {eventid} does not exist.")
@@ -121,33 +325,267 @@ def get_event(eventid: str, account_identifier: Optional[str] = None) -> Hairsty
     if account_identifier is not None and event.account_identifier != account_identifier:
         raise PermissionError(f"Account {account_identifier} does not have an event with id {eventid}.")
     
-    if datetime.now() > event.event_timeout:
+    # Archived events are past every timeout already, but were only archived once they were done
+    if check_timeout and not archived and _timed_out(event):
         handle_timeout(eventid=eventid)
         raise TimeoutError("Event has timed out")
     
     return event
 
+def _timed_out(event: HairstyleChangeEvent) -> bool:
+    # Finished and errored events keep their results and status past the timeout
+    return event.finished_timestamp is None and not event.errored and datetime.now() > event.event_timeout
+
+async def aget_event(
+    eventid: str,
+    account_identifier: Optional[str] = None,
+    check_timeout: bool = True,
+    include_archived: bool = True,
+    ) -> HairstyleChangeEvent:
+    """
+    The async `get_event`, for views served from asgi.py.
+
+    Args:
+        eventid (str): The ID of the event.
+        account_identifier (Optional[str]): The identifier of the account.
+            If it is supplied, the account must have an event with the specified ID.
+        check_timeout (bool): Whether to raise for an event that timed out before it finished or errored.
+        include_archived (bool): Whether to look in the archive for events no longer in the live store.
+
+    Returns:
+        event (HairstyleChangeEvent): The event.
+
+    Raises:
+        Exception: If the event with the specified ID does not exist.
+        PermissionError: If the account does not have an event with the specified ID.
+        TimeoutError: If the event has timed out.
+
+    The live store is read with `EventStore.aget`. Events that are not in it or have timed out
+    take the blocking path in a thread, as they need the archive or are expired on the way.
+    """
+    event = await get_store().aget(eventid)
+    
+    if event is None or (check_timeout and _timed_out(event)):
+        return await sync_to_async(get_event, thread_sensitive=False)(eventid, account_identifier, check_timeout, include_archived)
+    
+    if account_identifier is not None and event.account_identifier != account_identifier:
+        raise PermissionError(f"Account {account_identifier} does not have an event with id {eventid}.")
+    
+    return event
+
 def handle_timeout(eventid: str):
-    raise NotImplementedError()
+    """
+    Expires an event whose timeout has passed, see `timeout_handler.expire_event`.
+
+    Args:
+        eventid (str): The ID of the event.
+    """
+    from hairstyle_creation.handlers.timeout_handler import expire_event
+    
+    expire_event(eventid)
 
-import os
-import json
+import threading
 
-database = "database/"
-os.makedirs(database, exist_ok=True)
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
 
-def write_data(data: HairstyleChangeEvent):
-    json_file = os.path.join(database, f"{data.eventid}.json")
+if typing.TYPE_CHECKING:
+    from hairstyle_creation.stores.account_index import AccountIndex
+    from hairstyle_creation.stores.archive import EventArchive
+    from hairstyle_creation.stores.base import EventStore
+
+DEFAULT_EVENT_STORE = {
+    "BACKEND": "hairstyle_creation.stores.file_store.FileEventStore",
+    "OPTIONS": {"directory": "database/"},
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> "EventStore":
+    """
+    Returns the event store configured by `settings.EVENT_STORE`.
+
+    Returns:
+        store (EventStore): The process wide event store, created on first use.
+    """
+    global _store
     
-    with open(json_file, "w") as f:
-        f.write(data.model_dump_json())
-        
-def get_data(eventid: str) -> HairstyleChangeEvent:
-    json_file = os.path.join(database,f"{eventid}.json")
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = getattr(settings, "EVENT_STORE", DEFAULT_EVENT_STORE)
+                backend = import_string(config["BACKEND"])
+                store = backend(**config.get("OPTIONS", {}))
+                
+                # Below the cache, so it shares the loads of the cache's misses and of stale entries
+                if config.get("COALESCE", False):
+                    from hairstyle_creation.stores.single_flight import CoalescingEventStore
+                    store = CoalescingEventStore(store)
+                
+                if "CACHE" in config:
+                    from hairstyle_creation.stores.cache import CachedEventStore
+                    store = CachedEventStore(
+                        store,
+                        max_entries=config["CACHE"].get("MAX_ENTRIES", 1024),
+                        ttl=config["CACHE"].get("TTL", 30.0),
+                    )
+                
+                _store = store
+    
+    return _store
+
+_archive = None
+
+def get_archive() -> Optional["EventArchive"]:
+    """
+    Returns the archive of old events configured by `settings.EVENT_ARCHIVE`.
+
+    Returns:
+        Optional[EventArchive]: The process wide archive, created on first use, or None if archiving is not configured.
+    """
+    global _archive
     
-    if not os.path.exists(json_file):
+    config = getattr(settings, "EVENT_ARCHIVE", None)
+    if config is None:
         return None
     
-    with open(json_file, "r") as f:
-        return HairstyleChangeEvent(**json.load(f))
-    
\ No newline at end of file
+    if _archive is None:
+        with _store_lock:
+            if _archive is None:
+                from hairstyle_creation.stores.archive import EventArchive
+                _archive = EventArchive(**config.get("OPTIONS", {}))
+    
+    return _archive
+
+DEFAULT_ACCOUNT_INDEX = "database/accounts.sqlite3"
+
+_account_index = None
+
+def get_account_index() -> "AccountIndex":
+    """
+    Returns the index of every account's events configured by `settings.ACCOUNT_INDEX_PATH`.
+
+    Returns:
+        index (AccountIndex): The process wide account index, created on first use.
+    """
+    global _account_index
+    
+    if _account_index is None:
+        with _store_lock:
+            if _account_index is None:
+                from hairstyle_creation.stores.account_index import AccountIndex
+                path = getattr(settings, "ACCOUNT_INDEX_PATH", DEFAULT_ACCOUNT_INDEX)
+                _account_index = AccountIndex(path=str(path))
+    
+    return _account_index
+
+def _reset_store(setting: str, **kwargs: typing.Any) -> None:
+    global _store, _archive, _account_index
+    
+    if setting == "EVENT_STORE":
+        _store = None
+    elif setting == "EVENT_ARCHIVE":
+        _archive = None
+    elif setting == "ACCOUNT_INDEX_PATH":
+        _account_index = None
+
+setting_changed.connect(_reset_store)
+
+def _index_event(event: HairstyleChangeEvent) -> None:
+    # The event is already stored, so a failing index only leaves its summary behind until the next write
+    # or `python manage.py reindex_accounts`
+    try:
+        get_account_index().record(event)
+    except Exception as e:
+        print(f"Account index update failed for {event.eventid}: {e}")
+
+def write_data(data: HairstyleChangeEvent):
+    get_store().put(data)
+    _index_event(data)
+        
+def get_data(eventid: str) -> Optional[HairstyleChangeEvent]:
+    return get_store().get(eventid)
+
+T = TypeVar("T")
+
+# Callbacks waiting for the event `update_event` is changing to be written
+_after_write: ContextVar[Optional[list[Callable[[], None]]]] = ContextVar("after_write", default=None)
+
+def after_write(callback: Callable[[], None]) -> None:
+    """
+    Runs a side effect of a change, like sending an inference job, only once the change is written.
+
+    Args:
+        callback (Callable[[], None]): The side effect. Inside an `update` passed to `update_event`
+            it runs after the write that wins, and never for attempts that lose the race.
+            Anywhere else it runs right away.
+    """
+    pending = _after_write.get()
+    if pending is None:
+        callback()
+    else:
+        pending.append(callback)
+
+def _run_after_write(callbacks: list[Callable[[], None]]) -> None:
+    # The event is already written, so a failing callback must not fail the request that wrote it
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            print(f"After write callback failed: {e}")
+
+def update_event(
+    eventid: str,
+    update: Callable[[HairstyleChangeEvent], T],
+    account_identifier: Optional[str] = None,
+    check_timeout: bool = True,
+    ) -> T:
+    """
+    Changes an event without losing concurrent writes, using optimistic concurrency.
+
+    Args:
+        eventid (str): The ID of the event.
+        update (Callable[[HairstyleChangeEvent], T]): Changes the loaded event in place.
+            It is called again on a freshly loaded event every time the write loses a race,
+            so side effects outside of the event must go through `after_write`.
+        account_identifier (Optional[str]): The identifier of the account.
+            If it is supplied, the account must have an event with the specified ID.
+        check_timeout (bool): Whether to raise for an event that has timed out.
+
+    Returns:
+        result (T): What `update` returned for the event that was written.
+
+    Raises:
+        VersionConflict: If the write lost the race `UPDATE_ATTEMPTS` times in a row.
+        
+    If `update` raises, nothing is written and the exception is passed on.
+    """
+    for attempt in range(UPDATE_ATTEMPTS):
+        # Archived events are read only, so they are not looked for
+        event = get_event(eventid, account_identifier, check_timeout, include_archived=False)
+        expected_version = event.version
+        
+        pending: list[Callable[[], None]] = []
+        token = _after_write.set(pending)
+        try:
+            result = update(event)
+        finally:
+            _after_write.reset(token)
+        
+        # Blends that got their result in this change are stamped with the version it is written as
+        for inference_event in event.blend_inferences or []:
+            if inference_event.result is not None and inference_event.result_version is None:
+                inference_event.result_version = expected_version + 1
+        
+        if get_store().compare_and_swap(event, expected_version):
+            _index_event(event)
+            _run_after_write(pending)
+            return result
+        
+        # Jittered backoff so the writers that lost do not all collide again
+        time.sleep(random.uniform(0, min(0.05, 0.001 * 2 ** attempt)))
+    
+    raise VersionConflict(f"Could not update event {eventid} after {UPDATE_ATTEMPTS} attempts")
+
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import typing
+from typing import Optional
+
+from hairstyle_creation import metrics
+
+
+class Subscription:
+    """
+    Wakes one waiting request when its event is published, see `EventNotifier.subscribe`.
+    """
+
+    def __init__(self, notifier: "EventNotifier", eventid: str):
+        self.notifier = notifier
+        self.eventid = eventid
+        self._loop = asyncio.get_running_loop()
+        self._published = asyncio.Event()
+
+    def _set(self) -> None:
+        # Published from whichever thread wrote the event
+        try:
+            self._loop.call_soon_threadsafe(self._published.set)
+        except RuntimeError:
+            # The request's loop has closed
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Args:
+            timeout (float): The most seconds to wait.
+
+        Returns:
+            bool: True if the event was published since the last wait, False if it timed out.
+        """
+        try:
+            await asyncio.wait_for(self._published.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        self._published.clear()
+        return True
+
+    def close(self) -> None:
+        self.notifier._unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+
+class EventNotifier:
+    """
+    Fans out "this event changed" to the requests waiting on it in this process.
+
+    Nothing is sent between processes, so waiters also look at the store every so often
+    to catch results that were posted to another process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._stats = {"published": 0, "delivered": 0}
+
+    def subscribe(self, eventid: str) -> Subscription:
+        """
+        Starts listening for an event, before its state is read so no publish in between is missed.
+        Must be called from the request's event loop.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            subscription (Subscription): Close it, or use it as a context manager, when done waiting.
+        """
+        subscription = Subscription(self, eventid)
+        with self._lock:
+            self._subscriptions.setdefault(eventid, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.eventid)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.eventid]
+
+    def publish(self, eventid: str) -> int:
+        """
+        Wakes every request waiting on an event, call it once a change to it is written.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            delivered (int): The number of requests woken.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(eventid, ()))
+            self._stats["published"] += 1
+            self._stats["delivered"] += len(subscriptions)
+
+        for subscription in subscriptions:
+            subscription._set()
+
+        return len(subscriptions)
+
+    def stats(self) -> dict[str, typing.Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "waiting": sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            }
+
+_notifier: Optional[EventNotifier] = None
+_notifier_lock = threading.Lock()
+
+def get_notifier() -> EventNotifier:
+    """
+    Returns:
+        notifier (EventNotifier): The process wide notifier, created on first use.
+    """
+    global _notifier
+
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = EventNotifier()
+
+    return _notifier
+
+def _notification_stats() -> dict[str, typing.Any]:
+    notifier = _notifier
+    return notifier.stats() if notifier is not None else {}
+
+metrics.register("notifications", _notification_stats)
@@ -0,0 +1,243 @@
+from abc import ABC, abstractmethod
+import threading
+import time
+import typing
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class QueueMessage(BaseModel):
+    """
+    A message handed out by `JobQueue.receive`, hidden from other receivers until it is acked,
+    nacked or its visibility timeout runs out.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    message_id: str
+    body: str
+
+    # Identifies this delivery of the message, a message received again gets a new one
+    receipt: str
+    receive_count: int = 1
+
+class SendResult(BaseModel):
+    """
+    What happened to each message of a `JobQueue.send_batch`.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    sent: list[str] = []
+    # Why each message that was not sent failed, by its ID
+    failed: dict[str, str] = {}
+
+class QueueDepth(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    # Messages waiting to be received, including delayed ones
+    visible: int
+    # Messages received but not acked yet
+    in_flight: int
+
+
+class JobQueue(ABC):
+    """
+    At least once delivery of inference jobs to the GPU workers.
+
+    A received message is hidden for its visibility timeout. A worker that crashes before
+    acking it lets the timeout run out, and the message is handed to the next receiver.
+    """
+
+    # The most messages sent in one round trip
+    max_batch_size: Optional[int] = None
+
+    def __init__(self, batch_size: int = 10):
+        """
+        Args:
+            batch_size (int): The most messages `send_batch` sends in one round trip, capped at what the backend takes.
+        """
+        if self.max_batch_size is not None:
+            batch_size = min(batch_size, self.max_batch_size)
+        self.batch_size = max(1, batch_size)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "sent": 0,
+            "send_failed": 0,
+            "send_calls": 0,
+            "send_seconds_total": 0.0,
+            "send_seconds_max": 0.0,
+            "received": 0,
+            "acked": 0,
+            "nacked": 0,
+        }
+
+    def send(self, message_id: str, body: str, delay: float = 0.0) -> None:
+        """
+        Adds one message to the queue.
+
+        Args:
+            message_id (str): Identifies the message to receivers, usually the inference event ID.
+            body (str): The message.
+            delay (float): Seconds before the message can be received.
+
+        Raises:
+            RuntimeError: If the message was not sent.
+        """
+        result = self.send_batch([(message_id, body)], delay=delay)
+        if result.failed:
+            raise RuntimeError(f"Message {message_id} was not sent: {result.failed[message_id]}")
+
+    def send_batch(self, messages: list[tuple[str, str]], delay: float = 0.0) -> SendResult:
+        """
+        Adds several messages to the queue, `batch_size` of them per round trip.
+
+        Args:
+            messages (list[tuple[str, str]]): The ID and body of each message.
+            delay (float): Seconds before the messages can be received.
+
+        Returns:
+            result (SendResult): Which messages were sent and which failed. A round trip
+                that fails as a whole fails each of its messages, the other round trips still go ahead.
+        """
+        sent = []
+        failed = {}
+
+        for start in range(0, len(messages), self.batch_size):
+            batch = messages[start:start + self.batch_size]
+
+            begin = time.perf_counter()
+            try:
+                batch_failed = self._send_batch(batch, delay)
+            except Exception as e:
+                batch_failed = {message_id: str(e) for message_id, _ in batch}
+            elapsed = time.perf_counter() - begin
+
+            for message_id, _ in batch:
+                if message_id in batch_failed:
+                    failed[message_id] = batch_failed[message_id]
+                else:
+                    sent.append(message_id)
+
+            with self._stats_lock:
+                self._stats["sent"] += len(batch) - len(batch_failed)
+                self._stats["send_failed"] += len(batch_failed)
+                self._stats["send_calls"] += 1
+                self._stats["send_seconds_total"] += elapsed
+                self._stats["send_seconds_max"] = max(self._stats["send_seconds_max"], elapsed)
+
+        return SendResult(sent=sent, failed=failed)
+
+    def receive(
+        self,
+        max_messages: int = 1,
+        visibility_timeout: Optional[float] = None,
+        wait_time: float = 0.0,
+        ) -> list[QueueMessage]:
+        """
+        Takes the oldest visible messages off the queue until they are acked.
+
+        Args:
+            max_messages (int): The most messages to return.
+            visibility_timeout (Optional[float]): Seconds the messages stay hidden, defaults to the queue's.
+            wait_time (float): Seconds to wait for a message if none is visible yet.
+
+        Returns:
+            messages (list[QueueMessage]): The received messages, empty if none arrived in time.
+        """
+        messages = self._receive(max_messages, visibility_timeout, wait_time)
+
+        with self._stats_lock:
+            self._stats["received"] += len(messages)
+
+        return messages
+
+    def ack(self, receipt: str) -> bool:
+        """
+        Removes a received message for good, once its job is done.
+
+        Args:
+            receipt (str): The receipt of the message.
+
+        Returns:
+            bool: False if the receipt is stale because the message timed out and was received again.
+        """
+        acked = self._ack(receipt)
+
+        with self._stats_lock:
+            self._stats["acked"] += int(acked)
+
+        return acked
+
+    def nack(self, receipt: str, delay: float = 0.0) -> bool:
+        """
+        Gives a received message back to the queue without waiting for its visibility timeout.
+
+        Args:
+            receipt (str): The receipt of the message.
+            delay (float): Seconds before the message can be received again.
+
+        Returns:
+            bool: False if the receipt is stale because the message timed out and was received again.
+        """
+        nacked = self._nack(receipt, delay)
+
+        with self._stats_lock:
+            self._stats["nacked"] += int(nacked)
+
+        return nacked
+
+    def stats(self) -> dict[str, typing.Any]:
+        """
+        Returns:
+            stats (dict[str, typing.Any]): The counters and enqueue latency of this queue in this process.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        stats["send_seconds_mean"] = stats["send_seconds_total"] / stats["send_calls"] if stats["send_calls"] else 0.0
+        return stats
+
+    @abstractmethod
+    def _send_batch(self, messages: list[tuple[str, str]], delay: float) -> dict[str, str]:
+        """
+        Sends at most `batch_size` messages in one round trip.
+
+        Returns:
+            failed (dict[str, str]): Why each message that was not sent failed, by its ID.
+
+        Raises:
+            Exception: If the round trip failed as a whole.
+        """
+
+    @abstractmethod
+    def _receive(self, max_messages: int, visibility_timeout: Optional[float], wait_time: float) -> list[QueueMessage]:
+        ...
+
+    @abstractmethod
+    def _ack(self, receipt: str) -> bool:
+        ...
+
+    @abstractmethod
+    def _nack(self, receipt: str, delay: float) -> bool:
+        ...
+
+    @abstractmethod
+    def depth(self) -> QueueDepth:
+        """
+        Returns:
+            depth (QueueDepth): How many messages are waiting and in flight, approximate for remote queues.
+        """
+
+    @abstractmethod
+    def discard(self, message_ids: list[str]) -> int:
+        """
+        Removes messages that have not been received yet, for jobs that are no longer needed.
+
+        Args:
+            message_ids (list[str]): The IDs the messages were sent with.
+
+        Returns:
+            discarded (int): The number of messages removed. Queues that can only remove
+                received messages return 0, and their workers drop jobs of finished events instead.
+        """
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+from uuid import uuid4
+
+from hairstyle_creation.queues.base import JobQueue, QueueDepth, QueueMessage
+
+# How often a receive waiting for messages looks again
+POLL_INTERVAL = 0.05
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Job queue in a SQLite database, with the same visibility timeouts as SQS.
+
+    Every process on the machine shares it, so the whole pipeline runs and can be load tested
+    without a network. Several queues can live in the same database, told apart by their name.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str = "database/queues.sqlite3",
+        visibility_timeout: float = 30.0,
+        batch_size: int = 100,
+        timeout: float = 30.0,
+        clock: Callable[[], float] = time.time,
+        ):
+        super().__init__(batch_size=batch_size)
+        self.name = name
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.timeout = timeout
+        self.clock = clock
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "queue TEXT NOT NULL, "
+            "message_id TEXT NOT NULL, "
+            "body TEXT NOT NULL, "
+            "sent_at REAL NOT NULL, "
+            "visible_at REAL NOT NULL, "
+            "receipt TEXT, "
+            "receive_count INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (queue, message_id)"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (queue, visible_at, sent_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_receipt ON jobs (receipt)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _send_batch(self, messages: list[tuple[str, str]], delay: float) -> dict[str, str]:
+        now = self.clock()
+        conn = self._connection()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Sending a message ID that is still queued again leaves the queued one as it is
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (queue, message_id, body, sent_at, visible_at) VALUES (?, ?, ?, ?, ?)",
+                [(self.name, message_id, body, now, now + delay) for message_id, body in messages],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # The batch is one transaction, so it is either sent as a whole or raises
+        return {}
+
+    def _receive_visible(self, max_messages: int, visibility_timeout: float) -> list[QueueMessage]:
+        now = self.clock()
+        conn = self._connection()
+
+        # The write lock is taken up front so two receivers can not both take the same message
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT message_id, body, receive_count FROM jobs WHERE queue = ? AND visible_at <= ? "
+                "ORDER BY visible_at, sent_at LIMIT ?",
+                (self.name, now, max_messages),
+            ).fetchall()
+
+            messages = []
+            for message_id, body, receive_count in rows:
+                receipt = uuid4().hex
+                conn.execute(
+                    "UPDATE jobs SET receipt = ?, visible_at = ?, receive_count = ? WHERE queue = ? AND message_id = ?",
+                    (receipt, now + visibility_timeout, receive_count + 1, self.name, message_id),
+                )
+                messages.append(QueueMessage(
+                    message_id=message_id,
+                    body=body,
+                    receipt=receipt,
+                    receive_count=receive_count + 1,
+                ))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return messages
+
+    def _receive(self, max_messages: int, visibility_timeout: Optional[float], wait_time: float) -> list[QueueMessage]:
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+
+        deadline = time.monotonic() + wait_time
+        while True:
+            messages = self._receive_visible(max_messages, visibility_timeout)
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(POLL_INTERVAL)
+
+    def _ack(self, receipt: str) -> bool:
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE queue = ? AND receipt = ?",
+            (self.name, receipt),
+        )
+        return cursor.rowcount > 0
+
+    def _nack(self, receipt: str, delay: float) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE jobs SET visible_at = ?, receipt = NULL WHERE queue = ? AND receipt = ?",
+            (self.clock() + delay, self.name, receipt),
+        )
+        return cursor.rowcount > 0
+
+    def depth(self) -> QueueDepth:
+        now = self.clock()
+        visible, in_flight = self._connection().execute(
+            "SELECT "
+            "COALESCE(SUM(receipt IS NULL OR visible_at <= ?), 0), "
+            "COALESCE(SUM(receipt IS NOT NULL AND visible_at > ?), 0) "
+            "FROM jobs WHERE queue = ?",
+            (now, now, self.name),
+        ).fetchone()
+        return QueueDepth(visible=visible, in_flight=in_flight)
+
+    def discard(self, message_ids: list[str]) -> int:
+        now = self.clock()
+        conn = self._connection()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            discarded = 0
+            for message_id in message_ids:
+                # Messages a worker is holding are left for it to ack
+                discarded += conn.execute(
+                    "DELETE FROM jobs WHERE queue = ? AND message_id = ? AND (receipt IS NULL OR visible_at <= ?)",
+                    (self.name, message_id, now),
+                ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return discarded
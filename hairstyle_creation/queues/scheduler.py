@@ -0,0 +1,235 @@
+from collections import deque
+from datetime import datetime
+import threading
+import time
+import typing
+from typing import Callable, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+from hairstyle_creation.models import InferenceJob
+from hairstyle_creation.queues.base import JobQueue, QueueMessage
+
+# How often a scheduler waiting for jobs looks at the queues again
+POLL_INTERVAL = 0.05
+# Queue waits kept per class for the percentiles
+WAIT_SAMPLES = 1024
+
+
+class ScheduledJob(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    priority_class: str
+    message: QueueMessage
+    job: InferenceJob
+
+def job_cost(job: InferenceJob) -> int:
+    """
+    Args:
+        job (InferenceJob): A queued job.
+
+    Returns:
+        cost (int): The GPU passes the job takes, one per blend of a coalesced job.
+    """
+    return len(job.targets) if job.targets else 1
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class _PriorityClass:
+    def __init__(self, name: str, queue: JobQueue):
+        self.name = name
+        self.queue = queue
+
+        # Received jobs waiting to be handed out, by account
+        self.pending: dict[str, deque[tuple[QueueMessage, InferenceJob]]] = {}
+        # Accounts with pending jobs in round robin order, the current one first
+        self.active: deque[str] = deque()
+        self.deficits: dict[str, int] = {}
+        # Whether the account at the front of `active` was given its quantum for this turn
+        self.in_turn = False
+        self.buffered = 0
+
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.dispatched = 0
+
+
+class JobScheduler:
+    """
+    Hands queued jobs to GPU workers one at a time, by priority class and then fairly between accounts.
+
+    Classes are served in strict priority order, so a blending job only goes out when no embedding job is waiting.
+    Within a class accounts take turns in deficit round robin: every turn an account earns `quantum` GPU passes
+    and spends them on its jobs, so an account that picked 30 styles gets the same share as one that picked 1.
+
+    Up to `prefetch` jobs per class are taken off the queue ahead of time to choose between, and accounts
+    share fairly among those. `prefetch` should be larger than the jobs one pick queues (coalescing keeps
+    that small), but the prefetched jobs count against their visibility timeout while they wait, so it
+    should stay well below what the workers get through in one visibility timeout.
+    """
+
+    def __init__(
+        self,
+        classes: list[tuple[str, JobQueue]],
+        quantum: int = 1,
+        prefetch: int = 32,
+        clock: Callable[[], datetime] = datetime.now,
+        max_receives: Optional[int] = None,
+        dead_letter: Optional[Callable[[str, QueueMessage, InferenceJob], None]] = None,
+        ):
+        """
+        Args:
+            classes (list[tuple[str, JobQueue]]): The name and queue of every priority class, highest priority first.
+            quantum (int): GPU passes an account earns per turn.
+            prefetch (int): The most jobs per class taken off the queue before they are handed out.
+            clock (Callable[[], datetime]): Returns the current time, for the queue waits.
+            max_receives (Optional[int]): Jobs received more often than this are not handed out again
+                but passed to `dead_letter` and acked. Defaults to no limit.
+            dead_letter (Optional[Callable[[str, QueueMessage, InferenceJob], None]]): Keeps a job given up on,
+                with the name of its class. If it raises, the job stays on its queue.
+        """
+        self.classes = [_PriorityClass(name, queue) for name, queue in classes]
+        self.quantum = max(1, quantum)
+        self.prefetch = prefetch
+        self.clock = clock
+        self.max_receives = max_receives
+        self.dead_letter = dead_letter
+        self._lock = threading.Lock()
+
+    def _fill(self, priority_class: _PriorityClass) -> None:
+        if priority_class.buffered >= self.prefetch:
+            return
+
+        for message in priority_class.queue.receive(max_messages=self.prefetch - priority_class.buffered):
+            try:
+                job = InferenceJob.model_validate_json(message.body)
+            except ValueError as e:
+                # Can never be run, so it is dropped instead of being handed out again and again
+                print(f"Dropping malformed job {message.message_id}: {e}")
+                priority_class.queue.ack(message.receipt)
+                continue
+
+            if self.max_receives is not None and message.receive_count > self.max_receives:
+                # Every worker that took it crashed or ran out of time, handing it out again only wastes GPUs
+                try:
+                    if self.dead_letter is not None:
+                        self.dead_letter(priority_class.name, message, job)
+                except Exception as e:
+                    print(f"Could not dead letter job {message.message_id}: {e}")
+                    continue
+                priority_class.queue.ack(message.receipt)
+                continue
+
+            account = job.account_identifier or ""
+            if account not in priority_class.pending:
+                priority_class.pending[account] = deque()
+                priority_class.active.append(account)
+                priority_class.deficits[account] = 0
+
+            priority_class.pending[account].append((message, job))
+            priority_class.buffered += 1
+
+    def _remove_account(self, priority_class: _PriorityClass, account: str) -> None:
+        priority_class.active.popleft()
+        del priority_class.pending[account]
+        # An account that runs out of jobs does not keep its unspent passes
+        del priority_class.deficits[account]
+        priority_class.in_turn = False
+
+    def _next_in_class(self, priority_class: _PriorityClass) -> Optional[tuple[QueueMessage, InferenceJob]]:
+        while priority_class.active:
+            account = priority_class.active[0]
+            jobs = priority_class.pending[account]
+
+            if not priority_class.in_turn:
+                priority_class.deficits[account] += self.quantum
+                priority_class.in_turn = True
+
+            cost = job_cost(jobs[0][1])
+            if cost <= priority_class.deficits[account]:
+                priority_class.deficits[account] -= cost
+                priority_class.buffered -= 1
+                scheduled = jobs.popleft()
+                if not jobs:
+                    self._remove_account(priority_class, account)
+                return scheduled
+
+            # Its passes are used up for this turn, the next account goes
+            priority_class.in_turn = False
+            priority_class.active.rotate(-1)
+
+        return None
+
+    def next_job(self, wait_time: float = 0.0) -> Optional[ScheduledJob]:
+        """
+        Picks the job a worker should run next.
+
+        Args:
+            wait_time (float): Seconds to wait for a job if none is queued.
+
+        Returns:
+            Optional[ScheduledJob]: The job with its queue message, which must be passed to `ack` or `nack`,
+                or None if no job arrived in time.
+        """
+        deadline = time.monotonic() + wait_time
+
+        while True:
+            with self._lock:
+                for priority_class in self.classes:
+                    self._fill(priority_class)
+                    scheduled = self._next_in_class(priority_class)
+                    if scheduled is None:
+                        continue
+
+                    message, job = scheduled
+                    priority_class.dispatched += 1
+                    if job.queue_timestamp is not None:
+                        priority_class.waits.append(max(0.0, (self.clock() - job.queue_timestamp).total_seconds()))
+
+                    return ScheduledJob(priority_class=priority_class.name, message=message, job=job)
+
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def _queue(self, scheduled: ScheduledJob) -> JobQueue:
+        return next(priority_class.queue for priority_class in self.classes if priority_class.name == scheduled.priority_class)
+
+    def ack(self, scheduled: ScheduledJob) -> bool:
+        """
+        Removes a job that is done from its queue, see `JobQueue.ack`.
+        """
+        return self._queue(scheduled).ack(scheduled.message.receipt)
+
+    def nack(self, scheduled: ScheduledJob, delay: float = 0.0) -> bool:
+        """
+        Gives a job back to its queue, see `JobQueue.nack`.
+        """
+        return self._queue(scheduled).nack(scheduled.message.receipt, delay)
+
+    def stats(self) -> dict[str, typing.Any]:
+        """
+        Returns:
+            stats (dict[str, typing.Any]): For every class the jobs handed out, the jobs buffered and
+                the queue wait percentiles in seconds of the recently handed out jobs.
+        """
+        with self._lock:
+            classes = [
+                (priority_class.name, priority_class.dispatched, priority_class.buffered, list(priority_class.waits))
+                for priority_class in self.classes
+            ]
+
+        return {
+            name: {
+                "dispatched": dispatched,
+                "buffered": buffered,
+                "wait_p50": percentile(waits, 0.5),
+                "wait_p90": percentile(waits, 0.9),
+                "wait_p99": percentile(waits, 0.99),
+            }
+            for name, dispatched, buffered, waits in classes
+        }
@@ -0,0 +1,135 @@
+import threading
+import typing
+from typing import Optional
+
+from django.core.exceptions import ImproperlyConfigured
+
+from hairstyle_creation.queues.base import JobQueue, QueueDepth, QueueMessage
+
+# The most messages SQS takes or returns in one call
+SQS_BATCH_SIZE = 10
+# The longest SQS long polls
+SQS_MAX_WAIT_SECONDS = 20
+
+
+class SQSJobQueue(JobQueue):
+    """
+    Job queue on Amazon SQS, or anything that speaks its API.
+
+    boto3 is only imported when the queue is first used, so it is only needed where SQS is configured.
+    """
+
+    max_batch_size = SQS_BATCH_SIZE
+
+    def __init__(
+        self,
+        queue_url: str,
+        visibility_timeout: Optional[float] = None,
+        batch_size: int = SQS_BATCH_SIZE,
+        **client_options: typing.Any,
+        ):
+        """
+        Args:
+            queue_url (str): The URL of the queue.
+            visibility_timeout (Optional[float]): Seconds received messages stay hidden, defaults to the queue's own setting.
+            batch_size (int): The most messages sent in one call, SQS takes at most 10.
+            client_options: Passed on to `boto3.client("sqs", ...)`, e.g. `region_name` or `endpoint_url`.
+        """
+        super().__init__(batch_size=batch_size)
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.client_options = client_options
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def client(self) -> typing.Any:
+        # boto3 clients are thread safe, so the process shares one
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    try:
+                        import boto3
+                    except ImportError as e:
+                        raise ImproperlyConfigured("SQSJobQueue needs boto3, install it with `pip install boto3`") from e
+
+                    self._client = boto3.client("sqs", **self.client_options)
+
+        return self._client
+
+    def _send_batch(self, messages: list[tuple[str, str]], delay: float) -> dict[str, str]:
+        response = self.client().send_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[
+                {
+                    # Batch entry IDs only have to be unique within the call
+                    "Id": str(i),
+                    "MessageBody": body,
+                    "DelaySeconds": int(delay),
+                    "MessageAttributes": {"message_id": {"DataType": "String", "StringValue": message_id}},
+                }
+                for i, (message_id, body) in enumerate(messages)
+            ],
+        )
+
+        return {
+            messages[int(entry["Id"])][0]: entry.get("Message", entry.get("Code", "Failed"))
+            for entry in response.get("Failed", [])
+        }
+
+    def _receive(self, max_messages: int, visibility_timeout: Optional[float], wait_time: float) -> list[QueueMessage]:
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+
+        options = {}
+        if visibility_timeout is not None:
+            options["VisibilityTimeout"] = int(visibility_timeout)
+
+        response = self.client().receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max(1, min(max_messages, SQS_BATCH_SIZE)),
+            WaitTimeSeconds=min(int(wait_time), SQS_MAX_WAIT_SECONDS),
+            MessageAttributeNames=["message_id"],
+            AttributeNames=["ApproximateReceiveCount"],
+            **options,
+        )
+
+        messages = []
+        for message in response.get("Messages", []):
+            attributes = message.get("MessageAttributes", {})
+            message_id = attributes.get("message_id", {}).get("StringValue", message["MessageId"])
+
+            messages.append(QueueMessage(
+                message_id=message_id,
+                body=message["Body"],
+                receipt=message["ReceiptHandle"],
+                receive_count=int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1)),
+            ))
+
+        return messages
+
+    def _ack(self, receipt: str) -> bool:
+        self.client().delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+        return True
+
+    def _nack(self, receipt: str, delay: float) -> bool:
+        self.client().change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=receipt,
+            VisibilityTimeout=int(delay),
+        )
+        return True
+
+    def depth(self) -> QueueDepth:
+        attributes = self.client().get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesDelayed", "ApproximateNumberOfMessagesNotVisible"],
+        )["Attributes"]
+
+        return QueueDepth(
+            visible=int(attributes["ApproximateNumberOfMessages"]) + int(attributes["ApproximateNumberOfMessagesDelayed"]),
+            in_flight=int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+        )
+
+    def discard(self, message_ids: list[str]) -> int:
+        # SQS can only delete messages it has handed out, with their receipt
+        return 0
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+from hairstyle_creation.models import EventSummary, HairstyleChangeEvent
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _start_key(start: datetime) -> int:
+    if start.tzinfo is not None:
+        start = start.astimezone().replace(tzinfo=None)
+    return (start - _EPOCH) // _MICROSECOND
+
+
+class AccountIndex:
+    """
+    Secondary index from an account to its events, newest first, with a summary of each.
+
+    Listing an account reads one range of a SQLite B-tree and never loads the events themselves.
+    Pages are found with a keyset cursor, so a page deep into the history costs the same as the first.
+    """
+
+    def __init__(self, path: str = "database/accounts.sqlite3", timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS account_events ("
+            "eventid TEXT PRIMARY KEY, "
+            "account_identifier TEXT NOT NULL, "
+            "start INTEGER NOT NULL, "
+            "version INTEGER NOT NULL, "
+            "summary TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS account_events_history "
+            "ON account_events (account_identifier, start, eventid)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, event: HairstyleChangeEvent) -> None:
+        """
+        Adds an event to its account's history, or updates its summary.
+
+        Args:
+            event (HairstyleChangeEvent): The event as it was just written.
+
+        Writes that reach the index out of order never replace a newer version's summary.
+        """
+        self._connection().execute(
+            "INSERT INTO account_events (eventid, account_identifier, start, version, summary) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (eventid) DO UPDATE SET "
+            "account_identifier = excluded.account_identifier, start = excluded.start, "
+            "version = excluded.version, summary = excluded.summary "
+            "WHERE excluded.version >= account_events.version",
+            (
+                event.eventid,
+                event.account_identifier,
+                _start_key(event.start_timestamp),
+                event.version,
+                EventSummary.from_event(event).model_dump_json(),
+            ),
+        )
+
+    def remove(self, eventid: str) -> None:
+        """
+        Removes an event from its account's history.
+
+        Args:
+            eventid (str): The ID of the event.
+        """
+        self._connection().execute("DELETE FROM account_events WHERE eventid = ?", (eventid,))
+
+    def remove_range(self, low: str, high: str) -> int:
+        """
+        Removes every event whose ID is in a range from its account's history.
+
+        Args:
+            low (str): The first ID of the range.
+            high (str): Past the last ID of the range.
+
+        Returns:
+            removed (int): The number of events removed.
+        """
+        return self._connection().execute(
+            "DELETE FROM account_events WHERE eventid >= ? AND eventid < ?",
+            (low, high),
+        ).rowcount
+
+    def page(
+        self,
+        account_identifier: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        ) -> tuple[list[EventSummary], Optional[str]]:
+        """
+        Lists one page of an account's events, newest first.
+
+        Args:
+            account_identifier (str): The identifier of the account.
+            limit (int): The most events to return.
+            cursor (Optional[str]): The `next_cursor` of the previous page, None for the first page.
+
+        Returns:
+            summaries (list[EventSummary]): The summaries of the events on the page.
+            next_cursor (Optional[str]): Fetches the page after this one, None if this is the last page.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        if cursor is None:
+            rows = self._connection().execute(
+                "SELECT start, eventid, summary FROM account_events WHERE account_identifier = ? "
+                "ORDER BY start DESC, eventid DESC LIMIT ?",
+                (account_identifier, limit + 1),
+            ).fetchall()
+        else:
+            start, _, eventid = cursor.partition("_")
+            rows = self._connection().execute(
+                "SELECT start, eventid, summary FROM account_events WHERE account_identifier = ? "
+                "AND (start, eventid) < (?, ?) ORDER BY start DESC, eventid DESC LIMIT ?",
+                (account_identifier, int(start), eventid, limit + 1),
+            ).fetchall()
+
+        # One row more than the page is fetched to know whether there is a next page
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1][0]}_{rows[-1][1]}"
+
+        return [EventSummary.model_validate_json(summary) for _, _, summary in rows], next_cursor
+
+    def rebuild(self, events: Iterable[HairstyleChangeEvent]) -> int:
+        """
+        Records every given event, for events written before the index existed or while it was failing.
+
+        Args:
+            events (Iterable[HairstyleChangeEvent]): The events to record.
+
+        Returns:
+            recorded (int): The number of events recorded.
+        """
+        recorded = 0
+        for event in events:
+            self.record(event)
+            recorded += 1
+        return recorded
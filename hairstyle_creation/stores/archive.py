@@ -0,0 +1,201 @@
+import os
+import re
+import sqlite3
+import struct
+import threading
+from typing import Iterable, Iterator, Optional
+import zlib
+
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.codec import decode_event, get_codec
+from hairstyle_creation.stores.locks import file_lock
+
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.seg$")
+
+# Every record is its compressed length and CRC followed by the compressed event
+_FRAME = struct.Struct("<II")
+
+
+class EventArchive:
+    """
+    Append-only archive of events that left the live store, in compressed segment files.
+
+    Each event is compressed on its own, so fetching one only decompresses that event.
+    A SQLite index maps every event ID to its record's segment and offset.
+    Segments are only ever appended to, and a new one is started once the current one
+    reaches `segment_bytes`, so reading the whole archive is sequential.
+
+    An event archived again (after it changed in the live store) is appended once more,
+    and the index points at the newest copy.
+    """
+
+    def __init__(
+        self,
+        directory: str = "database/archive/",
+        segment_bytes: int = 64 * 1024 * 1024,
+        codec: str = "json",
+        compression_level: int = 6,
+        timeout: float = 30.0,
+        ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.codec = get_codec(codec)
+        self.compression_level = compression_level
+        self.timeout = timeout
+        self.index_path = os.path.join(directory, "index.sqlite3")
+        self.lock_path = os.path.join(directory, ".lock")
+        self._local = threading.local()
+
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS archived ("
+            "eventid TEXT PRIMARY KEY, "
+            "segment INTEGER NOT NULL, "
+            "offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS archived_segment ON archived (segment, offset)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.index_path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.seg")
+
+    def segments(self) -> list[int]:
+        """
+        Returns:
+            segments (list[int]): The numbers of every segment file, oldest first.
+        """
+        return sorted(
+            int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(self.directory))
+            if match is not None
+        )
+
+    def append(self, events: Iterable[HairstyleChangeEvent]) -> int:
+        """
+        Appends events to the current segment and indexes them.
+
+        Args:
+            events (Iterable[HairstyleChangeEvent]): The events to archive.
+
+        Returns:
+            archived (int): The number of events appended.
+
+        The records are synced to disk before they are indexed, and only indexed events count
+        as archived, so a crash part way leaves at most some unreferenced bytes in the segment.
+        """
+        frames = []
+        for event in events:
+            compressed = zlib.compress(self.codec.encode(event), self.compression_level)
+            frames.append((event.eventid, _FRAME.pack(len(compressed), zlib.crc32(compressed)) + compressed))
+
+        if not frames:
+            return 0
+
+        with file_lock(self.lock_path):
+            segments = self.segments()
+            segment = segments[-1] if segments else 1
+            path = self._segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                segment += 1
+                path = self._segment_path(segment)
+
+            rows = []
+            with open(path, "ab") as f:
+                offset = f.tell()
+                for eventid, frame in frames:
+                    f.write(frame)
+                    rows.append((eventid, segment, offset, len(frame)))
+                    offset += len(frame)
+                f.flush()
+                os.fsync(f.fileno())
+
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT INTO archived (eventid, segment, offset, length) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (eventid) DO UPDATE SET "
+                    "segment = excluded.segment, offset = excluded.offset, length = excluded.length",
+                    rows,
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+        return len(rows)
+
+    @staticmethod
+    def _decode_frame(frame: bytes) -> HairstyleChangeEvent:
+        length, crc = _FRAME.unpack_from(frame)
+        compressed = frame[_FRAME.size:_FRAME.size + length]
+        if len(compressed) != length or zlib.crc32(compressed) != crc:
+            raise ValueError("Archived event record is corrupt")
+        return decode_event(zlib.decompress(compressed))
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        """
+        Loads one archived event, reading and decompressing only its own record.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            Optional[HairstyleChangeEvent]: The archived event, or None if it was never archived.
+        """
+        row = self._connection().execute(
+            "SELECT segment, offset, length FROM archived WHERE eventid = ?", (eventid,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        segment, offset, length = row
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(offset)
+            frame = f.read(length)
+
+        return self._decode_frame(frame)
+
+    def __contains__(self, eventid: str) -> bool:
+        row = self._connection().execute("SELECT 1 FROM archived WHERE eventid = ?", (eventid,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+
+    def iter_events(self) -> Iterator[HairstyleChangeEvent]:
+        """
+        Reads every archived event one segment at a time, in the order they were archived.
+
+        Yields:
+            event (HairstyleChangeEvent): The newest archived copy of every event.
+        """
+        conn = self._connection()
+
+        for segment in self.segments():
+            # Walks the segment by its index rather than by the frames themselves,
+            # so superseded copies and a record cut off by a crash are skipped
+            rows = conn.execute(
+                "SELECT offset, length FROM archived WHERE segment = ? ORDER BY offset", (segment,)
+            ).fetchall()
+            if not rows:
+                continue
+
+            with open(self._segment_path(segment), "rb") as f:
+                for offset, length in rows:
+                    if f.tell() != offset:
+                        f.seek(offset)
+                    yield self._decode_frame(f.read(length))
@@ -0,0 +1,148 @@
+from abc import ABC, abstractmethod
+import typing
+from typing import Hashable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from pydantic import BaseModel
+
+from hairstyle_creation.models import HairstyleChangeEvent
+
+
+def clone(value: typing.Any) -> typing.Any:
+    """
+    Copies the mutable parts of an event that is handed to several callers, so each can change its copy freely.
+
+    Frozen models can not be changed, so they are shared instead of copied.
+    """
+    if isinstance(value, BaseModel):
+        if value.model_config.get("frozen"):
+            return value
+
+        copied = value.model_copy()
+        for name, field_value in value.__dict__.items():
+            if isinstance(field_value, (BaseModel, list)):
+                copied.__dict__[name] = clone(field_value)
+        return copied
+
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+
+    return value
+
+
+class EventStore(ABC):
+    """
+    Storage backend for `HairstyleChangeEvent`s.
+
+    Every write bumps `HairstyleChangeEvent.version`, which is what
+    `compare_and_swap` checks against to detect concurrent writers.
+    """
+
+    @abstractmethod
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        """
+        Loads an event from the store.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            Optional[HairstyleChangeEvent]: The stored event, or None if it does not exist.
+        """
+
+    async def aget(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        """
+        Loads an event from the store without blocking the event loop.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            Optional[HairstyleChangeEvent]: The stored event, or None if it does not exist.
+
+        Backends without async I/O read in a thread of the pool shared by every request,
+        rather than the single thread `sync_to_async` runs everything in by default.
+        """
+        return await sync_to_async(self.get, thread_sensitive=False)(eventid)
+
+    @abstractmethod
+    def put(self, event: HairstyleChangeEvent) -> None:
+        """
+        Writes an event unconditionally, bumping its version.
+
+        Args:
+            event (HairstyleChangeEvent): The event to write.
+        """
+
+    @abstractmethod
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        """
+        Writes an event only if the stored version still matches.
+
+        Args:
+            event (HairstyleChangeEvent): The event to write.
+            expected_version (int): The version the event had when it was loaded.
+                A version of 0 means the event must not exist yet.
+
+        Returns:
+            bool: True if the event was written, False if another writer got there first.
+        """
+
+    @abstractmethod
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        """
+        Cheaply identifies the currently stored revision of an event without loading it.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            Optional[Hashable]: A token that changes whenever the event is written, or None if it does not exist.
+        """
+
+    async def astamp(self, eventid: str) -> Optional[Hashable]:
+        """
+        The async `stamp`, see `aget`.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            Optional[Hashable]: A token that changes whenever the event is written, or None if it does not exist.
+        """
+        return await sync_to_async(self.stamp, thread_sensitive=False)(eventid)
+
+    @abstractmethod
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        """
+        Returns the stamp of an event this thread has just written.
+
+        Args:
+            event (HairstyleChangeEvent): The event passed to the last `put` or successful `compare_and_swap`.
+
+        Returns:
+            Optional[Hashable]: The stamp `stamp` returns for that write, or None if it is not known.
+        """
+
+    @abstractmethod
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        """
+        Removes an event only if the stored version still matches.
+
+        Args:
+            eventid (str): The ID of the event.
+            expected_version (int): The version the event had when it was loaded.
+
+        Returns:
+            bool: True if the event was removed, False if it does not exist or was written since.
+        """
+
+    @abstractmethod
+    def iter_eventids(self) -> Iterator[str]:
+        """
+        Lists the IDs of every stored event, without loading the events.
+
+        Yields:
+            eventid (str): The ID of a stored event. Events written or removed while
+                iterating may or may not be listed.
+        """
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+import time
+import typing
+from typing import Callable
+
+from hairstyle_creation.models import Hairstyle
+
+
+class BlendMemo:
+    """
+    Finished blends keyed by the embedding they were blended against and the hairstyle and color,
+    least recently used evicted first and expired after `ttl` seconds.
+
+    Re-running a preset against the same photo reuses the blended image instead of running another GPU pass.
+    """
+
+    def __init__(
+        self,
+        path: str = "database/blends.sqlite3",
+        max_entries: int = 100_000,
+        ttl: float = 7 * 24 * 3600,
+        timeout: float = 30.0,
+        clock: Callable[[], float] = time.time,
+        ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout = timeout
+        self.clock = clock
+        self._local = threading.local()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blends ("
+            "embedded_file_location TEXT NOT NULL, "
+            "hairstyle_id INTEGER NOT NULL, "
+            "color_id INTEGER NOT NULL, "
+            "result_img_location TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (embedded_file_location, hairstyle_id, color_id)"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS blends_last_used ON blends (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS blends_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO blends_size (id, size) VALUES (0, 0)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, embedded_file_location: str, hairstyles: list[Hairstyle]) -> dict[tuple[int, int], str]:
+        """
+        Finds the blends of several hairstyles against one embedding and marks them as recently used.
+
+        Args:
+            embedded_file_location (str): Where the embedding is stored.
+            hairstyles (list[Hairstyle]): The hairstyles to look up.
+
+        Returns:
+            blends (dict[tuple[int, int], str]): The blended image location by hairstyle and color ID,
+                for the hairstyles that were found and have not expired.
+        """
+        if not hairstyles:
+            return {}
+
+        now = self.clock()
+        conn = self._connection()
+        keys = {(hairstyle.hairstyle_id, hairstyle.color_id) for hairstyle in hairstyles}
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT hairstyle_id, color_id, result_img_location, stored_at FROM blends "
+                f"WHERE embedded_file_location = ? AND (hairstyle_id, color_id) IN (VALUES {', '.join(['(?, ?)'] * len(keys))})",
+                (embedded_file_location, *(value for key in keys for value in key)),
+            ).fetchall()
+
+            blends = {}
+            expired = []
+            for hairstyle_id, color_id, result_img_location, stored_at in rows:
+                if now - stored_at > self.ttl:
+                    expired.append((embedded_file_location, hairstyle_id, color_id))
+                else:
+                    blends[(hairstyle_id, color_id)] = result_img_location
+
+            conn.executemany(
+                "UPDATE blends SET last_used = ? WHERE embedded_file_location = ? AND hairstyle_id = ? AND color_id = ?",
+                [(now, embedded_file_location, hairstyle_id, color_id) for hairstyle_id, color_id in blends],
+            )
+            if expired:
+                conn.executemany(
+                    "DELETE FROM blends WHERE embedded_file_location = ? AND hairstyle_id = ? AND color_id = ?",
+                    expired,
+                )
+                conn.execute("UPDATE blends_size SET size = size - ? WHERE id = 0", (len(expired),))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            self._stats["hits"] += len(blends)
+            self._stats["misses"] += len(keys) - len(blends)
+            self._stats["expired"] += len(expired)
+
+        return blends
+
+    def put(self, embedded_file_location: str, hairstyle: Hairstyle, result_img_location: str) -> None:
+        """
+        Remembers a finished blend, evicting the least recently used ones past `max_entries`.
+
+        Args:
+            embedded_file_location (str): Where the embedding the blend was made from is stored.
+            hairstyle (Hairstyle): The blended hairstyle.
+            result_img_location (str): Where the blended image is stored.
+        """
+        now = self.clock()
+        conn = self._connection()
+        key = (embedded_file_location, hairstyle.hairstyle_id, hairstyle.color_id)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM blends WHERE embedded_file_location = ? AND hairstyle_id = ? AND color_id = ?",
+                key,
+            ).fetchone() is not None
+            conn.execute(
+                "INSERT INTO blends (embedded_file_location, hairstyle_id, color_id, result_img_location, stored_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (embedded_file_location, hairstyle_id, color_id) DO UPDATE SET "
+                "result_img_location = excluded.result_img_location, stored_at = excluded.stored_at, last_used = excluded.last_used",
+                (*key, result_img_location, now, now),
+            )
+
+            evicted = 0
+            if not exists:
+                conn.execute("UPDATE blends_size SET size = size + 1 WHERE id = 0")
+                size = conn.execute("SELECT size FROM blends_size WHERE id = 0").fetchone()[0]
+                if size > self.max_entries:
+                    evicted = conn.execute(
+                        "DELETE FROM blends WHERE (embedded_file_location, hairstyle_id, color_id) IN "
+                        "(SELECT embedded_file_location, hairstyle_id, color_id FROM blends ORDER BY last_used LIMIT ?)",
+                        (size - self.max_entries,),
+                    ).rowcount
+                    conn.execute("UPDATE blends_size SET size = size - ? WHERE id = 0", (evicted,))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            self._stats["stored"] += 1
+            self._stats["evicted"] += evicted
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT size FROM blends_size WHERE id = 0").fetchone()[0]
+
+    def stats(self) -> dict[str, typing.Any]:
+        """
+        Returns:
+            stats (dict[str, typing.Any]): The lookups, hit rate, expiries and evictions of this memo in this process.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import threading
+import time
+import typing
+from typing import Hashable, Iterator, NamedTuple, Optional
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.base import EventStore, clone
+
+
+class _Entry(NamedTuple):
+    event: HairstyleChangeEvent
+    stamp: Hashable
+    expires: float
+
+
+class CachedEventStore(EventStore):
+    """
+    Keeps recently used events in memory in front of another store.
+
+    The cache is bounded by both size (least recently used entries are evicted first) and age.
+    Every hit is checked against the wrapped store's `stamp`, so writes from other processes
+    are picked up on the next read without loading the event.
+    """
+
+    def __init__(self, store: EventStore, max_entries: int = 1024, ttl: float = 30.0):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        metrics.register("event_cache", self.stats)
+
+    def stats(self) -> dict[str, typing.Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, event: HairstyleChangeEvent, stamp: Optional[Hashable]) -> None:
+        with self._lock:
+            if stamp is None:
+                self._entries.pop(event.eventid, None)
+                return
+
+            self._entries[event.eventid] = _Entry(event, stamp, time.monotonic() + self.ttl)
+            self._entries.move_to_end(event.eventid)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, eventid: str) -> None:
+        with self._lock:
+            self._entries.pop(eventid, None)
+
+    def _entry(self, eventid: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(eventid)
+
+        return entry if entry is not None and entry.expires > time.monotonic() else None
+
+    def _hit(self, entry: _Entry, stamp: Optional[Hashable]) -> Optional[HairstyleChangeEvent]:
+        with self._lock:
+            if stamp != entry.stamp:
+                self.stale += 1
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if entry.event.eventid in self._entries:
+                self._entries.move_to_end(entry.event.eventid)
+
+        return clone(entry.event)
+
+    def _loaded(self, eventid: str, event: Optional[HairstyleChangeEvent], stamp: Optional[Hashable]) -> Optional[HairstyleChangeEvent]:
+        if event is None:
+            self.invalidate(eventid)
+            return None
+
+        self._remember(clone(event), stamp)
+        return event
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        entry = self._entry(eventid)
+        if entry is not None:
+            event = self._hit(entry, self.store.stamp(eventid))
+            if event is not None:
+                return event
+        else:
+            with self._lock:
+                self.misses += 1
+
+        # The stamp is read before the event so a write in between only makes the entry look stale
+        stamp = self.store.stamp(eventid)
+        return self._loaded(eventid, self.store.get(eventid), stamp)
+
+    async def aget(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        # A hit only waits for the stamp, the event is copied from memory on the loop
+        entry = self._entry(eventid)
+        if entry is not None:
+            event = self._hit(entry, await self.store.astamp(eventid))
+            if event is not None:
+                return event
+        else:
+            with self._lock:
+                self.misses += 1
+
+        stamp = await self.store.astamp(eventid)
+        return self._loaded(eventid, await self.store.aget(eventid), stamp)
+
+    def put(self, event: HairstyleChangeEvent) -> None:
+        try:
+            self.store.put(event)
+        except BaseException:
+            self.invalidate(event.eventid)
+            raise
+
+        self._remember(clone(event), self.store.written_stamp(event))
+
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        try:
+            swapped = self.store.compare_and_swap(event, expected_version)
+        except BaseException:
+            self.invalidate(event.eventid)
+            raise
+
+        if not swapped:
+            # Whatever is cached lost the race, so the next read has to go to the store
+            self.invalidate(event.eventid)
+            return False
+
+        self._remember(clone(event), self.store.written_stamp(event))
+        return True
+
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        return self.store.stamp(eventid)
+
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        return self.store.written_stamp(event)
+
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        try:
+            return self.store.delete(eventid, expected_version)
+        finally:
+            self.invalidate(eventid)
+
+    def iter_eventids(self) -> Iterator[str]:
+        return self.store.iter_eventids()
@@ -0,0 +1,400 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+import struct
+import sys
+import typing
+
+from pydantic import BaseModel
+
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    EmbeddingInferenceResult,
+    Hairstyle,
+    HairstyleChangeEvent,
+    InferenceEvent,
+    UploadPicture
+)
+
+# Binary records start with MAGIC followed by one byte of format version.
+# JSON always starts with "{", so the two can be told apart from the first bytes
+MAGIC = b"HCE"
+FORMAT_VERSION = 1
+
+# Field order of every model in the binary format, records store their fields by position.
+# New fields are only ever appended, and records written before a field existed load it with its default.
+# Removing a field or changing its type needs a new FORMAT_VERSION
+LAYOUTS: tuple[tuple[type[BaseModel], tuple[str, ...]], ...] = (
+    (HairstyleChangeEvent, (
+        "eventid",
+        "account_identifier",
+        "uploaded_picture",
+        "hairstyles",
+        "embedding_inference",
+        "blend_inferences",
+        "start_timestamp",
+        "uploaded_picture_timestamp",
+        "picked_hairstyles_timestamp",
+        "finished_timestamp",
+        "event_timeout",
+        "errored",
+        "version",
+        "speculative_inferences",
+        "cancelled_timestamp",
+    )),
+    (InferenceEvent, (
+        "inference_eventid",
+        "type",
+        "start_timestamp",
+        "hairstyle",
+        "result",
+        "queue_timestamp",
+        "finished_timestamp",
+        "job_id",
+        "attempts",
+        "lease_id",
+        "speculative",
+        "lease_timestamp",
+        "result_version",
+        "uncounted_attempts",
+    )),
+    (Hairstyle, ("hairstyle_id", "hairstyle_name", "color_id", "color_name")),
+    (UploadPicture, ("file_location", "bbox", "content_hash")),
+    (EmbeddingInferenceResult, (
+        "inference_eventid",
+        "hairchange_eventid",
+        "embedded_file_location",
+        "segmentation_file_location",
+        "errored",
+        "lease_id",
+    )),
+    (BlendInferenceResult, ("inference_eventid", "hairchange_eventid", "result_img_location", "errored", "lease_id")),
+)
+
+# Every value is one unsigned word, a 4 bit tag and the rest payload. Words are 16 bits wide when every
+# payload in the record fits and 32 bits otherwise. Timestamps and integers too large for the payload
+# are kept in a second array of 64 bit words
+_TAG_BITS = 4
+_TAG_MASK = (1 << _TAG_BITS) - 1
+_MAX_PAYLOAD = (1 << (32 - _TAG_BITS)) - 1
+_FIELD_BITS = 6
+_FIELD_MASK = (1 << _FIELD_BITS) - 1
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_WIDE_INT = 4
+_STR = 5
+_DATETIME = 6
+_DATETIME_TZ = 7
+_LIST = 8
+_TUPLE = 9
+_MODEL = 10
+# An earlier frozen model equal to this one, by its order among the frozen models of the record
+_MODEL_REF = 11
+
+# Strings with a directory at least this long share it with the other strings in that directory
+_MIN_SHARED_PREFIX = 16
+
+_HEADER = struct.Struct("<B4I")
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_TZ = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+_MODEL_IDS = {model_class: model_id for model_id, (model_class, _) in enumerate(LAYOUTS)}
+
+
+class Codec:
+    """
+    Turns events into the bytes a store keeps, and back.
+    """
+
+    name: str
+    extension: str
+
+    def encode(self, event: HairstyleChangeEvent) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, raw: bytes) -> HairstyleChangeEvent:
+        return decode_event(raw)
+
+
+class JsonCodec(Codec):
+    """
+    The original format, the JSON written by `model_dump_json`.
+    """
+
+    name = "json"
+    extension = "json"
+
+    def encode(self, event: HairstyleChangeEvent) -> bytes:
+        return event.model_dump_json().encode()
+
+
+class BinaryCodec(Codec):
+    """
+    Compact binary format.
+
+    Fields are stored by position in `LAYOUTS` instead of by name, every string is written once
+    to a table and referred to by index, and timestamps are microseconds since the epoch.
+    Values are packed into fixed width words so they are read back in bulk by `array`.
+
+    Records are about 4x smaller than JSON, but every value is still encoded and decoded in Python,
+    so this codec is 2-3x slower than `JsonCodec`.
+    """
+
+    name = "binary"
+    extension = "hce"
+
+    def encode(self, event: HairstyleChangeEvent) -> bytes:
+        return _Encoder().encode(event)
+
+
+CODECS: dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Args:
+        name (str): "json" or "binary".
+
+    Returns:
+        codec (Codec): The codec with that name.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown event codec {name!r}, expected one of {', '.join(CODECS)}") from None
+
+
+def decode_event(raw: bytes) -> HairstyleChangeEvent:
+    """
+    Loads an event written by any codec, telling them apart by their first bytes.
+
+    Args:
+        raw (bytes): The stored event.
+
+    Returns:
+        event (HairstyleChangeEvent): The loaded event.
+
+    Raises:
+        ValueError: The event was written by a newer binary format than this version reads.
+    """
+    if raw[:len(MAGIC)] != MAGIC:
+        return HairstyleChangeEvent.from_json(raw)
+
+    version = raw[len(MAGIC)]
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Event was written with binary format {version}, this version reads up to {FORMAT_VERSION}")
+
+    return _decode(raw)
+
+
+_FROZEN = {model_class for model_class, _ in LAYOUTS if model_class.model_config.get("frozen")}
+
+
+class _Encoder:
+    def __init__(self):
+        self.words: list[int] = []
+        self.wide: list[int] = []
+        self.strings: dict[str, int] = {}
+        self.table: list[tuple[int, str]] = []
+        # By identity, equal copies are not worth hashing every frozen model for
+        self.frozen: dict[int, int] = {}
+
+    def string(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            prefix = 0
+            suffix = value
+            cut = value.rfind("/", 0, len(value) - 1) + 1
+            if cut >= _MIN_SHARED_PREFIX:
+                prefix = self.string(value[:cut]) + 1
+                suffix = value[cut:]
+
+            index = self.strings[value] = len(self.table)
+            self.table.append((prefix, suffix))
+        return index
+
+    def value(self, value: typing.Any) -> None:
+        words = self.words
+        value_type = type(value)
+
+        if value_type is str:
+            index = self.strings.get(value)
+            words.append((self.string(value) if index is None else index) << _TAG_BITS | _STR)
+        elif value_type in _MODEL_IDS:
+            if value_type in _FROZEN:
+                index = self.frozen.get(id(value))
+                if index is not None:
+                    words.append(index << _TAG_BITS | _MODEL_REF)
+                    return
+                self.frozen[id(value)] = len(self.frozen)
+
+            model_id = _MODEL_IDS[value_type]
+            layout = LAYOUTS[model_id][1]
+            words.append((model_id << _FIELD_BITS | len(layout)) << _TAG_BITS | _MODEL)
+            # The common scalar fields are written inline, only nested values recurse
+            strings = self.strings
+            wide = self.wide
+            fields = value.__dict__
+            for name in layout:
+                field = fields[name]
+                field_type = type(field)
+                if field_type is str:
+                    index = strings.get(field)
+                    words.append((self.string(field) if index is None else index) << _TAG_BITS | _STR)
+                elif field is None:
+                    words.append(_NONE)
+                elif field_type is datetime and field.tzinfo is None:
+                    words.append(len(wide) << _TAG_BITS | _DATETIME)
+                    wide.append((field - _EPOCH) // _MICROSECOND)
+                else:
+                    self.value(field)
+        elif value is None:
+            words.append(_NONE)
+        elif value_type is datetime:
+            if value.tzinfo is None:
+                words.append(len(self.wide) << _TAG_BITS | _DATETIME)
+                self.wide.append((value - _EPOCH) // _MICROSECOND)
+            else:
+                words.append(len(self.wide) << _TAG_BITS | _DATETIME_TZ)
+                self.wide.append((value - _EPOCH_TZ) // _MICROSECOND)
+                self.wide.append(value.utcoffset() // _MICROSECOND)
+        elif value_type is bool:
+            words.append(_TRUE if value else _FALSE)
+        elif value_type is int:
+            if 0 <= value <= _MAX_PAYLOAD:
+                words.append(value << _TAG_BITS | _INT)
+            else:
+                words.append(len(self.wide) << _TAG_BITS | _WIDE_INT)
+                self.wide.append(value)
+        elif value_type is list or value_type is tuple:
+            words.append(len(value) << _TAG_BITS | (_LIST if value_type is list else _TUPLE))
+            for item in value:
+                self.value(item)
+        else:
+            raise TypeError(f"Can not encode {value_type.__name__} in a binary event")
+
+    def encode(self, event: HairstyleChangeEvent) -> bytes:
+        self.value(event)
+
+        table = [part for prefix, suffix in self.table for part in (prefix, len(suffix))]
+        blob = "".join(suffix for _, suffix in self.table).encode()
+
+        typecode = "H" if max(max(self.words), max(table)) <= 0xFFFF else "I"
+        words = array(typecode, table + self.words)
+        wide = array("q", self.wide)
+        if sys.byteorder == "big":
+            words.byteswap()
+            wide.byteswap()
+
+        return b"".join((
+            MAGIC,
+            bytes((FORMAT_VERSION,)),
+            _HEADER.pack(words.itemsize, len(self.table), len(blob), len(self.words), len(wide)),
+            blob,
+            words.tobytes(),
+            wide.tobytes(),
+        ))
+
+
+def _array(typecode: str, raw: bytes) -> array:
+    values = array(typecode, raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+_object_setattr = object.__setattr__
+
+
+def _decode(raw: bytes) -> HairstyleChangeEvent:
+    offset = len(MAGIC) + 1
+    width, string_count, blob_length, word_count, wide_count = _HEADER.unpack_from(raw, offset)
+    offset += _HEADER.size
+
+    blob = raw[offset:offset + blob_length].decode()
+    offset += blob_length
+
+    word_length = width * (2 * string_count + word_count)
+    words = _array("H" if width == 2 else "I", raw[offset:offset + word_length])
+    wide = _array("q", raw[offset + word_length:offset + word_length + 8 * wide_count])
+
+    strings = []
+    start = 0
+    for i in range(0, 2 * string_count, 2):
+        prefix = words[i]
+        end = start + words[i + 1]
+        strings.append(strings[prefix - 1] + blob[start:end] if prefix else blob[start:end])
+        start = end
+
+    frozen: list[typing.Optional[BaseModel]] = []
+    next_word = iter(words[2 * string_count:]).__next__
+
+    def value(word: int) -> typing.Any:
+        tag = word & _TAG_MASK
+        payload = word >> _TAG_BITS
+
+        if tag == _MODEL:
+            model_class, layout = LAYOUTS[payload >> _FIELD_BITS]
+            if model_class in _FROZEN:
+                index = len(frozen)
+                frozen.append(None)
+
+            # The common scalar fields are read inline, only nested values recurse
+            count = payload & _FIELD_MASK
+            data = {}
+            for name in layout[:count]:
+                word = next_word()
+                tag = word & _TAG_MASK
+                if tag == _STR:
+                    data[name] = strings[word >> _TAG_BITS]
+                elif tag == _NONE:
+                    data[name] = None
+                elif tag == _DATETIME:
+                    data[name] = _EPOCH + wide[word >> _TAG_BITS] * _MICROSECOND
+                else:
+                    data[name] = value(word)
+
+            if count < len(layout):
+                # Written before the newest fields were added, those get their defaults
+                model = model_class.model_construct(**data)
+            else:
+                # Records are only written from validated models, so they are not validated again
+                model = model_class.__new__(model_class)
+                _object_setattr(model, "__dict__", data)
+                _object_setattr(model, "__pydantic_fields_set__", set(layout))
+                _object_setattr(model, "__pydantic_extra__", None)
+                _object_setattr(model, "__pydantic_private__", None)
+
+            if model_class in _FROZEN:
+                frozen[index] = model
+            return model
+        if tag == _STR:
+            return strings[payload]
+        if tag == _MODEL_REF:
+            return frozen[payload]
+        if tag == _LIST:
+            return [value(next_word()) for _ in range(payload)]
+        if tag == _NONE:
+            return None
+        if tag == _DATETIME:
+            return _EPOCH + wide[payload] * _MICROSECOND
+        if tag == _FALSE:
+            return False
+        if tag == _TRUE:
+            return True
+        if tag == _INT:
+            return payload
+        if tag == _TUPLE:
+            return tuple([value(next_word()) for _ in range(payload)])
+        if tag == _WIDE_INT:
+            return wide[payload]
+        if tag == _DATETIME_TZ:
+            utc_offset = timezone(wide[payload + 1] * _MICROSECOND)
+            return (_EPOCH_TZ + wide[payload] * _MICROSECOND).astimezone(utc_offset)
+
+        raise ValueError(f"Unknown binary value tag {tag}")
+
+    return value(next_word())
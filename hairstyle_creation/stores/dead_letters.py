@@ -0,0 +1,127 @@
+from datetime import datetime
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from hairstyle_creation.models import DeadLetter, InferenceJob
+
+
+class DeadLetterStore:
+    """
+    Jobs that ran out of attempts, oldest first, kept in a SQLite database so every process on the machine shares it.
+
+    Nothing takes them off again on its own, they stay until they are replayed or dropped,
+    see `python manage.py dead_letters`.
+    """
+
+    def __init__(self, path: str = "database/dead_letters.sqlite3", timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "message_id TEXT PRIMARY KEY, "
+            "queue TEXT NOT NULL, "
+            "job TEXT NOT NULL, "
+            "reason TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL, "
+            "dead_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS dead_letters_dead_at ON dead_letters (queue, dead_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, letter: DeadLetter) -> None:
+        """
+        Keeps a job that ran out of attempts, replacing an earlier letter with the same message ID.
+
+        Args:
+            letter (DeadLetter): The job and why it was given up on.
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO dead_letters (message_id, queue, job, reason, attempts, dead_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                letter.message_id,
+                letter.queue,
+                letter.job.model_dump_json(),
+                letter.reason,
+                letter.attempts,
+                letter.dead_timestamp.timestamp(),
+            ),
+        )
+
+    def _letter(self, row: tuple) -> DeadLetter:
+        message_id, queue, job, reason, attempts, dead_at = row
+        return DeadLetter(
+            message_id=message_id,
+            queue=queue,
+            job=InferenceJob.model_validate_json(job),
+            reason=reason,
+            attempts=attempts,
+            dead_timestamp=datetime.fromtimestamp(dead_at),
+        )
+
+    def get(self, message_id: str) -> Optional[DeadLetter]:
+        """
+        Args:
+            message_id (str): The ID the job was queued with.
+
+        Returns:
+            Optional[DeadLetter]: The letter, or None if there is none with that ID.
+        """
+        row = self._connection().execute(
+            "SELECT message_id, queue, job, reason, attempts, dead_at FROM dead_letters WHERE message_id = ?",
+            (message_id,),
+        ).fetchone()
+        return None if row is None else self._letter(row)
+
+    def list(self, queue: Optional[str] = None, limit: int = 100) -> list[DeadLetter]:
+        """
+        Args:
+            queue (Optional[str]): Only the letters of this queue, defaults to every queue.
+            limit (int): The most letters to return.
+
+        Returns:
+            letters (list[DeadLetter]): The letters, oldest first.
+        """
+        if queue is None:
+            rows = self._connection().execute(
+                "SELECT message_id, queue, job, reason, attempts, dead_at FROM dead_letters ORDER BY dead_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT message_id, queue, job, reason, attempts, dead_at FROM dead_letters "
+                "WHERE queue = ? ORDER BY dead_at LIMIT ?",
+                (queue, limit),
+            ).fetchall()
+        return [self._letter(row) for row in rows]
+
+    def remove(self, message_id: str) -> bool:
+        """
+        Args:
+            message_id (str): The ID the job was queued with.
+
+        Returns:
+            bool: False if there was no letter with that ID.
+        """
+        return self._connection().execute("DELETE FROM dead_letters WHERE message_id = ?", (message_id,)).rowcount > 0
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
@@ -0,0 +1,137 @@
+from datetime import datetime
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+
+class DeadlineIndex:
+    """
+    Keys ordered by deadline, kept in a SQLite B-tree so every process on the machine shares it.
+
+    Scheduling, removing and finding the next due key are all O(log n),
+    so nothing ever has to scan the event store to find what has expired.
+    """
+
+    def __init__(self, path: str = "database/deadlines.sqlite3", table: str = "deadlines", timeout: float = 30.0):
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, "
+            "deadline REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_deadline ON {table} (deadline)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def schedule(self, key: str, deadline: datetime) -> None:
+        """
+        Adds a key, or moves it if it is already scheduled.
+
+        Args:
+            key (str): The key, usually an event ID.
+            deadline (datetime): When the key is due.
+        """
+        self._connection().execute(
+            f"INSERT INTO {self.table} (key, deadline) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET deadline = excluded.deadline",
+            (key, deadline.timestamp()),
+        )
+
+    def reschedule(self, key: str, deadline: datetime) -> bool:
+        """
+        Moves a key that is still scheduled.
+
+        Args:
+            key (str): The key.
+            deadline (datetime): When the key is due.
+
+        Returns:
+            bool: False if the key is not scheduled, and so was not added.
+        """
+        return self._connection().execute(
+            f"UPDATE {self.table} SET deadline = ? WHERE key = ?",
+            (deadline.timestamp(), key),
+        ).rowcount > 0
+
+    def deadline(self, key: str) -> Optional[datetime]:
+        """
+        Args:
+            key (str): The key.
+
+        Returns:
+            Optional[datetime]: When the key is due, or None if it is not scheduled.
+        """
+        row = self._connection().execute(f"SELECT deadline FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else datetime.fromtimestamp(row[0])
+
+    def remove(self, key: str) -> None:
+        """
+        Removes a key, if it is scheduled.
+
+        Args:
+            key (str): The key to remove.
+        """
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def remove_range(self, low: str, high: str) -> int:
+        """
+        Removes every scheduled key in a range.
+
+        Args:
+            low (str): The first key of the range.
+            high (str): Past the last key of the range.
+
+        Returns:
+            removed (int): The number of keys removed.
+        """
+        return self._connection().execute(
+            f"DELETE FROM {self.table} WHERE key >= ? AND key < ?",
+            (low, high),
+        ).rowcount
+
+    def due(self, now: datetime, limit: int = 100) -> list[tuple[str, datetime]]:
+        """
+        Finds the keys whose deadline has passed, earliest first. They stay scheduled until removed.
+
+        Args:
+            now (datetime): The current time.
+            limit (int): The most keys to return.
+
+        Returns:
+            due (list[tuple[str, datetime]]): The due keys with their deadlines.
+        """
+        rows = self._connection().execute(
+            f"SELECT key, deadline FROM {self.table} WHERE deadline <= ? ORDER BY deadline LIMIT ?",
+            (now.timestamp(), limit),
+        ).fetchall()
+        return [(key, datetime.fromtimestamp(deadline)) for key, deadline in rows]
+
+    def next_deadline(self) -> Optional[datetime]:
+        """
+        Returns:
+            Optional[datetime]: The earliest scheduled deadline, or None if nothing is scheduled.
+        """
+        row = self._connection().execute(f"SELECT MIN(deadline) FROM {self.table}").fetchone()
+        return None if row[0] is None else datetime.fromtimestamp(row[0])
+
+    def __len__(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import typing
+from typing import Optional
+
+from hairstyle_creation.models import UploadPicture
+
+
+def picture_key(picture: UploadPicture) -> Optional[str]:
+    """
+    Identifies what an embedding is computed from, the stored image, its content and the face in it.
+
+    Args:
+        picture (UploadPicture): The uploaded picture.
+
+    Returns:
+        Optional[str]: The cache key, or None if the picture has no content hash.
+
+    The content hash comes from the client and is never checked, so the key also holds the image's location.
+    An entry was computed from the image stored there, so a client only ever hits the embedding of an image
+    it could have had embedded anyway, and can not fill the entry of another image with its own.
+    """
+    if picture.content_hash is None:
+        return None
+
+    key = f"{picture.file_location}\0{picture.content_hash}:{','.join(map(str, picture.bbox))}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Finished embeddings keyed by the content of the picture they were computed from, least recently used evicted first.
+
+    A repeat upload of the same photo reuses its embedding instead of running another GPU pass.
+    The entry count is kept next to the entries, so staying under `max_entries` never counts the table.
+    """
+
+    def __init__(self, path: str = "database/embeddings.sqlite3", max_entries: int = 10_000, timeout: float = 30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._local = threading.local()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, "
+            "embedded_file_location TEXT NOT NULL, "
+            "segmentation_file_location TEXT NOT NULL, "
+            "last_used REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO embeddings_size (id, size) VALUES (0, 0)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[tuple[str, str]]:
+        """
+        Looks up an embedding and marks it as recently used.
+
+        Args:
+            key (str): The key from `picture_key`.
+
+        Returns:
+            Optional[tuple[str, str]]: The embedded and segmentation file locations, or None if they are not cached.
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT embedded_file_location, segmentation_file_location FROM embeddings WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        with self._stats_lock:
+            self._stats["hits" if row is not None else "misses"] += 1
+
+        if row is None:
+            return None
+
+        conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def put(self, key: str, embedded_file_location: str, segmentation_file_location: str) -> None:
+        """
+        Caches an embedding, evicting the least recently used ones past `max_entries`.
+
+        Args:
+            key (str): The key from `picture_key`.
+            embedded_file_location (str): Where the embedding is stored.
+            segmentation_file_location (str): Where the segmentation is stored.
+        """
+        conn = self._connection()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute("SELECT 1 FROM embeddings WHERE key = ?", (key,)).fetchone() is not None
+            conn.execute(
+                "INSERT INTO embeddings (key, embedded_file_location, segmentation_file_location, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET embedded_file_location = excluded.embedded_file_location, "
+                "segmentation_file_location = excluded.segmentation_file_location, last_used = excluded.last_used",
+                (key, embedded_file_location, segmentation_file_location, time.time()),
+            )
+
+            evicted = 0
+            if not exists:
+                conn.execute("UPDATE embeddings_size SET size = size + 1 WHERE id = 0")
+                size = conn.execute("SELECT size FROM embeddings_size WHERE id = 0").fetchone()[0]
+                if size > self.max_entries:
+                    evicted = conn.execute(
+                        "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (size - self.max_entries,),
+                    ).rowcount
+                    conn.execute("UPDATE embeddings_size SET size = size - ? WHERE id = 0", (evicted,))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            self._stats["stored"] += 1
+            self._stats["evicted"] += evicted
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT size FROM embeddings_size WHERE id = 0").fetchone()[0]
+
+    def stats(self) -> dict[str, typing.Any]:
+        """
+        Returns:
+            stats (dict[str, typing.Any]): The lookups, hit rate and evictions of this cache in this process.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
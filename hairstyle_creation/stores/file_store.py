@@ -0,0 +1,269 @@
+from datetime import datetime
+import os
+import threading
+import time
+from typing import Callable, Hashable, Iterator, Optional
+
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.base import EventStore
+from hairstyle_creation.stores.codec import CODECS, decode_event, get_codec
+from hairstyle_creation.stores.layout import drop_partitions, iter_partitions, partition_directory
+from hairstyle_creation.stores.locks import file_lock, striped_lock_path
+
+
+class FileEventStore(EventStore):
+    """
+    Stores every event as its own file, `<eventid>.json` or `<eventid>.hce` depending on the codec.
+
+    With `sharded` the files are spread over hourly `<YYYYMM>/<DD>/<HH>` partition
+    directories taken from the event ID, so no directory grows without limit and
+    old events can be dropped a whole partition at a time with `drop_partitions`.
+    Events left in the root by the old flat layout are moved into their partition
+    the first time they are read.
+
+    Events written by another codec are still read, and are rewritten with
+    this store's codec the next time they change.
+
+    Files are replaced atomically so readers never see a half written event,
+    and writes to the same event are serialized with striped lock files.
+    """
+
+    def __init__(self, directory: str = "database/", sharded: bool = True, codec: str = "json"):
+        self.directory = directory
+        self.sharded = sharded
+        self.codec = get_codec(codec)
+        self.extension = f".{self.codec.extension}"
+        self._other_extensions = [f".{other.extension}" for other in CODECS.values() if other is not self.codec]
+        self.lock_directory = os.path.join(directory, ".locks")
+        self._local = threading.local()
+        os.makedirs(self.lock_directory, exist_ok=True)
+
+    def _lock(self, eventid: str):
+        return file_lock(striped_lock_path(self.lock_directory, eventid))
+
+    def _flat_path(self, eventid: str, extension: Optional[str] = None) -> str:
+        return os.path.join(self.directory, eventid + (extension or self.extension))
+
+    def _path(self, eventid: str, extension: Optional[str] = None) -> str:
+        if not self.sharded:
+            return self._flat_path(eventid, extension)
+        return os.path.join(partition_directory(self.directory, eventid), eventid + (extension or self.extension))
+
+    def _other_codec_paths(self, eventid: str) -> list[str]:
+        paths = [self._path(eventid, extension) for extension in self._other_extensions]
+        if self.sharded:
+            paths += [self._flat_path(eventid, extension) for extension in self._other_extensions]
+        return paths
+
+    def _move_flat(self, eventid: str, extension: Optional[str] = None) -> bool:
+        """
+        Moves an event from the flat layout into its partition. The event's lock must be held.
+        """
+        path = self._path(eventid, extension)
+        flat_path = self._flat_path(eventid, extension)
+        if path == flat_path:
+            return False
+
+        try:
+            os.replace(flat_path, path)
+        except FileNotFoundError:
+            if not os.path.exists(flat_path):
+                return False
+            # First event of a new partition
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(flat_path, path)
+        return True
+
+    def _migrate(self, eventid: str, locked: bool, extension: Optional[str] = None) -> bool:
+        if locked:
+            return self._move_flat(eventid, extension)
+        with self._lock(eventid):
+            return self._move_flat(eventid, extension)
+
+    @staticmethod
+    def _load(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _find(self, eventid: str, locked: bool = False) -> Optional[tuple[str, bytes]]:
+        path = self._path(eventid)
+        raw = self._load(path)
+
+        if raw is None and self.sharded:
+            # Either migrated now or by another reader in the meantime, it is in its partition if it exists
+            self._migrate(eventid, locked)
+            raw = self._load(path)
+
+        if raw is None:
+            # Written before the store switched codecs
+            for path in self._other_codec_paths(eventid):
+                raw = self._load(path)
+                if raw is not None:
+                    break
+
+        return None if raw is None else (path, raw)
+
+    def _read(self, eventid: str, locked: bool = False) -> Optional[HairstyleChangeEvent]:
+        found = self._find(eventid, locked)
+        return None if found is None else decode_event(found[1])
+
+    def _remove_stale_copies(self, eventid: str) -> None:
+        """
+        Drops copies left behind by the flat layout or another codec, they would only be stale now.
+        The event's lock must be held.
+        """
+        stale_paths = self._other_codec_paths(eventid)
+        if self.sharded:
+            stale_paths.append(self._flat_path(eventid))
+
+        for path in stale_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _stat_stamp(stat: os.stat_result) -> tuple[int, int, int]:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _write(self, event: HairstyleChangeEvent) -> None:
+        path = self._path(event.eventid)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+        try:
+            f = open(tmp_path, "wb")
+        except FileNotFoundError:
+            # First event of a new partition
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(tmp_path, "wb")
+
+        with f:
+            f.write(self.codec.encode(event))
+
+        # Filesystem mtimes are only as fine as the kernel tick, so stamp the file with a precise one.
+        # The rename keeps the inode and mtime, so this is exactly what `stamp` will see afterwards
+        now = time.time_ns()
+        os.utime(tmp_path, ns=(now, now))
+        stamp = self._stat_stamp(os.stat(tmp_path))
+        os.replace(tmp_path, path)
+
+        self._local.written = (event.eventid, event.version, stamp)
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        return self._read(eventid)
+
+    def put(self, event: HairstyleChangeEvent) -> None:
+        with self._lock(event.eventid):
+            event.version += 1
+            self._write(event)
+            self._remove_stale_copies(event.eventid)
+
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        with self._lock(event.eventid):
+            found = self._find(event.eventid, locked=True)
+            current_version = 0 if found is None else decode_event(found[1]).version
+
+            if current_version != expected_version:
+                return False
+
+            event.version = expected_version + 1
+            self._write(event)
+
+            if found is not None and found[0] != self._path(event.eventid):
+                self._remove_stale_copies(event.eventid)
+            return True
+
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        try:
+            return self._stat_stamp(os.stat(self._path(eventid)))
+        except FileNotFoundError:
+            pass
+
+        # Not migrated yet, migrating keeps the inode and mtime so the stamp stays the same.
+        # Or written before the store switched codecs
+        paths = self._other_codec_paths(eventid)
+        if self.sharded:
+            paths.insert(0, self._flat_path(eventid))
+
+        for path in paths:
+            try:
+                return self._stat_stamp(os.stat(path))
+            except FileNotFoundError:
+                pass
+        return None
+
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        written = getattr(self._local, "written", None)
+        if written is None or written[:2] != (event.eventid, event.version):
+            return None
+        return written[2]
+
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        with self._lock(eventid):
+            found = self._find(eventid, locked=True)
+            if found is None or decode_event(found[1]).version != expected_version:
+                return False
+
+            os.remove(found[0])
+            self._remove_stale_copies(eventid)
+
+        # Removes the hour, day and month directories once they are empty
+        directory = os.path.dirname(self._path(eventid))
+        while self.sharded and directory != os.path.normpath(self.directory):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+        return True
+
+    def iter_eventids(self) -> Iterator[str]:
+        extensions = [self.extension] + self._other_extensions
+        directories = [self.directory]
+        if self.sharded:
+            directories += [path for path, _ in iter_partitions(self.directory)]
+
+        for directory in directories:
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+
+            for name in names:
+                eventid, extension = os.path.splitext(name)
+                if extension in extensions:
+                    yield eventid
+
+    def migrate_flat_layout(self) -> int:
+        """
+        Moves every event left in the root by the flat layout into its partition.
+
+        Returns:
+            migrated (int): The number of events moved.
+        """
+        if not self.sharded:
+            return 0
+
+        extensions = [self.extension] + self._other_extensions
+        migrated = 0
+        for name in os.listdir(self.directory):
+            eventid, extension = os.path.splitext(name)
+            if extension in extensions and self._migrate(eventid, locked=False, extension=extension):
+                migrated += 1
+        return migrated
+
+    def drop_partitions(self, before: datetime, on_drop: Optional[Callable[[datetime], None]] = None) -> int:
+        """
+        Removes every event in an hourly partition that ended before a point in time.
+
+        Args:
+            before (datetime): Partitions whose hour ended before this are removed.
+            on_drop (Optional[Callable[[datetime], None]]): Called with the hour of every removed partition.
+
+        Returns:
+            dropped (int): The number of partitions removed.
+        """
+        return drop_partitions(self.directory, before, on_drop)
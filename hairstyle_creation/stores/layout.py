@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+import os
+import re
+import shutil
+from typing import Callable, Iterator, Optional
+
+# create_eventid starts every ID with the time it was created as `%Y%m-%d%H-`
+EVENTID_PARTITION = re.compile(r"^(\d{6})-(\d{2})(\d{2})-")
+
+PARTITION_LENGTH = timedelta(hours=1)
+
+
+def partition_directory(root: str, eventid: str) -> str:
+    """
+    Finds the hourly partition directory an event belongs in.
+
+    Args:
+        root (str): The root directory of the store.
+        eventid (str): The ID of the event.
+
+    Returns:
+        directory (str): `<root>/<YYYYMM>/<DD>/<HH>` from the time in the event ID,
+            or the root itself for IDs that were not made by `create_eventid`.
+    """
+    match = EVENTID_PARTITION.match(eventid)
+    if match is None:
+        return root
+    return os.path.join(root, *match.groups())
+
+
+def eventid_created(eventid: str) -> Optional[datetime]:
+    """
+    Reads the time an event was created from its ID, without loading the event.
+
+    Args:
+        eventid (str): The ID of the event.
+
+    Returns:
+        Optional[datetime]: The time from the `%Y%m-%d%H-%M%S-` prefix, to the second,
+            or None for IDs that were not made by `create_eventid`.
+    """
+    try:
+        return datetime.strptime(eventid[:16], "%Y%m-%d%H-%M%S")
+    except ValueError:
+        return None
+
+
+def partition_eventids(start: datetime) -> tuple[str, str]:
+    """
+    Finds the range of event IDs that `create_eventid` gives out during one partition's hour.
+
+    Args:
+        start (datetime): The hour the partition starts at.
+
+    Returns:
+        low (str): The first ID of the range.
+        high (str): Past the last ID of the range, so the range is `low <= eventid < high`.
+    """
+    prefix = start.strftime("%Y%m-%d%H")
+    # "." sorts right after "-", so no ID of a later hour falls in between
+    return f"{prefix}-", f"{prefix}."
+
+
+def iter_partitions(root: str) -> Iterator[tuple[str, datetime]]:
+    """
+    Lists the hourly partitions under a root directory.
+
+    Args:
+        root (str): The root directory of the store.
+
+    Yields:
+        partition (tuple[str, datetime]): The partition directory and the hour it starts at.
+    """
+    for month in sorted(os.listdir(root)):
+        month_path = os.path.join(root, month)
+        if not (len(month) == 6 and month.isdigit() and os.path.isdir(month_path)):
+            continue
+
+        for day in sorted(os.listdir(month_path)):
+            day_path = os.path.join(month_path, day)
+            if not (len(day) == 2 and day.isdigit() and os.path.isdir(day_path)):
+                continue
+
+            for hour in sorted(os.listdir(day_path)):
+                hour_path = os.path.join(day_path, hour)
+                if not (len(hour) == 2 and hour.isdigit() and os.path.isdir(hour_path)):
+                    continue
+
+                yield hour_path, datetime.strptime(f"{month}{day}{hour}", "%Y%m%d%H")
+
+
+def drop_partitions(root: str, before: datetime, on_drop: Optional[Callable[[datetime], None]] = None) -> int:
+    """
+    Removes every hourly partition that ended before a point in time, one directory removal each.
+
+    Args:
+        root (str): The root directory of the store.
+        before (datetime): Partitions whose hour ended before this are removed.
+        on_drop (Optional[Callable[[datetime], None]]): Called with the hour of every removed partition,
+            to clean up what refers to its events, see `partition_eventids`.
+
+    Returns:
+        dropped (int): The number of partitions removed.
+    """
+    dropped = 0
+    for path, start in iter_partitions(root):
+        if start + PARTITION_LENGTH > before:
+            continue
+
+        shutil.rmtree(path, ignore_errors=True)
+        dropped += 1
+        if on_drop is not None:
+            on_drop(start)
+
+        # Removes the day and month directories once they are empty
+        for parent in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+
+    return dropped
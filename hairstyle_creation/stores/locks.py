@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+import os
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_STRIPES = 64
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Holds an exclusive, cross-process lock on `path` for the duration of the block.
+
+    Args:
+        path (str): The lock file. It is created if it does not exist.
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def striped_lock_path(lock_directory: str, key: str) -> str:
+    """
+    Maps a key onto one of `LOCK_STRIPES` lock files so unrelated keys rarely contend.
+
+    Args:
+        lock_directory (str): The directory holding the lock files.
+        key (str): The key to lock, usually an event ID.
+
+    Returns:
+        str: The path of the lock file guarding the key.
+    """
+    stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+    return os.path.join(lock_directory, f"{stripe}.lock")
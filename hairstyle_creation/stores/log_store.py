@@ -0,0 +1,333 @@
+from collections import OrderedDict
+import json
+import os
+import threading
+import typing
+from typing import Hashable, Iterator, NamedTuple, Optional
+
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.base import EventStore
+from hairstyle_creation.stores.locks import file_lock, striped_lock_path
+
+
+def _truncate_partial_record(log: typing.BinaryIO, chunk_size: int = 4096) -> None:
+    """
+    Cuts a record left without its newline by a crash mid-append off the end of a log, so the next record starts on its own line.
+    The event's lock must be held.
+    """
+    end = log.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        start = max(position - chunk_size, 0)
+        log.seek(start)
+        newline = log.read(position - start).rfind(b"\n")
+        if newline != -1:
+            position = start + newline + 1
+            break
+        position = start
+
+    if position != end:
+        log.truncate(position)
+
+
+class _State(NamedTuple):
+    stamp: Hashable
+    data: dict[str, typing.Any]
+    # Number of log records written since the last snapshot
+    tail: int
+
+
+def diff_event(old: dict[str, typing.Any], new: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """
+    Computes the delta record that turns one dumped event into another.
+
+    Args:
+        old (dict[str, typing.Any]): The event before the change, as dumped by `model_dump(mode="json")`.
+        new (dict[str, typing.Any]): The event after the change.
+
+    Returns:
+        delta (dict[str, typing.Any]): The changed fields under "set", and for list fields
+            (like `blend_inferences`) only the changed items under "items".
+    """
+    changed_fields: dict[str, typing.Any] = {}
+    changed_items: dict[str, typing.Any] = {}
+
+    for name, value in new.items():
+        if name == "version":
+            continue
+
+        previous = old.get(name)
+        if value == previous:
+            continue
+
+        if isinstance(value, list) and isinstance(previous, list):
+            changed_items[name] = {
+                "length": len(value),
+                "changed": {
+                    str(i): item for i, item in enumerate(value)
+                    if i >= len(previous) or previous[i] != item
+                },
+            }
+        else:
+            changed_fields[name] = value
+
+    delta: dict[str, typing.Any] = {}
+    if changed_fields:
+        delta["set"] = changed_fields
+    if changed_items:
+        delta["items"] = changed_items
+    return delta
+
+
+def apply_delta(data: dict[str, typing.Any], record: dict[str, typing.Any]) -> None:
+    """
+    Applies a log record made by `diff_event` to a dumped event in place.
+
+    Args:
+        data (dict[str, typing.Any]): The dumped event to change.
+        record (dict[str, typing.Any]): The log record, a delta plus the version it produces.
+    """
+    data.update(record.get("set", {}))
+
+    for name, patch in record.get("items", {}).items():
+        items = list(data.get(name) or [])[:patch["length"]]
+        items.extend([None] * (patch["length"] - len(items)))
+        for i, item in patch["changed"].items():
+            items[int(i)] = item
+        data[name] = items
+
+    data["version"] = record["version"]
+
+
+class EventLogStore(EventStore):
+    """
+    Event sourced store: every write appends a small delta record to the event's log.
+
+    Each event has a `<eventid>.log` file of JSON lines, one delta per write, which doubles
+    as an audit trail of the try-on. The current state is rebuilt from the latest
+    `<eventid>.snapshot.json` plus the log records written after it.
+    A snapshot is taken automatically every `snapshot_every` records, and `compact`
+    folds the remaining tail of the log into a new snapshot.
+    """
+
+    def __init__(self, directory: str = "database/log/", snapshot_every: int = 16, max_cached_states: int = 256):
+        self.directory = directory
+        self.lock_directory = os.path.join(directory, ".locks")
+        self.snapshot_every = snapshot_every
+        self.max_cached_states = max_cached_states
+
+        self._states: OrderedDict[str, _State] = OrderedDict()
+        self._states_lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(self.lock_directory, exist_ok=True)
+
+    def _log_path(self, eventid: str) -> str:
+        return os.path.join(self.directory, f"{eventid}.log")
+
+    def _snapshot_path(self, eventid: str) -> str:
+        return os.path.join(self.directory, f"{eventid}.snapshot.json")
+
+    def _lock(self, eventid: str):
+        return file_lock(striped_lock_path(self.lock_directory, eventid))
+
+    @staticmethod
+    def _stat_stamp(stat: os.stat_result) -> tuple[int, int, int]:
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _cached_state(self, eventid: str, stamp: Hashable) -> Optional[_State]:
+        with self._states_lock:
+            state = self._states.get(eventid)
+            if state is None or state.stamp != stamp:
+                return None
+            self._states.move_to_end(eventid)
+            return state
+
+    def _remember_state(self, eventid: str, state: _State) -> None:
+        with self._states_lock:
+            self._states[eventid] = state
+            self._states.move_to_end(eventid)
+            while len(self._states) > self.max_cached_states:
+                self._states.popitem(last=False)
+
+    def _rebuild(self, eventid: str) -> Optional[_State]:
+        """
+        Rebuilds an event from its latest snapshot and the log records after it.
+        """
+        try:
+            log = open(self._log_path(eventid), "rb")
+        except FileNotFoundError:
+            return None
+
+        with log:
+            stamp = self._stat_stamp(os.fstat(log.fileno()))
+            state = self._cached_state(eventid, stamp)
+            if state is not None:
+                return state
+
+            data: dict[str, typing.Any] = {}
+            offset = 0
+            try:
+                with open(self._snapshot_path(eventid), "rb") as f:
+                    snapshot = json.loads(f.read())
+                data = snapshot["event"]
+                offset = snapshot["offset"]
+            except FileNotFoundError:
+                pass
+
+            log.seek(offset)
+            tail = log.read(max(stamp[1] - offset, 0))
+
+        records = tail.split(b"\n")
+        # A record without its newline was cut off by a crash mid-append and never acknowledged
+        records.pop()
+        for line in records:
+            apply_delta(data, json.loads(line))
+
+        if not data:
+            return None
+
+        state = _State(stamp, data, len(records))
+        self._remember_state(eventid, state)
+        return state
+
+    def _append(self, event: HairstyleChangeEvent, base: Optional[_State], version: int) -> None:
+        new_data = event.model_dump(mode="json")
+        new_data["version"] = version
+
+        record = diff_event(base.data if base is not None else {}, new_data)
+        record["version"] = version
+
+        with open(self._log_path(event.eventid), "a+b") as f:
+            _truncate_partial_record(f)
+            f.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            f.flush()
+            stamp = self._stat_stamp(os.fstat(f.fileno()))
+
+        event.version = version
+        tail = (base.tail if base is not None else 0) + 1
+        state = _State(stamp, new_data, tail)
+
+        if tail >= self.snapshot_every:
+            self._write_snapshot(event.eventid, state)
+            state = state._replace(tail=0)
+
+        self._remember_state(event.eventid, state)
+        self._local.written = (event.eventid, version, stamp)
+
+    def _write_snapshot(self, eventid: str, state: _State) -> None:
+        path = self._snapshot_path(eventid)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+        # The snapshot covers the log up to its current size, the stamp's second item
+        with open(tmp_path, "w") as f:
+            json.dump({"offset": state.stamp[1], "event": state.data}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        state = self._rebuild(eventid)
+        if state is None:
+            return None
+        return HairstyleChangeEvent.model_validate(state.data)
+
+    def put(self, event: HairstyleChangeEvent) -> None:
+        with self._lock(event.eventid):
+            self._append(event, self._rebuild(event.eventid), event.version + 1)
+
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        with self._lock(event.eventid):
+            base = self._rebuild(event.eventid)
+            current_version = 0 if base is None else base.data["version"]
+
+            if current_version != expected_version:
+                return False
+
+            self._append(event, base, expected_version + 1)
+            return True
+
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        try:
+            return self._stat_stamp(os.stat(self._log_path(eventid)))
+        except FileNotFoundError:
+            return None
+
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        written = getattr(self._local, "written", None)
+        if written is None or written[:2] != (event.eventid, event.version):
+            return None
+        return written[2]
+
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        with self._lock(eventid):
+            state = self._rebuild(eventid)
+            if state is None or state.data["version"] != expected_version:
+                return False
+
+            with self._states_lock:
+                self._states.pop(eventid, None)
+
+            # The log goes last, on its own it still rebuilds the whole event
+            try:
+                os.remove(self._snapshot_path(eventid))
+            except FileNotFoundError:
+                pass
+            os.remove(self._log_path(eventid))
+            return True
+
+    def iter_eventids(self) -> Iterator[str]:
+        for name in os.listdir(self.directory):
+            if name.endswith(".log"):
+                yield name[:-len(".log")]
+
+    def history(self, eventid: str) -> list[dict[str, typing.Any]]:
+        """
+        Reads every delta record still in an event's log, oldest first.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            records (list[dict[str, typing.Any]]): The delta records, each with the version it produced.
+        """
+        try:
+            with open(self._log_path(eventid), "rb") as f:
+                records = f.read().split(b"\n")
+        except FileNotFoundError:
+            return []
+
+        records.pop()
+        return [json.loads(line) for line in records]
+
+    def compact(self, eventid: str) -> bool:
+        """
+        Folds the log records written since the last snapshot into a new snapshot.
+
+        Args:
+            eventid (str): The ID of the event.
+
+        Returns:
+            bool: True if a snapshot was written, False if there was nothing to fold.
+            
+        The log itself is left as it is so the audit trail of the event is kept.
+        """
+        with self._lock(eventid):
+            state = self._rebuild(eventid)
+            if state is None or state.tail == 0:
+                return False
+
+            self._write_snapshot(eventid, state)
+            self._remember_state(eventid, state._replace(tail=0))
+            return True
+
+    def compact_all(self) -> int:
+        """
+        Compacts every event in the store.
+
+        Returns:
+            compacted (int): The number of events a snapshot was written for.
+        """
+        compacted = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".log") and self.compact(name[:-len(".log")]):
+                compacted += 1
+        return compacted
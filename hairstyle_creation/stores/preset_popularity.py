@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+
+from hairstyle_creation.models import Hairstyle
+
+
+class PresetPopularity:
+    """
+    How often every hairstyle and color has been picked, kept in a SQLite database so every process on the machine shares it.
+    """
+
+    def __init__(self, path: str = "database/presets.sqlite3", timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS preset_picks ("
+            "hairstyle_id INTEGER NOT NULL, "
+            "color_id INTEGER NOT NULL, "
+            "hairstyle TEXT NOT NULL, "
+            "picks INTEGER NOT NULL, "
+            "PRIMARY KEY (hairstyle_id, color_id)"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS preset_picks_picks ON preset_picks (picks)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, hairstyles: list[Hairstyle]) -> None:
+        """
+        Counts one pick of each hairstyle.
+
+        Args:
+            hairstyles (list[Hairstyle]): The hairstyles a user picked.
+        """
+        self._connection().executemany(
+            "INSERT INTO preset_picks (hairstyle_id, color_id, hairstyle, picks) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (hairstyle_id, color_id) DO UPDATE SET picks = picks + 1, hairstyle = excluded.hairstyle",
+            [
+                (hairstyle.hairstyle_id, hairstyle.color_id, hairstyle.model_dump_json())
+                for hairstyle in hairstyles
+            ],
+        )
+
+    def top(self, limit: int) -> list[Hairstyle]:
+        """
+        Args:
+            limit (int): The most hairstyles to return.
+
+        Returns:
+            hairstyles (list[Hairstyle]): The most picked hairstyles, most picked first.
+        """
+        rows = self._connection().execute(
+            "SELECT hairstyle FROM preset_picks ORDER BY picks DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [Hairstyle.model_validate_json(hairstyle) for hairstyle, in rows]
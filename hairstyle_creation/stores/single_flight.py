@@ -0,0 +1,138 @@
+import asyncio
+from concurrent.futures import Future
+import threading
+import typing
+from typing import Hashable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.base import EventStore, clone
+
+
+class _Flight:
+    """
+    One read of an event from the wrapped store, shared by every caller that asked for it while it ran.
+    """
+
+    def __init__(self, stamp: Optional[Hashable]):
+        self.future: Future = Future()
+        self.followers = 0
+        # The stamp the event had before it was read, only readers that saw the same one may share the read
+        self.stamp = stamp
+
+
+class CoalescingEventStore(EventStore):
+    """
+    Lets concurrent reads of the same event in this process share one load from another store (single flight).
+
+    A read that starts while another read of the event is running waits for that one instead of
+    loading and parsing the event again, and gets its own copy of the result. A read only joins one
+    that started at the stamp it sees itself, so a read that starts after a write, from this process
+    or another, never gets what was loaded before it. Callers such as the cache may then keep
+    the result under the stamp they read first.
+    """
+
+    def __init__(self, store: EventStore):
+        self.store = store
+
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.loads = 0
+        self.coalesced = 0
+
+        metrics.register("event_coalescing", self.stats)
+
+    def stats(self) -> dict[str, typing.Any]:
+        with self._lock:
+            reads = self.loads + self.coalesced
+            return {
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+                "coalescing_ratio": self.coalesced / reads if reads else 0.0,
+            }
+
+    def _join(self, eventid: str, stamp: Optional[Hashable]) -> tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(eventid)
+            if flight is not None and flight.stamp == stamp:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+
+            # A read started before the event was written is left to the readers that already joined it
+            flight = self._flights[eventid] = _Flight(stamp)
+            self.loads += 1
+            return flight, True
+
+    def _land(self, eventid: str, flight: _Flight) -> int:
+        # No one joins a flight once it is out of the map, so the followers are all counted
+        with self._lock:
+            if self._flights.get(eventid) is flight:
+                del self._flights[eventid]
+            return flight.followers
+
+    def _load(self, eventid: str, flight: _Flight) -> Optional[HairstyleChangeEvent]:
+        try:
+            event = self.store.get(eventid)
+        except BaseException as e:
+            self._land(eventid, flight)
+            flight.future.set_exception(e)
+            raise
+
+        # The leader may change its event before the followers copy it, so they copy an untouched one
+        followers = self._land(eventid, flight)
+        flight.future.set_result(clone(event) if followers and event is not None else event)
+        return event
+
+    def _forget(self, eventid: str) -> None:
+        with self._lock:
+            self._flights.pop(eventid, None)
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        flight, leader = self._join(eventid, self.store.stamp(eventid))
+        if leader:
+            return self._load(eventid, flight)
+
+        return clone(flight.future.result())
+
+    async def aget(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        # Followers wait on the loop instead of holding a thread while the leader reads
+        flight, leader = self._join(eventid, await self.store.astamp(eventid))
+        if leader:
+            return await sync_to_async(self._load, thread_sensitive=False)(eventid, flight)
+
+        return clone(await asyncio.wrap_future(flight.future))
+
+    def put(self, event: HairstyleChangeEvent) -> None:
+        try:
+            self.store.put(event)
+        finally:
+            self._forget(event.eventid)
+
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        try:
+            return self.store.compare_and_swap(event, expected_version)
+        finally:
+            self._forget(event.eventid)
+
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        return self.store.stamp(eventid)
+
+    async def astamp(self, eventid: str) -> Optional[Hashable]:
+        return await self.store.astamp(eventid)
+
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        return self.store.written_stamp(event)
+
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        try:
+            return self.store.delete(eventid, expected_version)
+        finally:
+            self._forget(eventid)
+
+    def iter_eventids(self) -> Iterator[str]:
+        return self.store.iter_eventids()
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+from typing import Hashable, Iterator, Optional
+
+from hairstyle_creation.models import HairstyleChangeEvent
+from hairstyle_creation.stores.base import EventStore
+from hairstyle_creation.stores.codec import decode_event, get_codec
+
+
+class SQLiteEventStore(EventStore):
+    """
+    Stores events in a single SQLite database running in WAL mode.
+
+    WAL lets every gunicorn worker read while another one writes, so all of the
+    workers on a machine can share one database file.
+    Each thread (and each forked process) gets its own connection.
+    Rows written by another codec are still read, so the codec can be changed on a live database.
+    """
+
+    def __init__(self, path: str = "database/events.sqlite3", timeout: float = 30.0, codec: str = "json"):
+        self.path = path
+        self.timeout = timeout
+        self.codec = get_codec(codec)
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "eventid TEXT PRIMARY KEY, "
+            "version INTEGER NOT NULL, "
+            "data BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections can not be shared across a fork, so they are keyed by pid as well as thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, eventid: str) -> Optional[HairstyleChangeEvent]:
+        row = self._connection().execute(
+            "SELECT data FROM events WHERE eventid = ?", (eventid,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return decode_event(row[0])
+
+    def put(self, event: HairstyleChangeEvent) -> None:
+        conn = self._connection()
+
+        # The version is bumped from the stored row, not the caller's copy, so a put from a stale copy
+        # still moves the version forward and writers holding the stored version see the conflict
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version FROM events WHERE eventid = ?", (event.eventid,)).fetchone()
+            new_version = (0 if row is None else row[0]) + 1
+            conn.execute(
+                "INSERT INTO events (eventid, version, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (eventid) DO UPDATE SET version = excluded.version, data = excluded.data",
+                (event.eventid, new_version, self.codec.encode(event.model_copy(update={"version": new_version}))),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        event.version = new_version
+
+    def compare_and_swap(self, event: HairstyleChangeEvent, expected_version: int) -> bool:
+        new_version = expected_version + 1
+        data = self.codec.encode(event.model_copy(update={"version": new_version}))
+        conn = self._connection()
+
+        if expected_version == 0:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO events (eventid, version, data) VALUES (?, ?, ?)",
+                (event.eventid, new_version, data),
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE events SET version = ?, data = ? WHERE eventid = ? AND version = ?",
+                (new_version, data, event.eventid, expected_version),
+            )
+
+        if cursor.rowcount != 1:
+            return False
+
+        event.version = new_version
+        return True
+
+    def stamp(self, eventid: str) -> Optional[Hashable]:
+        row = self._connection().execute(
+            "SELECT version FROM events WHERE eventid = ?", (eventid,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def written_stamp(self, event: HairstyleChangeEvent) -> Optional[Hashable]:
+        return event.version
+
+    def delete(self, eventid: str, expected_version: int) -> bool:
+        cursor = self._connection().execute(
+            "DELETE FROM events WHERE eventid = ? AND version = ?", (eventid, expected_version)
+        )
+        return cursor.rowcount == 1
+
+    def iter_eventids(self) -> Iterator[str]:
+        # Pages through the primary key so no read transaction is held open while the caller works
+        last = ""
+        while True:
+            rows = self._connection().execute(
+                "SELECT eventid FROM events WHERE eventid > ? ORDER BY eventid LIMIT 1000", (last,)
+            ).fetchall()
+            if not rows:
+                return
+
+            for (eventid,) in rows:
+                yield eventid
+            last = rows[-1][0]
@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import typing
+
+from hairstyle_creation.models import InferenceJob
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE, get_queue
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+
+class PipelineTestCase(TestCase):
+    """
+    Runs the pipeline with its event store, indexes and job queues in a temporary directory, never in database/.
+
+    Test cases add their own settings by extending `pipeline_settings`.
+    """
+
+    # The job queues to create, and options every one of them gets
+    queues: tuple[str, ...] = (EMBEDDING_QUEUE, BLENDING_QUEUE)
+    queue_options: dict[str, typing.Any] = {}
+
+    def pipeline_settings(self) -> dict[str, typing.Any]:
+        return {
+            # The configured store, cache and all, only somewhere else
+            "EVENT_STORE": {
+                **settings.EVENT_STORE,
+                "OPTIONS": {**settings.EVENT_STORE.get("OPTIONS", {}), "directory": f"{self.directory}/events"},
+            },
+            "ACCOUNT_INDEX_PATH": f"{self.directory}/accounts.sqlite3",
+            "DEADLINE_INDEX_PATH": f"{self.directory}/deadlines.sqlite3",
+            "DEAD_LETTER_PATH": f"{self.directory}/dead_letters.sqlite3",
+            "BLEND_MEMO": None,
+            "EMBEDDING_CACHE": None,
+            "JOB_QUEUES": {
+                name: {
+                    "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+                    "OPTIONS": {"name": name, "path": f"{self.directory}/queues.sqlite3", **self.queue_options},
+                }
+                for name in self.queues
+            },
+        }
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(**self.pipeline_settings())
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def take(self, name: str, max_messages: int = 10) -> list[InferenceJob]:
+        """
+        Receives and acks the jobs waiting on a queue, like a worker would.
+
+        Args:
+            name (str): The name of the queue.
+            max_messages (int): The most jobs to take.
+
+        Returns:
+            jobs (list[InferenceJob]): The jobs taken, oldest first.
+        """
+        queue = get_queue(name)
+        messages = queue.receive(max_messages=max_messages)
+        for message in messages:
+            queue.ack(message.receipt)
+        return [InferenceJob.model_validate_json(message.body) for message in messages]
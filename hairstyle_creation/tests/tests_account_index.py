@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+import io
+import shutil
+import tempfile
+
+from hairstyle_creation.models import (
+    HairstyleChangeEvent,
+    UploadPicture,
+    create_eventid,
+    update_event,
+    get_data,
+    write_data
+)
+from hairstyle_creation.handlers.client_event_handler import create_new_hairstyle_event, get_history
+from hairstyle_creation.handlers.timeout_handler import get_deadline_index, schedule_timeout
+from hairstyle_creation.stores.account_index import AccountIndex
+
+from hairstyle_creation.tests.test_presets import picture_valid
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class AccountIndexTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = AccountIndex(path=f"{self.directory}/accounts.sqlite3")
+
+        start = datetime.now()
+        self.events = [
+            HairstyleChangeEvent(
+                eventid=create_eventid(),
+                account_identifier=ACCOUNT_IDENTIFIER,
+                start_timestamp=start + timedelta(minutes=i),
+                version=1,
+            )
+            for i in range(5)
+        ]
+        for event in self.events:
+            self.index.record(event)
+
+        self.index.record(HairstyleChangeEvent(eventid=create_eventid(), account_identifier="other", version=1))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_pages(self):
+        """Tests that an account's events are listed newest first, one page at a time"""
+        first, cursor = self.index.page(ACCOUNT_IDENTIFIER, limit=2)
+        second, cursor = self.index.page(ACCOUNT_IDENTIFIER, limit=2, cursor=cursor)
+        third, cursor = self.index.page(ACCOUNT_IDENTIFIER, limit=2, cursor=cursor)
+
+        listed = [summary.eventid for summary in first + second + third]
+        self.assertEqual(listed, [event.eventid for event in reversed(self.events)])
+        self.assertIsNone(cursor)
+
+    def test_summary_updates(self):
+        """Tests that the summary follows the event, and an older write does not replace a newer one"""
+        event = self.events[0]
+        event.uploaded_picture = UploadPicture(**picture_valid)
+        event.version = 3
+        self.index.record(event)
+
+        stale = event.model_copy(update={"errored": True, "version": 2})
+        self.index.record(stale)
+
+        summaries, _ = self.index.page(ACCOUNT_IDENTIFIER, limit=10)
+        self.assertEqual(summaries[-1].status, "uploaded")
+
+    def test_remove(self):
+        """Tests that removed events leave the history"""
+        self.index.remove(self.events[-1].eventid)
+
+        summaries, _ = self.index.page(ACCOUNT_IDENTIFIER, limit=10)
+        self.assertNotIn(self.events[-1].eventid, [summary.eventid for summary in summaries])
+
+
+class HistoryTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EVENT_STORE={
+                "BACKEND": "hairstyle_creation.stores.file_store.FileEventStore",
+                "OPTIONS": {"directory": self.directory},
+            },
+            ACCOUNT_INDEX_PATH=f"{self.directory}/accounts.sqlite3",
+            DEADLINE_INDEX_PATH=f"{self.directory}/deadlines.sqlite3",
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_writes_are_indexed(self):
+        """Tests that events are indexed as they are created and changed"""
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+
+        def upload_picture(event: HairstyleChangeEvent) -> None:
+            event.uploaded_picture = UploadPicture(**picture_valid)
+
+        update_event(eventid, upload_picture, ACCOUNT_IDENTIFIER)
+
+        summaries, cursor = get_history(ACCOUNT_IDENTIFIER)
+
+        self.assertEqual([summary.eventid for summary in summaries], [eventid])
+        self.assertEqual(summaries[0].status, "uploaded")
+        self.assertIsNone(cursor)
+
+    def test_history_view(self):
+        """Tests the paginated history endpoint"""
+        eventids = [create_new_hairstyle_event(account_identifier="") for _ in range(3)]
+        write_data(HairstyleChangeEvent(eventid=create_eventid(), account_identifier=ACCOUNT_IDENTIFIER))
+
+        response = self.client.get(reverse("history"), {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+
+        response = self.client.get(reverse("history"), {"limit": 2, "cursor": first["next_cursor"]})
+        second = response.json()
+
+        listed = [summary["eventid"] for summary in first["events"] + second["events"]]
+        self.assertEqual(listed, list(reversed(eventids)))
+        self.assertIsNone(second["next_cursor"])
+
+        self.assertEqual(self.client.get(reverse("history"), {"cursor": "nonsense"}).status_code, 400)
+
+    def test_drop_event_partitions(self):
+        """Tests that dropping old partitions also removes their events from the account and deadline indexes"""
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        old_event = HairstyleChangeEvent(
+            eventid="202001-0112-0000-" + eventid.split("-", 3)[3],
+            account_identifier=ACCOUNT_IDENTIFIER
+        )
+        write_data(old_event)
+        schedule_timeout(old_event)
+
+        out = io.StringIO()
+        call_command("drop_event_partitions", "--older-than-days", "1", stdout=out)
+        self.assertIn("Dropped 1 partitions", out.getvalue())
+        self.assertIn("Removed 1 events from the account index", out.getvalue())
+
+        summaries, _ = get_history(ACCOUNT_IDENTIFIER)
+        self.assertEqual([summary.eventid for summary in summaries], [eventid])
+        self.assertIsNone(get_deadline_index().deadline(old_event.eventid))
+        self.assertIsNotNone(get_deadline_index().deadline(eventid))
+        self.assertIsNone(get_data(old_event.eventid))
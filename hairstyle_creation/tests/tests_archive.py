@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+
+from hairstyle_creation.models import (
+    EVENT_TIMEOUT,
+    BlendInferenceResult,
+    EmbeddingInferenceResult,
+    Hairstyle,
+    HairstyleChangeEvent,
+    InferenceEvent,
+    UploadPicture,
+    create_eventid,
+    get_data,
+    get_event,
+    update_event,
+    write_data
+)
+from hairstyle_creation.handlers.archive_handler import archive_events
+from hairstyle_creation.handlers.client_event_handler import get_results
+from hairstyle_creation.stores.archive import EventArchive
+
+from hairstyle_creation.tests.test_presets import embedding_inference_result_valid, hairstyle_1, picture_valid
+
+from django.test import TestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+def make_old_event(days: int, finished: bool = True) -> HairstyleChangeEvent:
+    start = datetime.now() - timedelta(days=days)
+    return HairstyleChangeEvent(
+        eventid=start.strftime('%Y%m-%d%H-%M%S-') + create_eventid().split("-", 3)[3],
+        account_identifier=ACCOUNT_IDENTIFIER,
+        hairstyles=[Hairstyle(**hairstyle_1)],
+        start_timestamp=start,
+        event_timeout=start + EVENT_TIMEOUT,
+        finished_timestamp=start + timedelta(minutes=1) if finished else None,
+    )
+
+
+class EventArchiveTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = EventArchive(directory=self.directory, segment_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get(self):
+        """Tests that a single archived event can be fetched back by its ID"""
+        events = [make_old_event(days=10) for _ in range(3)]
+        self.assertEqual(self.archive.append(events), 3)
+
+        self.assertEqual(self.archive.get(events[1].eventid), events[1])
+        self.assertIsNone(self.archive.get(create_eventid()))
+        self.assertEqual(len(self.archive), 3)
+
+    def test_segments(self):
+        """Tests that a new segment is started once the current one is full"""
+        events = []
+        for _ in range(20):
+            event = make_old_event(days=10)
+            self.archive.append([event])
+            events.append(event)
+
+        self.assertGreater(len(self.archive.segments()), 1)
+        self.assertEqual(list(self.archive.iter_events()), events)
+        self.assertEqual(self.archive.get(events[0].eventid), events[0])
+
+    def test_archived_again(self):
+        """Tests that only the newest copy of an event archived twice is read"""
+        event = make_old_event(days=10)
+        self.archive.append([event])
+
+        event.errored = True
+        self.archive.append([event])
+
+        self.assertTrue(self.archive.get(event.eventid).errored)
+        self.assertEqual(list(self.archive.iter_events()), [event])
+
+
+class ArchiveEventsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EVENT_STORE={
+                "BACKEND": "hairstyle_creation.stores.file_store.FileEventStore",
+                "OPTIONS": {"directory": f"{self.directory}/live"},
+            },
+            EVENT_ARCHIVE={"OPTIONS": {"directory": f"{self.directory}/archive"}},
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_archive_old_events(self):
+        """Tests that only old events that are done are moved, and can still be read"""
+        old_event = make_old_event(days=10)
+        unfinished_event = make_old_event(days=10, finished=False)
+        unfinished_event.event_timeout = datetime.now() + EVENT_TIMEOUT
+        recent_event = make_old_event(days=1)
+        for event in (old_event, unfinished_event, recent_event):
+            write_data(event)
+
+        self.assertEqual(archive_events(max_age=timedelta(days=7)), 1)
+
+        self.assertIsNone(get_data(old_event.eventid))
+        self.assertIsNotNone(get_data(unfinished_event.eventid))
+        self.assertIsNotNone(get_data(recent_event.eventid))
+
+        event = get_event(old_event.eventid, account_identifier=ACCOUNT_IDENTIFIER, check_timeout=False)
+        self.assertEqual(event, old_event)
+
+        # Archived events can not be changed
+        self.assertRaises(Exception, update_event, old_event.eventid, lambda event: None, check_timeout=False)
+
+        self.assertEqual(archive_events(max_age=timedelta(days=7)), 0)
+
+    def test_read_archived_results(self):
+        """Tests that the results of an archived event are read the way a client asks for them, long after its timeout"""
+        old_event = make_old_event(days=10)
+        old_event.uploaded_picture = UploadPicture(**picture_valid)
+        old_event.embedding_inference = InferenceEvent(
+            inference_eventid="embedding",
+            type="Embedding",
+            start_timestamp=old_event.start_timestamp,
+            result=EmbeddingInferenceResult(**embedding_inference_result_valid),
+        )
+        old_event.blend_inferences = [
+            InferenceEvent(
+                inference_eventid="blend",
+                type="Blending",
+                start_timestamp=old_event.start_timestamp,
+                hairstyle=old_event.hairstyles[0],
+                result=BlendInferenceResult(
+                    inference_eventid="blend",
+                    hairchange_eventid=old_event.eventid,
+                    result_img_location="s3://results/blend.png",
+                    errored=False,
+                ),
+                finished_timestamp=old_event.finished_timestamp,
+            ),
+        ]
+        write_data(old_event)
+        self.assertEqual(archive_events(max_age=timedelta(days=7)), 1)
+
+        self.assertEqual(get_event(old_event.eventid, ACCOUNT_IDENTIFIER), old_event)
+        self.assertEqual(get_results(ACCOUNT_IDENTIFIER, old_event.eventid), [old_event.blend_inferences[0].result])
+
+    def test_finished_past_timeout(self):
+        """Tests that a finished event still in the live store is read past its timeout, and not expired"""
+        event = make_old_event(days=1)
+        write_data(event)
+
+        self.assertEqual(get_event(event.eventid, ACCOUNT_IDENTIFIER), event)
+        self.assertFalse(get_data(event.eventid).errored)
+
+        # One that never finished is expired by the read
+        unfinished_event = make_old_event(days=1, finished=False)
+        write_data(unfinished_event)
+
+        self.assertRaises(TimeoutError, get_event, unfinished_event.eventid, ACCOUNT_IDENTIFIER)
+        self.assertTrue(get_data(unfinished_event.eventid).errored)
@@ -0,0 +1,70 @@
+import json
+
+from asgiref.sync import sync_to_async
+
+from hairstyle_creation.models import aget_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import hairstyle_1, picture_valid
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+
+
+class AsyncViewsTest(PipelineTestCase):
+    async def test_rendering(self):
+        """Tests a whole rendering through the async views, with the workers posting over HTTP"""
+        eventid = (await self.async_client.get(reverse("start_creation"))).json()["eventid"]
+
+        await self.async_client.post(
+            f"{reverse('upload_photo')}?eventid={eventid}",
+            json.dumps({"photo_link": picture_valid}),
+            content_type="application/json",
+        )
+        await self.async_client.post(
+            f"{reverse('rendering_start')}?eventid={eventid}",
+            json.dumps({"hairstyles": [hairstyle_1]}),
+            content_type="application/json",
+        )
+
+        for name, url in ((EMBEDDING_QUEUE, "embed_results"), (BLENDING_QUEUE, "blend_results")):
+            job = (await sync_to_async(self.take)(name, 1))[0]
+            lease = (await self.async_client.post(reverse("job_lease"), job.model_dump_json(), content_type="application/json")).json()["lease"]
+
+            result = {"inference_eventid": job.inference_eventid, "hairchange_eventid": eventid, "errored": False, "lease_id": lease["lease_id"]}
+            if name == EMBEDDING_QUEUE:
+                result.update(embedded_file_location="embedding.npy", segmentation_file_location="segmentation.png")
+            else:
+                result.update(result_img_location="blend.jpg")
+
+            response = await self.async_client.post(f"{reverse(url)}?eventid={eventid}", json.dumps(result), content_type="application/json")
+            self.assertEqual(response.json(), {"sucess": True})
+
+        results = (await self.async_client.get(f"{reverse('rendering_results')}?eventid={eventid}")).json()["results"]
+        self.assertEqual([result["result_img_location"] for result in results], ["blend.jpg"])
+
+    async def test_aget_event(self):
+        """Tests that the async lookup checks the account like the sync one"""
+        eventid = (await self.async_client.get(reverse("start_creation"))).json()["eventid"]
+
+        self.assertEqual((await aget_event(eventid, "")).eventid, eventid)
+        with self.assertRaises(PermissionError):
+            await aget_event(eventid, "someone else")
+
+    async def test_metrics_access(self):
+        """Tests that the metrics are only served to staff users and with the metrics token"""
+        self.assertEqual((await self.async_client.get(reverse("metrics"))).status_code, 403)
+
+        with override_settings(METRICS_TOKEN="secret"):
+            response = await self.async_client.get(reverse("metrics"), headers={"X-Metrics-Token": "wrong"})
+            self.assertEqual(response.status_code, 403)
+
+            response = await self.async_client.get(reverse("metrics"), headers={"X-Metrics-Token": "secret"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("queues", response.json())
+
+        staff = await User.objects.acreate(username="staff", is_staff=True)
+        await self.async_client.aforce_login(staff)
+        self.assertEqual((await self.async_client.get(reverse("metrics"))).status_code, 200)
@@ -0,0 +1,142 @@
+import shutil
+import tempfile
+
+from hairstyle_creation.models import Hairstyle, InferenceJob, get_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE, get_queue
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event
+)
+from hairstyle_creation.handlers.inference_handler import get_blend_memo, post_embed_result
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+from hairstyle_creation.stores.blend_memo import BlendMemo
+
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_result_valid,
+    hairstyle_1,
+    hairstyle_2,
+    picture_valid
+)
+
+from django.test import TestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class BlendMemoTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.memo = BlendMemo(path=f"{self.directory}/blends.sqlite3", max_entries=2, ttl=60, clock=self.clock)
+        self.hairstyle_1 = Hairstyle(**hairstyle_1)
+        self.hairstyle_2 = Hairstyle(**hairstyle_2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_lookup(self):
+        """Tests that blends are found by embedding, hairstyle and color"""
+        self.memo.put("a.npz", self.hairstyle_1, "a-1.jpg")
+        recolored = self.hairstyle_1.model_copy(update={"color_id": 99})
+
+        self.assertEqual(
+            self.memo.lookup("a.npz", [self.hairstyle_1, self.hairstyle_2, recolored]),
+            {(self.hairstyle_1.hairstyle_id, self.hairstyle_1.color_id): "a-1.jpg"},
+        )
+        self.assertEqual(self.memo.lookup("b.npz", [self.hairstyle_1]), {})
+        self.assertAlmostEqual(self.memo.stats()["hit_rate"], 1 / 4)
+
+    def test_expiry(self):
+        """Tests that blends older than the TTL are not reused"""
+        self.memo.put("a.npz", self.hairstyle_1, "a-1.jpg")
+
+        self.clock.now += 61
+        self.assertEqual(self.memo.lookup("a.npz", [self.hairstyle_1]), {})
+        self.assertEqual(len(self.memo), 0)
+        self.assertEqual(self.memo.stats()["expired"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """Tests that the memo stays under max_entries by evicting what was used longest ago"""
+        self.memo.put("a.npz", self.hairstyle_1, "a-1.jpg")
+        self.clock.now += 1
+        self.memo.put("b.npz", self.hairstyle_1, "b-1.jpg")
+        self.clock.now += 1
+        self.memo.lookup("a.npz", [self.hairstyle_1])
+        self.clock.now += 1
+        self.memo.put("c.npz", self.hairstyle_1, "c-1.jpg")
+
+        self.assertEqual(self.memo.lookup("b.npz", [self.hairstyle_1]), {})
+        self.assertEqual(len(self.memo.lookup("a.npz", [self.hairstyle_1])), 1)
+        self.assertEqual(len(self.memo), 2)
+
+
+class RepeatBlendTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            BLEND_MEMO={"PATH": f"{self.directory}/blends.sqlite3"},
+            JOB_QUEUES={
+                name: {
+                    "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+                    "OPTIONS": {"name": name, "path": f"{self.directory}/queues.sqlite3"},
+                }
+                for name in (EMBEDDING_QUEUE, BLENDING_QUEUE)
+            },
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def pick(self, hairstyles: list[dict]) -> str:
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=hairstyles)
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, picture=picture_valid)
+
+        post_embed_result({
+            **embedding_inference_result_valid,
+            "inference_eventid": get_event(eventid).embedding_inference.inference_eventid,
+            "hairchange_eventid": eventid,
+        })
+        return eventid
+
+    def run_blends(self) -> int:
+        queue = get_queue(BLENDING_QUEUE)
+        messages = queue.receive(max_messages=10)
+        for message in messages:
+            run_job(InferenceJob.model_validate_json(message.body))
+            queue.ack(message.receipt)
+        return len(messages)
+
+    def test_repeat_blend(self):
+        """Tests that blends made before from the same embedding are attached, and only the others are queued"""
+        first = self.pick([hairstyle_1])
+        self.assertEqual(self.run_blends(), 1)
+        first_image = get_event(first).blend_inferences[0].result.result_img_location
+
+        second = self.pick([hairstyle_1, hairstyle_2])
+
+        event = get_event(second)
+        self.assertEqual(event.blend_inferences[0].result.result_img_location, first_image)
+        self.assertEqual(event.blend_inferences[0].result.inference_eventid, event.blend_inferences[0].inference_eventid)
+        self.assertIsNone(event.blend_inferences[1].result)
+        self.assertIsNone(event.finished_timestamp)
+
+        self.assertEqual(self.run_blends(), 1)
+        self.assertIsNotNone(get_event(second).finished_timestamp)
+
+        # Every blend of a third pick is known, so it finishes without a job
+        third = self.pick([hairstyle_2, hairstyle_1])
+        self.assertEqual(get_queue(BLENDING_QUEUE).depth().visible, 0)
+        self.assertIsNotNone(get_event(third).finished_timestamp)
+        self.assertEqual(get_blend_memo().stats()["hits"], 3)
@@ -0,0 +1,142 @@
+from unittest import mock
+
+from hairstyle_creation.models import InferenceJob, get_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE, get_queue, retry_inferences
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event,
+    get_results
+)
+from hairstyle_creation.handlers import inference_handler
+from hairstyle_creation.handlers.inference_handler import post_results
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import hairstyle_1, hairstyle_2, picture_valid
+
+from django.urls import reverse
+
+ACCOUNT_IDENTIFIER = "bulk-account"
+
+
+def embedding_result(job: InferenceJob) -> dict:
+    return {"type": "Embedding", "result": {
+        "inference_eventid": job.inference_eventid,
+        "hairchange_eventid": job.hairchange_eventid,
+        "embedded_file_location": f"stub/{job.inference_eventid}.npy",
+        "segmentation_file_location": f"stub/{job.inference_eventid}.png",
+        "errored": False,
+    }}
+
+def blend_result(job: InferenceJob) -> dict:
+    return {"type": "Blending", "result": {
+        "inference_eventid": job.inference_eventid,
+        "hairchange_eventid": job.hairchange_eventid,
+        "result_img_location": f"stub/{job.inference_eventid}.jpg",
+        "errored": False,
+    }}
+
+
+class BulkResultsTest(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event_ids = []
+        for _ in range(2):
+            event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+            add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=event_id, hairstyles_dict=[hairstyle_1, hairstyle_2])
+            add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=event_id, picture=picture_valid)
+            self.event_ids.append(event_id)
+
+        self.assertEqual([status["status"] for status in post_results([embedding_result(job) for job in self.take(EMBEDDING_QUEUE)])], ["posted"] * 2)
+
+    def test_one_write_per_event(self):
+        """Tests that the blends of every event are posted with one write per event"""
+        jobs = self.take(BLENDING_QUEUE)
+        self.assertEqual(len(jobs), 4)
+        versions = {event_id: get_event(event_id).version for event_id in self.event_ids}
+
+        statuses = post_results([blend_result(job) for job in jobs])
+
+        self.assertEqual([status["status"] for status in statuses], ["posted"] * 4)
+        for event_id in self.event_ids:
+            self.assertEqual(get_event(event_id).version, versions[event_id] + 1)
+            self.assertEqual(len(get_results(ACCOUNT_IDENTIFIER, event_id)), 2)
+
+    def test_statuses(self):
+        """Tests that every result gets its own status and the rejected ones do not hold up the others"""
+        first, second, *_ = self.take(BLENDING_QUEUE)
+        post_results([blend_result(first)])
+        unknown = blend_result(second)
+        unknown["result"] = {**unknown["result"], "inference_eventid": "unknown"}
+
+        statuses = post_results([
+            blend_result(first),
+            unknown,
+            {"type": "Blending", "result": {"inference_eventid": first.inference_eventid}},
+            {"type": "Segmentation", "result": {}},
+            blend_result(second),
+        ])
+
+        self.assertEqual(
+            [status["status"] for status in statuses],
+            ["already_posted", "unknown_inference", "invalid", "invalid", "posted"],
+        )
+        self.assertIn("error", statuses[1])
+        self.assertNotIn("error", statuses[4])
+
+    def test_failed_write_leaves_no_trace(self):
+        """Tests that a result failing after it started changing the event fails its event's write, side effects and all"""
+        first, second, *_ = [job for job in self.take(BLENDING_QUEUE) if job.hairchange_eventid == self.event_ids[0]]
+        errored = blend_result(first)
+        errored["result"] = {**errored["result"], "errored": True}
+
+        def retry_then_fail(*args, **kwargs):
+            retry_inferences(*args, **kwargs)
+            raise RuntimeError("Failed after queueing the retry")
+
+        with mock.patch.object(inference_handler, "retry_inferences", side_effect=retry_then_fail):
+            statuses = post_results([blend_result(second), errored])
+
+        self.assertEqual([status["status"] for status in statuses], ["errored", "errored"])
+
+        blends = {blend.inference_eventid: blend for blend in get_event(self.event_ids[0]).blend_inferences}
+        self.assertEqual(blends[first.inference_eventid].attempts, 1)
+        self.assertIsNone(blends[first.inference_eventid].result)
+        self.assertIsNone(blends[second.inference_eventid].result)
+        # The retry was never sent
+        self.assertEqual(get_queue(BLENDING_QUEUE).depth().visible, 0)
+
+    def test_entries_not_of_the_job(self):
+        """Tests that the results of a job result that are not the job's are rejected one by one"""
+        jobs = self.take(BLENDING_QUEUE)
+        first, second = [job for job in jobs if job.hairchange_eventid == self.event_ids[0]]
+        other_event = next(job for job in jobs if job.hairchange_eventid == self.event_ids[1])
+
+        job_result = {"type": "Blending", "result": {
+            "job_id": first.inference_eventid,
+            "hairchange_eventid": self.event_ids[0],
+            "results": [blend_result(job)["result"] for job in (first, second, other_event)],
+        }}
+        status, = post_results([job_result])
+
+        self.assertEqual(status["status"], "posted")
+        self.assertEqual(
+            [(entry["inference_eventid"], entry["status"]) for entry in status["rejected"]],
+            [(second.inference_eventid, "invalid"), (other_event.inference_eventid, "invalid")],
+        )
+
+        blends = {blend.inference_eventid: blend for blend in get_event(self.event_ids[0]).blend_inferences}
+        self.assertIsNotNone(blends[first.inference_eventid].result)
+        self.assertIsNone(blends[second.inference_eventid].result)
+        self.assertTrue(all(blend.result is None for blend in get_event(self.event_ids[1]).blend_inferences))
+
+    def test_view(self):
+        """Tests that the view posts the results and rejects a body that is not a list"""
+        url = reverse("bulk_results")
+        jobs = self.take(BLENDING_QUEUE)
+
+        response = self.client.post(url, [blend_result(job) for job in jobs], content_type="application/json")
+        self.assertEqual([status["status"] for status in response.json()["results"]], ["posted"] * 4)
+
+        response = self.client.post(url, blend_result(jobs[0]), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
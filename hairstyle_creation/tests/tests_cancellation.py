@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from hairstyle_creation import metrics
+from hairstyle_creation.errors import EventCancelled
+from hairstyle_creation.models import EventSummary, get_event
+from hairstyle_creation.handlers.aws_queue_handler import EMBEDDING_QUEUE, get_queue
+from hairstyle_creation.handlers.cancel_handler import cancel_event
+from hairstyle_creation.handlers.client_event_handler import add_uploaded_picture, create_new_hairstyle_event
+from hairstyle_creation.handlers.lease_handler import acquire_lease, renew_lease
+from hairstyle_creation.handlers.timeout_handler import expire_event
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import picture_valid
+
+from django.urls import reverse
+
+# The client views act for this account
+ACCOUNT_IDENTIFIER = ""
+
+
+class CancellationTest(PipelineTestCase):
+    def pipeline_settings(self):
+        return {
+            **super().pipeline_settings(),
+            "JOB_CANCELLATION": {"GPU_SECONDS": {"Embedding": 10.0, "Blending": 5.0}},
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+
+    def test_cancel_queued(self):
+        """Tests that cancelling an event discards its queued jobs and counts the GPU time they would have used"""
+        before = metrics.collect()["cancellation"]
+
+        self.assertTrue(cancel_event(self.event_id, ACCOUNT_IDENTIFIER))
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 0)
+
+        event = get_event(self.event_id)
+        self.assertTrue(event.errored)
+        self.assertEqual(EventSummary.from_event(event).status, "cancelled")
+
+        after = metrics.collect()["cancellation"]
+        self.assertEqual(after["discarded_jobs"] - before["discarded_jobs"], 1)
+        self.assertGreater(after["reclaimed_gpu_seconds"], before["reclaimed_gpu_seconds"])
+
+        self.assertFalse(cancel_event(self.event_id, ACCOUNT_IDENTIFIER))
+
+    def test_cancel_running(self):
+        """Tests that the worker of a cancelled event loses its lease and its results are discarded"""
+        job = self.take(EMBEDDING_QUEUE, 1)[0]
+        lease = acquire_lease(job)
+        before = metrics.collect()["cancellation"]["aborted_jobs"]
+
+        response = self.client.post(f"{reverse('rendering_cancel')}?eventid={self.event_id}")
+        self.assertEqual(response.json(), {"cancelled": True})
+
+        self.assertEqual(metrics.collect()["cancellation"]["aborted_jobs"] - before, 1)
+        self.assertIsNone(renew_lease(lease.lease_id))
+        self.assertIsNone(acquire_lease(job))
+        self.assertRaises(EventCancelled, run_job, job, lease.lease_id)
+        self.assertIsNone(get_event(self.event_id).embedding_inference.result)
+
+    def test_timeout_revokes_leases(self):
+        """Tests that expiring a timed out event revokes the leases of its running jobs"""
+        lease = acquire_lease(self.take(EMBEDDING_QUEUE, 1)[0])
+
+        self.assertTrue(expire_event(self.event_id, now=datetime.now() + timedelta(days=1)))
+        self.assertIsNone(renew_lease(lease.lease_id))
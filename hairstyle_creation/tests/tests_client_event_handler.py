@@ -3,6 +3,7 @@ from datetime import datetime
 import pydantic_core
 from hairstyle_creation.errors import AlreadyExists
 from hairstyle_creation.models import (
+    EVENT_TIMEOUT,
     BlendInferenceResult,
     HairstyleChangeEvent,
     Hairstyle,
@@ -185,7 +186,7 @@ class GetResultsTest(TestCase):
     finished_event = HairstyleChangeEvent(
         account_identifier=ACCOUNT_IDENTIFIER,
         eventid="oijasd",
-        event_timeout=datetime.now(),
+        event_timeout=datetime.now() + EVENT_TIMEOUT,
         start_timestamp=datetime.now(),
         picked_hairstyles_timestamp=datetime.now(),
         uploaded_picture_timestamp=datetime.now(),
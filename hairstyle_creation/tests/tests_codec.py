@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    EmbeddingInferenceResult,
+    Hairstyle,
+    HairstyleChangeEvent,
+    InferenceEvent,
+    UploadPicture,
+    create_eventid
+)
+from hairstyle_creation.stores import codec
+from hairstyle_creation.stores.codec import BinaryCodec, JsonCodec, decode_event
+
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_valid,
+    hairstyle_1,
+    hairstyle_2,
+    picture_valid
+)
+
+from django.test import TestCase
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+def make_finished_event() -> HairstyleChangeEvent:
+    eventid = create_eventid()
+    bucket = f"s3://fusion-styles-inference/{eventid}"
+
+    embedding_inference = InferenceEvent(**embedding_inference_valid)
+    embedding_inference.set_result(EmbeddingInferenceResult(
+        inference_eventid=embedding_inference.inference_eventid,
+        hairchange_eventid=eventid,
+        embedded_file_location=f"{bucket}/embedding.npz",
+        segmentation_file_location=f"{bucket}/segmentation.png",
+        errored=False,
+    ))
+
+    hairstyles = [Hairstyle(**hairstyle_1), Hairstyle(**hairstyle_2)]
+    blend_inferences = []
+    for hairstyle in hairstyles:
+        blend_inference = InferenceEvent(inference_eventid=create_eventid(), type="Blending", hairstyle=hairstyle)
+        blend_inference.set_result(BlendInferenceResult(
+            inference_eventid=blend_inference.inference_eventid,
+            hairchange_eventid=eventid,
+            result_img_location=f"{bucket}/blend-{hairstyle.hairstyle_id}.png",
+            errored=False,
+        ))
+        blend_inferences.append(blend_inference)
+
+    return HairstyleChangeEvent(
+        eventid=eventid,
+        account_identifier=ACCOUNT_IDENTIFIER,
+        uploaded_picture=UploadPicture(file_location=f"{bucket}/upload.jpg", bbox=picture_valid["bbox"]),
+        hairstyles=hairstyles,
+        embedding_inference=embedding_inference,
+        blend_inferences=blend_inferences,
+        uploaded_picture_timestamp=datetime.now(),
+        picked_hairstyles_timestamp=datetime.now(),
+        finished_timestamp=datetime.now(),
+        version=3,
+    )
+
+
+class BinaryCodecTest(TestCase):
+    def setUp(self):
+        self.event = make_finished_event()
+
+    def test_round_trip(self):
+        """Tests that an event comes back from the binary format exactly as it was"""
+        event = decode_event(BinaryCodec().encode(self.event))
+
+        self.assertEqual(event, self.event)
+        self.assertEqual(event.model_dump_json(), self.event.model_dump_json())
+
+    def test_uncommon_values(self):
+        """Tests the values that do not fit the compact forms, large integers and timestamps with a timezone"""
+        self.event.hairstyles = [Hairstyle(**{**hairstyle_1, "hairstyle_id": 2**40, "color_id": -1})]
+        self.event.finished_timestamp = datetime(2024, 5, 1, 12, 30, tzinfo=timezone(timedelta(hours=-5)))
+
+        event = decode_event(BinaryCodec().encode(self.event))
+
+        self.assertEqual(event.hairstyles, self.event.hairstyles)
+        self.assertEqual(event.finished_timestamp, self.event.finished_timestamp)
+        self.assertEqual(event.finished_timestamp.utcoffset(), timedelta(hours=-5))
+
+    def test_reads_json(self):
+        """Tests that events written as JSON are still read"""
+        self.assertEqual(decode_event(JsonCodec().encode(self.event)), self.event)
+
+    def test_smaller_than_json(self):
+        """Tests that the binary format is much smaller than the JSON, even for an event with only two blends"""
+        self.assertLessEqual(2.5 * len(BinaryCodec().encode(self.event)), len(JsonCodec().encode(self.event)))
+
+    def test_newer_format(self):
+        """Tests that a record from a newer format version is refused instead of misread"""
+        raw = bytearray(BinaryCodec().encode(self.event))
+        raw[len(codec.MAGIC)] = codec.FORMAT_VERSION + 1
+
+        self.assertRaises(ValueError, decode_event, bytes(raw))
+
+    def test_layouts_cover_models(self):
+        """Tests that every model field has a place in the binary layouts"""
+        for model_class, layout in codec.LAYOUTS:
+            self.assertEqual(set(layout), set(model_class.model_fields), model_class.__name__)
+
+    def test_appended_field(self):
+        """Tests that records written before a field was appended load it with its default"""
+        layouts = list(codec.LAYOUTS)
+        # Drops the last three fields, cancelled_timestamp, speculative_inferences and version
+        layouts[0] = (HairstyleChangeEvent, layouts[0][1][:-3])
+
+        with mock.patch.object(codec, "LAYOUTS", tuple(layouts)):
+            raw = BinaryCodec().encode(self.event)
+
+        event = decode_event(raw)
+
+        self.assertEqual(event.version, 0)
+        self.assertEqual(event.blend_inferences, self.event.blend_inferences)
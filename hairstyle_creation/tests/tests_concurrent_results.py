@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import shutil
+import tempfile
+
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    Hairstyle,
+    InferenceEvent,
+    create_eventid,
+    get_event,
+    write_data
+)
+from hairstyle_creation.handlers.inference_handler import post_blend_result
+from hairstyle_creation.handlers.client_event_handler import create_new_hairstyle_event
+
+from hairstyle_creation.tests.test_presets import (
+    blend_inference_valid,
+    blend_inference_result_valid,
+    hairstyle_1
+)
+
+from django.test import TestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+BLENDS = 50
+
+
+class ConcurrentBlendResultsTestMixin:
+    """Fires many blend results at one event at the same time, mixed into one TestCase per store"""
+
+    event_store: dict
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        store = {**self.event_store, "OPTIONS": {
+            name: value.format(directory=self.directory) for name, value in self.event_store["OPTIONS"].items()
+        }}
+        self.settings_override = override_settings(EVENT_STORE=store)
+        self.settings_override.enable()
+
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+        event.hairstyles = [Hairstyle(**{**hairstyle_1, "hairstyle_id": i}) for i in range(BLENDS)]
+        event.blend_inferences = []
+        for hairstyle in event.hairstyles:
+            inference_event = InferenceEvent(**blend_inference_valid)
+            inference_event.inference_eventid = create_eventid()
+            inference_event.hairstyle = hairstyle
+            event.blend_inferences.append(inference_event)
+        write_data(event)
+
+        self.event = event
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_concurrent_blend_results(self):
+        """Tests that no blend result is lost when all of them are posted at once"""
+        def post(inference_event: InferenceEvent):
+            results = blend_inference_result_valid.copy()
+            results["inference_eventid"] = inference_event.inference_eventid
+            results["hairchange_eventid"] = self.event_id
+            post_blend_result(results)
+
+        with ThreadPoolExecutor(max_workers=BLENDS) as executor:
+            # Consumes the results so exceptions from the threads are raised here
+            list(executor.map(post, self.event.blend_inferences))
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+
+        self.assertIsInstance(event.finished_timestamp, datetime)
+        for inference_event in event.blend_inferences:
+            self.assertIsInstance(inference_event.result, BlendInferenceResult)
+
+
+class FileStoreConcurrentBlendResultsTest(ConcurrentBlendResultsTestMixin, TestCase):
+    event_store = {
+        "BACKEND": "hairstyle_creation.stores.file_store.FileEventStore",
+        "OPTIONS": {"directory": "{directory}"},
+        "CACHE": {},
+    }
+
+
+class SQLiteStoreConcurrentBlendResultsTest(ConcurrentBlendResultsTestMixin, TestCase):
+    event_store = {
+        "BACKEND": "hairstyle_creation.stores.sqlite_store.SQLiteEventStore",
+        "OPTIONS": {"path": "{directory}/events.sqlite3"},
+        "CACHE": {},
+    }
+
+
+class LogStoreConcurrentBlendResultsTest(ConcurrentBlendResultsTestMixin, TestCase):
+    event_store = {
+        "BACKEND": "hairstyle_creation.stores.log_store.EventLogStore",
+        "OPTIONS": {"directory": "{directory}"},
+        "CACHE": {},
+    }
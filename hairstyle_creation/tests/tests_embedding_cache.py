@@ -0,0 +1,128 @@
+import hashlib
+import shutil
+import tempfile
+
+from hairstyle_creation.models import UploadPicture, get_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE, get_queue
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event
+)
+from hairstyle_creation.handlers.inference_handler import get_embedding_cache, post_embed_result
+from hairstyle_creation.stores.embedding_cache import EmbeddingCache, picture_key
+
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_result_valid,
+    hairstyle_1,
+    hairstyle_2,
+    picture_valid
+)
+
+from django.test import TestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+picture_hashed = {**picture_valid, "content_hash": hashlib.sha256(b"photo").hexdigest()}
+
+
+class EmbeddingCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = EmbeddingCache(path=f"{self.directory}/embeddings.sqlite3", max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_key(self):
+        """Tests that the key follows the stored image, its content and bbox, and pictures without a hash are not cached"""
+        picture = UploadPicture(**picture_hashed)
+
+        self.assertEqual(picture_key(picture), picture_key(UploadPicture(**picture_hashed)))
+        # Another image claiming the same content does not get its embedding
+        self.assertNotEqual(picture_key(picture), picture_key(picture.model_copy(update={"file_location": "elsewhere"})))
+        self.assertNotEqual(picture_key(picture), picture_key(picture.model_copy(update={"content_hash": hashlib.sha256(b"other").hexdigest()})))
+        self.assertNotEqual(picture_key(picture), picture_key(picture.model_copy(update={"bbox": (0, 0, 3, 4)})))
+        self.assertIsNone(picture_key(UploadPicture(**picture_valid)))
+
+    def test_evicts_least_recently_used(self):
+        """Tests that the cache stays under max_entries by evicting what was used longest ago"""
+        self.cache.put("a", "a.npz", "a.png")
+        self.cache.put("b", "b.npz", "b.png")
+        self.assertEqual(self.cache.get("a"), ("a.npz", "a.png"))
+
+        self.cache.put("c", "c.npz", "c.png")
+
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 2)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["evicted"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+
+
+class RepeatUploadTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EMBEDDING_CACHE={"PATH": f"{self.directory}/embeddings.sqlite3"},
+            BLEND_MEMO=None,
+            JOB_QUEUES={
+                name: {
+                    "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+                    "OPTIONS": {"name": name, "path": f"{self.directory}/queues.sqlite3"},
+                }
+                for name in (EMBEDDING_QUEUE, BLENDING_QUEUE)
+            },
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def embed(self, picture: dict) -> str:
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, picture=picture)
+
+        embedding_inference = get_event(eventid).embedding_inference
+        if embedding_inference.result is None:
+            post_embed_result({
+                **embedding_inference_result_valid,
+                "inference_eventid": embedding_inference.inference_eventid,
+                "hairchange_eventid": eventid,
+            })
+        return eventid
+
+    def test_repeat_upload(self):
+        """Tests that a repeat upload of the same photo reuses the embedding and goes straight to blending"""
+        self.embed(picture_hashed)
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 1)
+
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_1, hairstyle_2])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, picture=picture_hashed)
+
+        event = get_event(eventid)
+        self.assertEqual(
+            event.embedding_inference.result.embedded_file_location,
+            embedding_inference_result_valid["embedded_file_location"],
+        )
+        self.assertEqual(event.embedding_inference.result.hairchange_eventid, eventid)
+        self.assertEqual(len(event.blend_inferences), 2)
+
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 1)
+        self.assertEqual(get_queue(BLENDING_QUEUE).depth().visible, 2)
+        self.assertEqual(get_embedding_cache().stats()["hits"], 1)
+
+    def test_other_pictures(self):
+        """Tests that another bbox, another image sent with the same hash or a picture without a content hash is embedded again"""
+        self.embed(picture_hashed)
+        self.embed({**picture_hashed, "bbox": (0, 0, 3, 4)})
+        self.embed({**picture_hashed, "file_location": "someone-elses-photo"})
+        self.embed(picture_valid)
+        self.embed(picture_valid)
+
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 5)
+        self.assertEqual(get_embedding_cache().stats()["hits"], 0)
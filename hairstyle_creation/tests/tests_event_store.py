@@ -0,0 +1,493 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from hairstyle_creation.models import (
+    BlendInferenceResult,
+    HairstyleChangeEvent,
+    Hairstyle,
+    InferenceEvent,
+    create_eventid
+)
+from hairstyle_creation.stores.cache import CachedEventStore
+from hairstyle_creation.stores.file_store import FileEventStore
+from hairstyle_creation.stores.log_store import EventLogStore
+from hairstyle_creation.stores.single_flight import CoalescingEventStore
+from hairstyle_creation.stores.sqlite_store import SQLiteEventStore
+
+from hairstyle_creation.tests.test_presets import (
+    blend_inference_result_valid,
+    embedding_inference_valid,
+    hairstyle_1
+)
+
+from django.test import TestCase
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class EventStoreTestMixin:
+    """Tests every event store has to pass, mixed into one TestCase per backend"""
+
+    def make_store(self, directory: str):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = self.make_store(self.directory)
+        self.event = HairstyleChangeEvent(
+            eventid=create_eventid(),
+            account_identifier=ACCOUNT_IDENTIFIER
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_missing(self):
+        """Tests that a missing event loads as None"""
+        self.assertIsNone(self.store.get(create_eventid()))
+
+    def test_put_get(self):
+        """Tests that a written event can be read back"""
+        self.event.hairstyles = [Hairstyle(**hairstyle_1)]
+        self.store.put(self.event)
+
+        event = self.store.get(self.event.eventid)
+
+        self.assertEqual(event.eventid, self.event.eventid)
+        self.assertEqual(event.hairstyles, [Hairstyle(**hairstyle_1)])
+        self.assertEqual(event.version, 1)
+
+    async def test_aget(self):
+        """Tests that the async read loads the same event without blocking the event loop"""
+        self.store.put(self.event)
+
+        event = await self.store.aget(self.event.eventid)
+
+        self.assertEqual(event, self.store.get(self.event.eventid))
+        self.assertIsNone(await self.store.aget(create_eventid()))
+
+    def test_timestamps_kept(self):
+        """Tests that loading an event keeps its stored timestamps instead of restarting them"""
+        self.event.embedding_inference = InferenceEvent(**embedding_inference_valid)
+        self.store.put(self.event)
+        time.sleep(0.001)
+        
+        event = self.store.get(self.event.eventid)
+        
+        self.assertEqual(event.start_timestamp, self.event.start_timestamp)
+        self.assertEqual(event.event_timeout, self.event.event_timeout)
+        self.assertEqual(event.embedding_inference.start_timestamp, self.event.embedding_inference.start_timestamp)
+
+    def test_compare_and_swap_create(self):
+        """Tests that a version of 0 only creates missing events"""
+        self.assertTrue(self.store.compare_and_swap(self.event, 0))
+        self.assertEqual(self.event.version, 1)
+
+        self.assertFalse(self.store.compare_and_swap(self.event, 0))
+
+    def test_compare_and_swap_conflict(self):
+        """Tests that a stale writer is rejected and does not overwrite the newer event"""
+        self.store.put(self.event)
+
+        first = self.store.get(self.event.eventid)
+        second = self.store.get(self.event.eventid)
+
+        first.errored = True
+        self.assertTrue(self.store.compare_and_swap(first, first.version))
+
+        second.hairstyles = [Hairstyle(**hairstyle_1)]
+        self.assertFalse(self.store.compare_and_swap(second, second.version))
+
+        event = self.store.get(self.event.eventid)
+        self.assertTrue(event.errored)
+        self.assertIsNone(event.hairstyles)
+        self.assertEqual(event.version, 2)
+
+    def test_delete(self):
+        """Tests that an event is only removed at the version it was loaded at"""
+        self.store.put(self.event)
+        self.store.put(self.event)
+
+        self.assertFalse(self.store.delete(self.event.eventid, 1))
+        self.assertIsNotNone(self.store.get(self.event.eventid))
+
+        self.assertTrue(self.store.delete(self.event.eventid, 2))
+        self.assertIsNone(self.store.get(self.event.eventid))
+        self.assertIsNone(self.store.stamp(self.event.eventid))
+        self.assertFalse(self.store.delete(self.event.eventid, 2))
+
+    def test_iter_eventids(self):
+        """Tests that every stored event is listed"""
+        other = HairstyleChangeEvent(eventid=create_eventid(), account_identifier=ACCOUNT_IDENTIFIER)
+        self.store.put(self.event)
+        self.store.put(other)
+
+        self.assertEqual(sorted(self.store.iter_eventids()), sorted([self.event.eventid, other.eventid]))
+
+
+class FileEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return FileEventStore(directory=directory)
+    
+    def test_partitioned(self):
+        """Tests that events are written into the hourly partition from their ID"""
+        self.store.put(self.event)
+        
+        month, day_hour = self.event.eventid.split("-")[:2]
+        path = os.path.join(self.directory, month, day_hour[:2], day_hour[2:], f"{self.event.eventid}.json")
+        
+        self.assertTrue(os.path.exists(path))
+        
+    def test_migrate_flat_layout(self):
+        """Tests that events written by the flat layout are still found, and moved into their partition"""
+        flat_store = FileEventStore(directory=self.directory, sharded=False)
+        flat_store.put(self.event)
+        
+        self.assertEqual(self.store.stamp(self.event.eventid), flat_store.stamp(self.event.eventid))
+        
+        event = self.store.get(self.event.eventid)
+        
+        self.assertEqual(event, self.event)
+        self.assertIsNone(flat_store.get(self.event.eventid))
+        self.assertEqual(self.store.migrate_flat_layout(), 0)
+        
+    def test_drop_partitions(self):
+        """Tests that whole partitions are dropped once their hour is over"""
+        old_event = HairstyleChangeEvent(
+            eventid="202001-0112-0000-" + self.event.eventid.split("-", 3)[3],
+            account_identifier=ACCOUNT_IDENTIFIER
+        )
+        self.store.put(old_event)
+        self.store.put(self.event)
+        
+        self.assertEqual(self.store.drop_partitions(datetime(2020, 1, 1, 12, 30)), 0)
+        self.assertEqual(self.store.drop_partitions(datetime(2020, 1, 1, 13)), 1)
+        
+        self.assertIsNone(self.store.get(old_event.eventid))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "202001")))
+        self.assertIsNotNone(self.store.get(self.event.eventid))
+
+
+class FlatFileEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return FileEventStore(directory=directory, sharded=False)
+
+
+class BinaryFileEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return FileEventStore(directory=directory, codec="binary")
+
+    def test_switch_codec(self):
+        """Tests that events written as JSON are read, and rewritten in the binary format on their next write"""
+        json_store = FileEventStore(directory=self.directory)
+        json_store.put(self.event)
+        json_path = json_store._path(self.event.eventid)
+
+        event = self.store.get(self.event.eventid)
+        self.assertEqual(event, self.event)
+
+        event.errored = True
+        self.assertTrue(self.store.compare_and_swap(event, event.version))
+
+        self.assertFalse(os.path.exists(json_path))
+        self.assertTrue(os.path.exists(self.store._path(self.event.eventid)))
+        self.assertTrue(json_store.get(self.event.eventid).errored)
+
+
+class SQLiteEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return SQLiteEventStore(path=f"{directory}/events.sqlite3")
+
+    def test_put_stale_copy(self):
+        """Tests that a put from an old copy moves the version past the stored one, so newer copies conflict"""
+        stale = self.event.model_copy(deep=True)
+        self.store.put(self.event)
+        self.store.put(self.event)
+        self.store.put(stale)
+
+        self.assertEqual(stale.version, 3)
+        self.assertEqual(self.store.get(self.event.eventid).version, 3)
+        self.assertFalse(self.store.compare_and_swap(self.event, self.event.version))
+
+
+class BinarySQLiteEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return SQLiteEventStore(path=f"{directory}/events.sqlite3", codec="binary")
+
+
+class EventLogStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        return EventLogStore(directory=directory, snapshot_every=4)
+    
+    def add_blends(self, count: int):
+        self.event.hairstyles = []
+        self.event.blend_inferences = []
+        for i in range(count):
+            hairstyle = Hairstyle(**{**hairstyle_1, "hairstyle_id": i})
+            self.event.hairstyles.append(hairstyle)
+            self.event.blend_inferences.append(InferenceEvent(
+                inference_eventid=create_eventid(),
+                type="Blending",
+                hairstyle=hairstyle
+            ))
+        self.store.put(self.event)
+    
+    def test_blend_result_delta(self):
+        """Tests that posting one blend result only logs that blend"""
+        self.add_blends(3)
+        
+        blend_inference = self.event.blend_inferences[1]
+        blend_inference.set_result(BlendInferenceResult(**{
+            **blend_inference_result_valid,
+            "inference_eventid": blend_inference.inference_eventid,
+            "hairchange_eventid": self.event.eventid,
+        }))
+        self.store.put(self.event)
+        
+        record = self.store.history(self.event.eventid)[-1]
+        
+        self.assertEqual(record["version"], self.event.version)
+        self.assertNotIn("set", record)
+        self.assertEqual(list(record["items"]["blend_inferences"]["changed"]), ["1"])
+        
+        event = self.store.get(self.event.eventid)
+        self.assertEqual(event.blend_inferences[1].result, blend_inference.result)
+        self.assertIsNone(event.blend_inferences[0].result)
+        
+    def test_snapshots(self):
+        """Tests that events are rebuilt correctly from snapshots plus the log tail"""
+        self.add_blends(2)
+        for _ in range(6):
+            self.event.errored = not self.event.errored
+            self.store.put(self.event)
+        
+        self.assertTrue(self.store.compact(self.event.eventid))
+        self.assertFalse(self.store.compact(self.event.eventid))
+        
+        # A fresh store has nothing cached, so it has to rebuild from disk
+        event = self.make_store(self.directory).get(self.event.eventid)
+        
+        self.assertEqual(event, self.event)
+        self.assertEqual(len(self.store.history(self.event.eventid)), 7)
+
+    def test_append_after_torn_record(self):
+        """Tests that a record cut off by a crash is dropped before the next one is appended"""
+        self.store.put(self.event)
+        with open(self.store._log_path(self.event.eventid), "ab") as f:
+            f.write(b'{"set":{"errored":tr')
+
+        # Another process, which has not seen the log before
+        store = self.make_store(self.directory)
+        event = store.get(self.event.eventid)
+        event.errored = True
+        store.put(event)
+
+        event = self.make_store(self.directory).get(self.event.eventid)
+        self.assertTrue(event.errored)
+        self.assertEqual(event.version, 2)
+        self.assertEqual([record["version"] for record in store.history(self.event.eventid)], [1, 2])
+
+
+class CachedEventStoreTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backing_store = FileEventStore(directory=self.directory)
+        self.store = CachedEventStore(self.backing_store, max_entries=2, ttl=30.0)
+        
+        self.event = HairstyleChangeEvent(
+            eventid=create_eventid(),
+            account_identifier=ACCOUNT_IDENTIFIER
+        )
+        self.store.put(self.event)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_write_through(self):
+        """Tests that reads after a write are served from the cache"""
+        for _ in range(3):
+            event = self.store.get(self.event.eventid)
+            self.assertEqual(event.version, self.event.version)
+        
+        self.assertEqual(self.store.hits, 3)
+        self.assertEqual(self.store.misses, 0)
+        
+    def test_copies_are_independent(self):
+        """Tests that changing a read event does not change the cached event"""
+        self.event.hairstyles = [Hairstyle(**hairstyle_1)]
+        self.store.put(self.event)
+        
+        event = self.store.get(self.event.eventid)
+        event.hairstyles.clear()
+        event.errored = True
+        
+        event = self.store.get(self.event.eventid)
+        self.assertEqual(event.hairstyles, [Hairstyle(**hairstyle_1)])
+        self.assertFalse(event.errored)
+        
+    def test_other_writer(self):
+        """Tests that a write that bypasses the cache (like one from another process) is picked up"""
+        other = self.backing_store.get(self.event.eventid)
+        other.errored = True
+        self.backing_store.put(other)
+        
+        event = self.store.get(self.event.eventid)
+        
+        self.assertTrue(event.errored)
+        self.assertEqual(self.store.stale, 1)
+        self.assertEqual(self.store.misses, 1)
+        
+    def test_eviction(self):
+        """Tests that the least recently used event is evicted when the cache is full"""
+        for _ in range(2):
+            self.store.put(HairstyleChangeEvent(
+                eventid=create_eventid(),
+                account_identifier=ACCOUNT_IDENTIFIER
+            ))
+        
+        self.assertEqual(self.store.evictions, 1)
+        
+        self.store.get(self.event.eventid)
+        self.assertEqual(self.store.misses, 1)
+        
+    async def test_aget_hit(self):
+        """Tests that async reads are served from the cache and pick up other writers like sync ones"""
+        event = await self.store.aget(self.event.eventid)
+        self.assertEqual(event.version, self.event.version)
+        self.assertEqual(self.store.hits, 1)
+
+        other = self.backing_store.get(self.event.eventid)
+        other.errored = True
+        self.backing_store.put(other)
+
+        self.assertTrue((await self.store.aget(self.event.eventid)).errored)
+        self.assertEqual(self.store.stale, 1)
+
+    def test_ttl(self):
+        """Tests that expired entries are reloaded from the store"""
+        self.store.ttl = 0.0
+        self.store.put(self.event)
+        time.sleep(0.001)
+        
+        self.store.get(self.event.eventid)
+        
+        self.assertEqual(self.store.hits, 0)
+        self.assertEqual(self.store.misses, 1)
+
+
+class GatedFileEventStore(FileEventStore):
+    """Holds every read after loading the event until the test opens the gate, so reads overlap"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.reads = 0
+
+    def get(self, eventid):
+        event = super().get(eventid)
+        self.reads += 1
+        self.gate.wait(5.0)
+        return event
+
+
+class CoalescingEventStoreTest(EventStoreTestMixin, TestCase):
+    def make_store(self, directory: str):
+        self.backing_store = GatedFileEventStore(directory=directory)
+        self.backing_store.gate.set()
+        return CoalescingEventStore(self.backing_store)
+
+    def wait_for_followers(self, followers: int) -> None:
+        deadline = time.monotonic() + 5.0
+        while self.store.coalesced < followers and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def test_concurrent_reads_share_a_load(self):
+        """Tests that reads of an event that overlap load it once and each get their own copy"""
+        self.event.hairstyles = [Hairstyle(**hairstyle_1)]
+        self.store.put(self.event)
+        self.backing_store.gate.clear()
+        self.backing_store.reads = 0
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(self.store.get, self.event.eventid) for _ in range(4)]
+            self.wait_for_followers(3)
+            self.backing_store.gate.set()
+            events = [future.result() for future in futures]
+
+        self.assertEqual(self.backing_store.reads, 1)
+        self.assertEqual(self.store.stats()["coalescing_ratio"], 3 / 4)
+        self.assertEqual(len({id(event) for event in events}), 4)
+
+        events[0].hairstyles.clear()
+        self.assertEqual(events[1].hairstyles, [Hairstyle(**hairstyle_1)])
+
+    async def test_concurrent_async_reads_share_a_load(self):
+        """Tests that async reads wait on the loop for the load they joined"""
+        self.store.put(self.event)
+        self.backing_store.gate.clear()
+        self.backing_store.reads = 0
+
+        reads = [asyncio.ensure_future(self.store.aget(self.event.eventid)) for _ in range(3)]
+        deadline = time.monotonic() + 5.0
+        while self.store.coalesced < 2 and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+        self.backing_store.gate.set()
+        events = await asyncio.gather(*reads)
+
+        self.assertEqual(self.backing_store.reads, 1)
+        self.assertEqual([event.version for event in events], [1] * 3)
+
+    def test_write_ends_sharing(self):
+        """Tests that a read started after a write does not join a load started before it"""
+        self.store.put(self.event)
+        self.backing_store.gate.clear()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            before = pool.submit(self.store.get, self.event.eventid)
+            while self.store.stats()["in_flight"] == 0:
+                time.sleep(0.001)
+
+            self.event.errored = True
+            self.store.put(self.event)
+            after = pool.submit(self.store.get, self.event.eventid)
+            self.backing_store.gate.set()
+
+            self.assertTrue(after.result().errored)
+            before.result()
+
+        self.assertEqual(self.store.coalesced, 0)
+
+    def test_other_process_write_during_load(self):
+        """Tests that a read that sees another process's write does not join a load from before it"""
+        cache = CachedEventStore(self.store, max_entries=2, ttl=30.0)
+        self.backing_store.put(self.event)
+        self.backing_store.gate.clear()
+        self.backing_store.reads = 0
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            before = pool.submit(cache.get, self.event.eventid)
+            while self.backing_store.reads == 0:
+                time.sleep(0.001)
+
+            # Another process, which has its own store over the same directory
+            other = FileEventStore(directory=self.directory).get(self.event.eventid)
+            other.errored = True
+            FileEventStore(directory=self.directory).put(other)
+
+            after = pool.submit(cache.get, self.event.eventid)
+            deadline = time.monotonic() + 5.0
+            while self.backing_store.reads < 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.backing_store.gate.set()
+
+            self.assertFalse(before.result().errored)
+            self.assertTrue(after.result().errored)
+
+        self.assertEqual(self.store.coalesced, 0)
+        self.assertTrue(cache.get(self.event.eventid).errored)
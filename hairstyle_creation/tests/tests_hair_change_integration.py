@@ -35,11 +35,13 @@ from hairstyle_creation.tests.test_presets import (
     hairstyle_2
 )
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 ACCOUNT_IDENTIFIER = "test"
 
 
+# Every test posts the same embedding, so blends posted by earlier tests would be reused
+@override_settings(BLEND_MEMO=None)
 class HairChangeIntergrationTest(TestCase):
     def setUp(self):
         self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
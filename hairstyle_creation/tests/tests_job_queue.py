@@ -0,0 +1,285 @@
+import shutil
+import tempfile
+
+from pydantic import ValidationError
+
+from hairstyle_creation.errors import AlreadyExists
+from hairstyle_creation.models import InferenceJob, after_write, create_eventid, get_event, update_event
+from hairstyle_creation.handlers.aws_queue_handler import (
+    BLENDING_QUEUE,
+    EMBEDDING_QUEUE,
+    get_queue,
+    remove_from_queue,
+    send_jobs
+)
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event,
+    get_results
+)
+from hairstyle_creation.handlers.inference_handler import post_blend_result
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+from hairstyle_creation.queues.local import SQLiteJobQueue
+from hairstyle_creation.queues.sqs import SQSJobQueue
+
+from hairstyle_creation.tests.test_presets import picture_valid, hairstyle_1, hairstyle_2
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SQLiteJobQueueTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.queue = SQLiteJobQueue("jobs", path=f"{self.directory}/queues.sqlite3", visibility_timeout=30.0, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_receive_ack(self):
+        """Tests that messages are received oldest first and are gone once acked"""
+        self.queue.send_batch([("a", "1"), ("b", "2"), ("c", "3")])
+
+        messages = self.queue.receive(max_messages=2)
+        self.assertEqual([message.body for message in messages], ["1", "2"])
+        self.assertEqual([message.body for message in self.queue.receive(max_messages=2)], ["3"])
+        self.assertEqual(self.queue.depth().in_flight, 3)
+
+        self.assertTrue(self.queue.ack(messages[0].receipt))
+        self.assertFalse(self.queue.ack(messages[0].receipt))
+        self.assertEqual(self.queue.depth().in_flight, 2)
+
+        stats = self.queue.stats()
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["send_calls"], 1)
+
+    def test_visibility_timeout(self):
+        """Tests that a message that is not acked in time is received again, and the old receipt goes stale"""
+        self.queue.send("a", "1")
+        first = self.queue.receive()[0]
+        self.assertEqual(self.queue.receive(), [])
+
+        self.clock.now += 31
+        self.assertEqual(self.queue.depth().visible, 1)
+        second = self.queue.receive()[0]
+
+        self.assertEqual(second.message_id, "a")
+        self.assertEqual(second.receive_count, 2)
+        self.assertFalse(self.queue.ack(first.receipt))
+        self.assertTrue(self.queue.ack(second.receipt))
+
+    def test_nack(self):
+        """Tests that a nacked message can be received again after its delay"""
+        self.queue.send("a", "1")
+        message = self.queue.receive()[0]
+
+        self.assertTrue(self.queue.nack(message.receipt, delay=5))
+        self.assertEqual(self.queue.receive(), [])
+
+        self.clock.now += 5
+        self.assertEqual(self.queue.receive()[0].message_id, "a")
+
+    def test_discard(self):
+        """Tests that discarding removes waiting messages but leaves the ones a worker holds"""
+        self.queue.send_batch([("a", "1"), ("b", "2")])
+        self.queue.receive()
+
+        self.assertEqual(self.queue.discard(["a", "b"]), 1)
+        self.assertEqual(self.queue.depth().visible, 0)
+        self.assertEqual(self.queue.depth().in_flight, 1)
+
+    def test_send_again(self):
+        """Tests that sending a message ID that is still queued does not queue it twice"""
+        self.queue.send("a", "1")
+        self.queue.send("a", "1")
+
+        self.assertEqual(len(self.queue.receive(max_messages=10)), 1)
+
+
+class FlakyJobQueue(SQLiteJobQueue):
+    """Fails every other message of the first batch it is sent."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    def _send_batch(self, messages, delay):
+        self.batches.append([message_id for message_id, _ in messages])
+        failed = {message_id: "Throttled" for message_id, _ in messages[::2]} if len(self.batches) == 1 else {}
+        super()._send_batch([message for message in messages if message[0] not in failed], delay)
+        return failed
+
+
+class FakeSQSClient:
+    def __init__(self, fail_ids=()):
+        self.batches = []
+        self.fail_ids = fail_ids
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append(Entries)
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries if entry["Id"] not in self.fail_ids],
+            "Failed": [{"Id": entry["Id"], "Message": "Throttled"} for entry in Entries if entry["Id"] in self.fail_ids],
+        }
+
+    def receive_message(self, **kwargs):
+        entries = self.batches[0][:kwargs["MaxNumberOfMessages"]]
+        return {"Messages": [
+            {
+                "MessageId": f"sqs-{entry['Id']}",
+                "ReceiptHandle": f"receipt-{entry['Id']}",
+                "Body": entry["MessageBody"],
+                "MessageAttributes": entry["MessageAttributes"],
+                "Attributes": {"ApproximateReceiveCount": "1"},
+            }
+            for entry in entries
+        ]}
+
+
+class SQSJobQueueTest(TestCase):
+    def test_send_receive(self):
+        """Tests that batches are split to what SQS takes and message IDs survive the round trip"""
+        queue = SQSJobQueue("https://sqs.example/queue")
+        queue._client = FakeSQSClient()
+
+        queue.send_batch([(f"job-{i}", str(i)) for i in range(25)])
+        self.assertEqual([len(batch) for batch in queue._client.batches], [10, 10, 5])
+
+        messages = queue.receive(max_messages=3)
+        self.assertEqual([message.message_id for message in messages], ["job-0", "job-1", "job-2"])
+        self.assertEqual(messages[0].receipt, "receipt-0")
+
+    def test_partial_failure(self):
+        """Tests that each entry SQS did not take is reported as failed"""
+        queue = SQSJobQueue("https://sqs.example/queue", batch_size=50)
+        queue._client = FakeSQSClient(fail_ids=("1",))
+
+        result = queue.send_batch([(f"job-{i}", str(i)) for i in range(12)])
+
+        self.assertEqual(queue.batch_size, 10)
+        self.assertEqual(result.failed, {"job-1": "Throttled", "job-11": "Throttled"})
+        self.assertEqual(len(result.sent), 10)
+
+
+class PipelineTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(JOB_QUEUES={
+            name: {
+                "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+                "OPTIONS": {"name": name, "path": f"{self.directory}/queues.sqlite3"},
+            }
+            for name in (EMBEDDING_QUEUE, BLENDING_QUEUE)
+        })
+        self.settings_override.enable()
+
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_queue(self, name: str) -> int:
+        queue = get_queue(name)
+        messages = queue.receive(max_messages=10)
+        for message in messages:
+            run_job(InferenceJob.model_validate_json(message.body))
+            queue.ack(message.receipt)
+        return len(messages)
+
+    def test_pipeline(self):
+        """Tests that an event is finished by workers answering the queued jobs"""
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, hairstyles_dict=[hairstyle_1, hairstyle_2])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+
+        self.assertEqual(self.run_queue(BLENDING_QUEUE), 0)
+        self.assertEqual(self.run_queue(EMBEDDING_QUEUE), 1)
+        self.assertEqual(self.run_queue(BLENDING_QUEUE), 2)
+
+        self.assertEqual(len(get_results(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id)), 2)
+        self.assertIsNotNone(get_event(self.event_id).finished_timestamp)
+
+    @override_settings(BLEND_JOBS={"COALESCE": True, "MAX_TARGETS": 2})
+    def test_coalesced_pipeline(self):
+        """Tests that coalesced blending jobs carry up to MAX_TARGETS hairstyles and finish the event"""
+        hairstyle_3 = {**hairstyle_2, "hairstyle_id": 2}
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, hairstyles_dict=[hairstyle_1, hairstyle_2, hairstyle_3])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+        self.run_queue(EMBEDDING_QUEUE)
+
+        jobs = [InferenceJob.model_validate_json(message.body) for message in get_queue(BLENDING_QUEUE).receive(max_messages=10)]
+        self.assertEqual(sorted(len(job.targets) for job in jobs), [1, 2])
+
+        blend_inferences = get_event(self.event_id).blend_inferences
+        self.assertEqual(len({blend_inference.job_id for blend_inference in blend_inferences}), 2)
+
+        for job in jobs:
+            run_job(job)
+        self.assertRaises(AlreadyExists, run_job, jobs[0])
+
+        self.assertEqual(len(get_results(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id)), 3)
+        self.assertIsNotNone(get_event(self.event_id).finished_timestamp)
+
+    def test_empty_job_result(self):
+        """Tests that a coalesced job result without any results is rejected as invalid"""
+        result = {"job_id": create_eventid(), "hairchange_eventid": self.event_id, "results": []}
+
+        self.assertRaises(ValidationError, post_blend_result, result)
+
+        response = self.client.post(f"{reverse('blend_results')}?eventid={self.event_id}", result, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_released_jobs(self):
+        """Tests that the jobs of an expired event are taken off the queue"""
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+
+        remove_from_queue([get_event(self.event_id).embedding_inference])
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 0)
+
+    def test_retry_failed_jobs(self):
+        """Tests that only the jobs that failed are sent again"""
+        jobs = [
+            InferenceJob(inference_eventid=create_eventid(), hairchange_eventid=self.event_id, type="Blending")
+            for _ in range(10)
+        ]
+        ids = [job.inference_eventid for job in jobs]
+
+        with override_settings(JOB_QUEUES={BLENDING_QUEUE: {
+            "BACKEND": "hairstyle_creation.tests.tests_job_queue.FlakyJobQueue",
+            "OPTIONS": {"name": BLENDING_QUEUE, "path": f"{self.directory}/flaky.sqlite3", "batch_size": 4},
+        }}):
+            send_jobs(BLENDING_QUEUE, jobs)
+            queue = get_queue(BLENDING_QUEUE)
+
+            # Jobs 0 and 2 failed in the first batch, and only they are sent again
+            self.assertEqual(queue.batches, [ids[0:4], ids[4:8], ids[8:10], [ids[0], ids[2]]])
+            self.assertEqual(sorted(message.message_id for message in queue.receive(max_messages=20)), sorted(ids))
+
+    def test_after_write(self):
+        """Tests that side effects of a change only run once it is written"""
+        ran = []
+
+        def fail(event):
+            after_write(lambda: ran.append("failed"))
+            raise KeyError("Not written")
+
+        self.assertRaises(KeyError, update_event, self.event_id, fail)
+        self.assertEqual(ran, [])
+
+        def succeed(event):
+            after_write(lambda: ran.append(event.version))
+
+        update_event(self.event_id, succeed)
+        self.assertEqual(ran, [2])
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from hairstyle_creation.errors import LeaseSuperseded
+from hairstyle_creation.models import get_event
+from hairstyle_creation.handlers.aws_queue_handler import EMBEDDING_QUEUE
+from hairstyle_creation.handlers.client_event_handler import add_uploaded_picture, create_new_hairstyle_event
+from hairstyle_creation.handlers.lease_handler import (
+    LeaseReaper,
+    acquire_lease,
+    get_lease_index,
+    renew_lease
+)
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import picture_valid
+
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class LeaseTest(PipelineTestCase):
+    def pipeline_settings(self):
+        return {
+            **super().pipeline_settings(),
+            "JOB_LEASES": {"DURATION": 30.0},
+            "JOB_RETRIES": {"BASE_DELAY": 0.0},
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+
+    def test_acquire(self):
+        """Tests that a job can only be leased by one worker at a time"""
+        job = self.take(EMBEDDING_QUEUE)[0]
+        lease = acquire_lease(job)
+
+        self.assertIsNotNone(lease)
+        self.assertEqual(get_event(self.event_id).embedding_inference.lease_id, lease.lease_id)
+        self.assertIsNone(acquire_lease(job))
+
+        run_job(job, lease_id=lease.lease_id)
+        self.assertIsNone(get_lease_index().deadline(lease.lease_id))
+        self.assertIsNone(acquire_lease(job))
+
+    def test_heartbeat(self):
+        """Tests that a renewed lease is not reaped"""
+        lease = acquire_lease(self.take(EMBEDDING_QUEUE)[0])
+        later = datetime.now() + timedelta(seconds=20)
+
+        self.assertEqual(renew_lease(lease.lease_id, now=later), later + timedelta(seconds=30))
+        self.assertEqual(LeaseReaper(clock=lambda: later + timedelta(seconds=1)).sweep(), 0)
+        self.assertEqual(get_event(self.event_id).embedding_inference.lease_id, lease.lease_id)
+
+    def test_lapsed_lease(self):
+        """Tests that the job of a lapsed lease is queued again and late results of that lease are discarded"""
+        job = self.take(EMBEDDING_QUEUE)[0]
+        lease = acquire_lease(job)
+
+        reaper = LeaseReaper(clock=lambda: datetime.now() + timedelta(seconds=31))
+        self.assertEqual(reaper.sweep(), 1)
+        self.assertIsNone(renew_lease(lease.lease_id))
+
+        retried = self.take(EMBEDDING_QUEUE)
+        self.assertEqual([retried_job.attempt for retried_job in retried], [2])
+        # The message of the first attempt, redelivered, is dropped
+        self.assertIsNone(acquire_lease(job))
+
+        self.assertRaises(LeaseSuperseded, run_job, job, lease.lease_id)
+        self.assertIsNone(get_event(self.event_id).embedding_inference.result)
+
+        new_lease = acquire_lease(retried[0])
+        run_job(retried[0], lease_id=new_lease.lease_id)
+        self.assertEqual(get_event(self.event_id).embedding_inference.result.lease_id, new_lease.lease_id)
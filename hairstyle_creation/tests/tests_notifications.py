@@ -0,0 +1,95 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE
+from hairstyle_creation.handlers.cancel_handler import cancel_event
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event,
+    wait_for_results
+)
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import hairstyle_1, hairstyle_2, picture_valid
+
+from django.urls import reverse
+
+# The client views act for this account
+ACCOUNT_IDENTIFIER = ""
+
+
+class ResultNotificationTest(PipelineTestCase):
+    def pipeline_settings(self):
+        return {
+            **super().pipeline_settings(),
+            # Long enough that only a notification ends a wait within the test
+            "RESULT_NOTIFICATIONS": {"MAX_WAIT": 60.0, "RECHECK_INTERVAL": 60.0},
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, hairstyles_dict=[hairstyle_1])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+        run_job(self.take(EMBEDDING_QUEUE, 1)[0])
+
+    async def test_woken_by_result(self):
+        """Tests that a waiting request returns the results as soon as the last blend is posted"""
+        job = (await sync_to_async(self.take)(BLENDING_QUEUE, 1))[0]
+        waiting = asyncio.create_task(wait_for_results(ACCOUNT_IDENTIFIER, self.event_id))
+
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiting.done())
+        await sync_to_async(run_job)(job)
+
+        status, results, _ = await asyncio.wait_for(waiting, 5.0)
+        self.assertEqual(status, "finished")
+        self.assertEqual(len(results), 1)
+
+    async def test_timeout(self):
+        """Tests that a wait ends with the current status once its timeout passes"""
+        status, results, _ = await wait_for_results(ACCOUNT_IDENTIFIER, self.event_id, timeout=0.05)
+
+        self.assertEqual(status, "blending")
+        self.assertEqual(results, [])
+
+    async def test_stream(self):
+        """Tests that the stream sends every status change and ends once the event is cancelled"""
+        response = await self.async_client.get(f"{reverse('rendering_stream')}?eventid={self.event_id}")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        stream = aiter(response.streaming_content)
+        self.assertIn(b'"blending"', await anext(stream))
+
+        await sync_to_async(cancel_event)(self.event_id)
+        self.assertIn(b'"cancelled"', await asyncio.wait_for(anext(stream), 5.0))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    async def test_stream_status_only_on_change(self):
+        """Tests that results that do not change the status are streamed without a status event"""
+        def start_event() -> str:
+            eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+            add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_1, hairstyle_2])
+            add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, picture=picture_valid)
+            run_job(self.take(EMBEDDING_QUEUE, 1)[0])
+            return eventid
+
+        eventid = await sync_to_async(start_event)()
+        # The blending jobs of the event in setUp were queued first
+        await sync_to_async(self.take)(BLENDING_QUEUE, 1)
+        first = (await sync_to_async(self.take)(BLENDING_QUEUE, 1))[0]
+
+        response = await self.async_client.get(f"{reverse('rendering_stream')}?eventid={eventid}")
+        stream = aiter(response.streaming_content)
+        self.assertIn(b"event: status", await anext(stream))
+
+        await sync_to_async(run_job)(first)
+        chunk = await asyncio.wait_for(anext(stream), 5.0)
+        self.assertIn(b"event: results", chunk)
+        self.assertNotIn(b"event: status", chunk)
+
+        await sync_to_async(cancel_event)(eventid)
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+from hairstyle_creation.models import update_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event,
+    get_new_results,
+    get_results
+)
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import hairstyle_1, hairstyle_2, picture_valid
+
+from django.urls import reverse
+
+# The client views act for this account
+ACCOUNT_IDENTIFIER = ""
+
+
+class PartialResultsTest(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, hairstyles_dict=[hairstyle_1, hairstyle_2])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+        run_job(self.take(EMBEDDING_QUEUE)[0])
+
+    def test_only_new_results(self):
+        """Tests that every call returns only the blends finished since the cursor of the one before"""
+        first, second = self.take(BLENDING_QUEUE)
+
+        status, results, cursor = get_new_results(ACCOUNT_IDENTIFIER, self.event_id)
+        self.assertEqual((status, results), ("blending", []))
+
+        run_job(first)
+        status, results, cursor = get_new_results(ACCOUNT_IDENTIFIER, self.event_id, cursor)
+        self.assertEqual(status, "blending")
+        self.assertEqual([result.inference_eventid for result in results], [first.inference_eventid])
+        # Still nothing for the client that waits for every blend
+        self.assertIsNone(get_results(ACCOUNT_IDENTIFIER, self.event_id))
+
+        run_job(second)
+        status, results, cursor = get_new_results(ACCOUNT_IDENTIFIER, self.event_id, cursor)
+        self.assertEqual(status, "finished")
+        self.assertEqual([result.inference_eventid for result in results], [second.inference_eventid])
+
+        self.assertEqual(get_new_results(ACCOUNT_IDENTIFIER, self.event_id, cursor)[1], [])
+        self.assertEqual(len(get_new_results(ACCOUNT_IDENTIFIER, self.event_id)[1]), 2)
+
+    def test_past_timeout(self):
+        """Tests that the blends finished before the event timed out are still returned, finished or not"""
+        first, second = self.take(BLENDING_QUEUE)
+        run_job(first)
+
+        update_event(self.event_id, lambda event: setattr(event, "event_timeout", datetime.now() - timedelta(seconds=1)))
+        status, results, _ = get_new_results(ACCOUNT_IDENTIFIER, self.event_id)
+        self.assertEqual(status, "errored")
+        self.assertEqual([result.inference_eventid for result in results], [first.inference_eventid])
+
+        # A finished one is not expired at all
+        event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=event_id, hairstyles_dict=[hairstyle_1])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=event_id, picture=picture_valid)
+        run_job(self.take(EMBEDDING_QUEUE)[0])
+        run_job(self.take(BLENDING_QUEUE)[0])
+
+        update_event(event_id, lambda event: setattr(event, "event_timeout", datetime.now() - timedelta(seconds=1)))
+        status, results, _ = get_new_results(ACCOUNT_IDENTIFIER, event_id)
+        self.assertEqual((status, len(results)), ("finished", 1))
+
+    def test_view(self):
+        """Tests that the view hands out the cursor of the next call"""
+        run_job(self.take(BLENDING_QUEUE)[0])
+        url = reverse("rendering_new_results")
+
+        body = self.client.get(f"{url}?eventid={self.event_id}").json()
+        self.assertEqual(len(body["results"]), 1)
+
+        body = self.client.get(f"{url}?eventid={self.event_id}&cursor={body['next_cursor']}").json()
+        self.assertEqual(body["results"], [])
+        self.assertEqual(self.client.get(f"{url}?eventid={self.event_id}&cursor=x").status_code, 400)
@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta
+import io
+
+from hairstyle_creation.errors import EventCancelled
+from hairstyle_creation.models import get_event, update_event
+from hairstyle_creation.handlers.aws_queue_handler import (
+    BLENDING_QUEUE,
+    EMBEDDING_QUEUE,
+    get_dead_letters,
+    get_queue,
+    get_scheduler,
+    replay_dead_letter,
+    retry_delay
+)
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event
+)
+from hairstyle_creation.handlers.inference_handler import post_blend_result, post_embed_result
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_result_valid,
+    hairstyle_1,
+    hairstyle_2,
+    picture_valid
+)
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class RetryDelayTest(SimpleTestCase):
+    def test_backoff(self):
+        """Tests that the delay is jittered up to a cap that doubles with every retry"""
+        for attempt, cap in ((2, 2.0), (3, 4.0), (5, 16.0), (20, 300.0)):
+            delays = [retry_delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= cap for delay in delays))
+            self.assertGreater(max(delays) - min(delays), cap / 4)
+
+
+class RetryTest(PipelineTestCase):
+    queue_options = {"visibility_timeout": 0.0}
+
+    def pipeline_settings(self):
+        return {
+            **super().pipeline_settings(),
+            "JOB_RETRIES": {"ATTEMPTS": 2, "BASE_DELAY": 0.0},
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, hairstyles_dict=[hairstyle_1, hairstyle_2])
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=self.event_id, picture=picture_valid)
+
+    def post_embedding(self, errored: bool) -> None:
+        post_embed_result({
+            **embedding_inference_result_valid,
+            "inference_eventid": get_event(self.event_id).embedding_inference.inference_eventid,
+            "hairchange_eventid": self.event_id,
+            "errored": errored,
+        })
+
+    def test_errored_embedding(self):
+        """Tests that an errored embedding is queued again and the event goes on once it succeeds"""
+        self.take(EMBEDDING_QUEUE)
+        self.post_embedding(errored=True)
+
+        event = get_event(self.event_id)
+        self.assertIsNone(event.embedding_inference.result)
+        self.assertEqual(event.embedding_inference.attempts, 2)
+
+        retried = self.take(EMBEDDING_QUEUE)
+        self.assertEqual(len(retried), 1)
+        self.assertEqual(retried[0].attempt, 2)
+
+        self.post_embedding(errored=False)
+        self.assertEqual(len(self.take(BLENDING_QUEUE)), 2)
+
+    def test_dead_letter(self):
+        """Tests that a job out of attempts goes to the dead letters and can be replayed from there"""
+        for _ in range(2):
+            self.take(EMBEDDING_QUEUE)
+            self.post_embedding(errored=True)
+
+        event = get_event(self.event_id)
+        self.assertTrue(event.errored)
+        self.assertTrue(event.embedding_inference.result.errored)
+
+        letters = get_dead_letters().list()
+        self.assertEqual(len(letters), 1)
+        self.assertEqual(letters[0].queue, EMBEDDING_QUEUE)
+        self.assertEqual(letters[0].attempts, 2)
+
+        out = io.StringIO()
+        call_command("dead_letters", "--replay", stdout=out)
+        self.assertIn("Replayed 1 jobs", out.getvalue())
+        self.assertEqual(len(get_dead_letters()), 0)
+
+        event = get_event(self.event_id)
+        self.assertFalse(event.errored)
+        self.assertIsNone(event.embedding_inference.result)
+
+        replayed = self.take(EMBEDDING_QUEUE)
+        self.assertEqual(len(replayed), 1)
+        run_job(replayed[0])
+        for job in self.take(BLENDING_QUEUE):
+            run_job(job)
+        self.assertIsNotNone(get_event(self.event_id).finished_timestamp)
+
+    def test_replay_next_attempt(self):
+        """Tests that a replayed job is queued as a new attempt, and gets the whole budget again"""
+        for _ in range(2):
+            self.take(EMBEDDING_QUEUE)
+            self.post_embedding(errored=True)
+        replay_dead_letter(get_dead_letters().list()[0].message_id)
+
+        replayed = self.take(EMBEDDING_QUEUE)[0]
+        self.assertEqual(replayed.attempt, 3)
+        self.assertEqual(get_event(self.event_id).embedding_inference.uncounted_attempts, 2)
+
+        # The first failure after the replay is retried, the second is not
+        self.post_embedding(errored=True)
+        self.assertEqual(self.take(EMBEDDING_QUEUE)[0].attempt, 4)
+        self.post_embedding(errored=True)
+        self.assertEqual(self.take(EMBEDDING_QUEUE), [])
+        self.assertEqual(get_dead_letters().list()[0].attempts, 4)
+
+    def test_replay_cancelled(self):
+        """Tests that the jobs of an event the user gave up on are not replayed"""
+        for _ in range(2):
+            self.take(EMBEDDING_QUEUE)
+            self.post_embedding(errored=True)
+        message_id = get_dead_letters().list()[0].message_id
+
+        update_event(self.event_id, lambda event: setattr(event, "cancelled_timestamp", datetime.now()))
+        self.assertRaises(EventCancelled, replay_dead_letter, message_id)
+
+        update_event(self.event_id, lambda event: setattr(event, "cancelled_timestamp", None))
+        update_event(self.event_id, lambda event: setattr(event, "event_timeout", datetime.now() - timedelta(seconds=1)))
+        self.assertRaises(TimeoutError, replay_dead_letter, message_id)
+
+        self.assertTrue(get_event(self.event_id).errored)
+        self.assertEqual(len(get_dead_letters()), 1)
+        self.assertEqual(self.take(EMBEDDING_QUEUE), [])
+
+    @override_settings(BLEND_JOBS={"COALESCE": True, "MAX_TARGETS": 8})
+    def test_errored_blend(self):
+        """Tests that only the errored blends of a coalesced job are queued again"""
+        self.post_embedding(errored=False)
+        job = self.take(BLENDING_QUEUE)[0]
+
+        post_blend_result({
+            "job_id": job.inference_eventid,
+            "hairchange_eventid": self.event_id,
+            "results": [
+                {
+                    "inference_eventid": target.inference_eventid,
+                    "hairchange_eventid": self.event_id,
+                    "result_img_location": f"{target.inference_eventid}.jpg",
+                    "errored": index == 1,
+                }
+                for index, target in enumerate(job.targets)
+            ],
+        })
+
+        retried = self.take(BLENDING_QUEUE)
+        self.assertEqual(len(retried), 1)
+        self.assertEqual([target.inference_eventid for target in retried[0].targets], [job.targets[1].inference_eventid])
+        self.assertIsNone(get_event(self.event_id).finished_timestamp)
+
+        run_job(retried[0])
+        self.assertIsNotNone(get_event(self.event_id).finished_timestamp)
+
+    def test_unanswered_job(self):
+        """Tests that a job received more often than the attempt budget without an answer goes to the dead letters"""
+        scheduler = get_scheduler()
+
+        # Never acked, so it is received again once the visibility timeout runs out
+        self.assertIsNotNone(scheduler.next_job())
+        self.assertIsNotNone(scheduler.next_job())
+        self.assertIsNone(scheduler.next_job())
+
+        self.assertEqual(len(get_dead_letters()), 1)
+        self.assertTrue(get_event(self.event_id).errored)
+        self.assertEqual(get_queue(EMBEDDING_QUEUE).depth().visible, 0)
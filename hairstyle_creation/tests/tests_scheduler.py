@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+import io
+import shutil
+import tempfile
+
+from hairstyle_creation.models import BlendTarget, Hairstyle, InferenceJob, create_eventid, get_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event
+)
+from hairstyle_creation.queues.local import SQLiteJobQueue
+from hairstyle_creation.queues.scheduler import JobScheduler
+
+from hairstyle_creation.tests.test_presets import hairstyle_1, hairstyle_2, picture_valid
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+NOW = datetime(2024, 1, 1, 12)
+
+
+def make_job(account_identifier: str, type: str = "Blending", targets: int = 0, waited: float = 0.0) -> InferenceJob:
+    return InferenceJob(
+        inference_eventid=create_eventid(),
+        hairchange_eventid=create_eventid(),
+        type=type,
+        account_identifier=account_identifier,
+        queue_timestamp=NOW - timedelta(seconds=waited),
+        targets=[
+            BlendTarget(inference_eventid=create_eventid(), hairstyle=Hairstyle(**hairstyle_1))
+            for _ in range(targets)
+        ] or None,
+    )
+
+
+class JobSchedulerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.embedding = SQLiteJobQueue(EMBEDDING_QUEUE, path=f"{self.directory}/queues.sqlite3")
+        self.blending = SQLiteJobQueue(BLENDING_QUEUE, path=f"{self.directory}/queues.sqlite3")
+        self.scheduler = JobScheduler(
+            [(EMBEDDING_QUEUE, self.embedding), (BLENDING_QUEUE, self.blending)],
+            clock=lambda: NOW,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def send(self, queue: SQLiteJobQueue, jobs: list[InferenceJob]) -> None:
+        queue.send_batch([(job.inference_eventid, job.model_dump_json()) for job in jobs])
+
+    def drain(self) -> list[str]:
+        accounts = []
+        while (scheduled := self.scheduler.next_job()) is not None:
+            accounts.append(scheduled.job.account_identifier)
+            self.scheduler.ack(scheduled)
+        return accounts
+
+    def test_priority(self):
+        """Tests that embedding jobs go out before blending jobs queued earlier"""
+        self.send(self.blending, [make_job("a")])
+        self.send(self.embedding, [make_job("b", type="Embedding")])
+
+        first = self.scheduler.next_job()
+        self.assertEqual(first.priority_class, EMBEDDING_QUEUE)
+        self.assertEqual(self.scheduler.next_job().priority_class, BLENDING_QUEUE)
+        self.assertIsNone(self.scheduler.next_job())
+
+    def test_fair_share(self):
+        """Tests that an account with many jobs takes turns with the accounts queued after it"""
+        self.send(self.blending, [make_job("heavy") for _ in range(30)])
+        self.send(self.blending, [make_job("light") for _ in range(2)])
+
+        accounts = self.drain()
+
+        self.assertEqual(len(accounts), 32)
+        self.assertEqual(accounts[:4], ["heavy", "light", "heavy", "light"])
+
+    def test_coalesced_cost(self):
+        """Tests that a coalesced job costs one turn per blend it carries"""
+        self.send(self.blending, [make_job("coalesced", targets=4)])
+        self.send(self.blending, [make_job("single") for _ in range(4)])
+
+        self.assertEqual(self.drain(), ["single", "single", "single", "coalesced", "single"])
+
+    def test_wait_percentiles(self):
+        """Tests that queue waits are reported per class"""
+        self.send(self.blending, [make_job("a", waited=seconds) for seconds in range(1, 11)])
+        self.send(self.embedding, [make_job("a", type="Embedding", waited=0.5)])
+        self.drain()
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats[EMBEDDING_QUEUE]["dispatched"], 1)
+        self.assertEqual(stats[EMBEDDING_QUEUE]["wait_p99"], 0.5)
+        self.assertEqual(stats[BLENDING_QUEUE]["wait_p50"], 6.0)
+        self.assertEqual(stats[BLENDING_QUEUE]["wait_p99"], 10.0)
+
+
+class StubWorkerTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            BLEND_MEMO=None,
+            JOB_QUEUES={
+                name: {
+                    "BACKEND": "hairstyle_creation.queues.local.SQLiteJobQueue",
+                    "OPTIONS": {"name": name, "path": f"{self.directory}/queues.sqlite3"},
+                }
+                for name in (EMBEDDING_QUEUE, BLENDING_QUEUE)
+            },
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_run_stub_worker(self):
+        """Tests that the stub worker finishes events through the scheduler"""
+        eventids = []
+        for account_identifier in ("a", "b"):
+            eventid = create_new_hairstyle_event(account_identifier=account_identifier)
+            add_hairstyles(account_identifier=account_identifier, eventid=eventid, hairstyles_dict=[hairstyle_1, hairstyle_2])
+            add_uploaded_picture(account_identifier=account_identifier, eventid=eventid, picture=picture_valid)
+            eventids.append(eventid)
+
+        out = io.StringIO()
+        call_command("run_stub_worker", "--once", "--wait", "0", stdout=out)
+
+        self.assertIn("Answered 6 jobs", out.getvalue())
+        for eventid in eventids:
+            self.assertIsNotNone(get_event(eventid).finished_timestamp)
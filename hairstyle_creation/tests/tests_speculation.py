@@ -0,0 +1,139 @@
+
+from hairstyle_creation.models import Hairstyle, get_event
+from hairstyle_creation.handlers.aws_queue_handler import BLENDING_QUEUE, EMBEDDING_QUEUE, SPECULATIVE_QUEUE, get_queue
+from hairstyle_creation.handlers.client_event_handler import (
+    add_hairstyles,
+    add_uploaded_picture,
+    create_new_hairstyle_event
+)
+from hairstyle_creation.handlers.inference_handler import get_preset_popularity, post_blend_result, post_embed_result
+from hairstyle_creation.handlers.lease_handler import acquire_lease
+from hairstyle_creation.management.commands.run_stub_worker import run_job
+
+from hairstyle_creation.tests.test_pipeline import PipelineTestCase
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_result_valid,
+    hairstyle_1,
+    hairstyle_2,
+    picture_valid
+)
+
+from django.test import override_settings
+
+
+ACCOUNT_IDENTIFIER = "test"
+
+hairstyle_3 = {**hairstyle_2, "hairstyle_id": 2}
+
+
+class SpeculativeBlendingTest(PipelineTestCase):
+    queues = (EMBEDDING_QUEUE, BLENDING_QUEUE, SPECULATIVE_QUEUE)
+
+    def pipeline_settings(self):
+        return {
+            **super().pipeline_settings(),
+            "SPECULATIVE_BLENDING": {"ENABLED": True, "PATH": f"{self.directory}/presets.sqlite3", "TOP_N": 2},
+        }
+
+    def setUp(self):
+        super().setUp()
+        # hairstyle_1 was picked most, then hairstyle_2, and hairstyle_3 never
+        popularity = get_preset_popularity()
+        popularity.record([Hairstyle(**hairstyle_1), Hairstyle(**hairstyle_2)])
+        popularity.record([Hairstyle(**hairstyle_1)])
+
+    def embed(self) -> str:
+        eventid = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+        add_uploaded_picture(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, picture=picture_valid)
+        self.take(EMBEDDING_QUEUE)
+
+        post_embed_result({
+            **embedding_inference_result_valid,
+            "inference_eventid": get_event(eventid).embedding_inference.inference_eventid,
+            "hairchange_eventid": eventid,
+        })
+        return eventid
+
+    def test_top_presets(self):
+        """Tests that the most picked presets are counted and returned most picked first"""
+        self.assertEqual(
+            [hairstyle.hairstyle_id for hairstyle in get_preset_popularity().top(3)],
+            [hairstyle_1["hairstyle_id"], hairstyle_2["hairstyle_id"]],
+        )
+
+    def test_pick_takes_over_speculative_blends(self):
+        """Tests that a pick reuses finished speculative blends, adopts queued ones and cancels the others"""
+        eventid = self.embed()
+        self.assertEqual(get_queue(SPECULATIVE_QUEUE).depth().visible, 2)
+
+        jobs = {job.hairstyle.hairstyle_id: job for job in self.take(SPECULATIVE_QUEUE)}
+        run_job(jobs[hairstyle_1["hairstyle_id"]])
+
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_3, hairstyle_1])
+
+        event = get_event(eventid)
+        self.assertEqual([blend.hairstyle.hairstyle_id for blend in event.blend_inferences], [2, 0])
+        self.assertIsNotNone(event.blend_inferences[1].result)
+        self.assertEqual(len(event.speculative_inferences), 1)
+
+        # Only the blend that was not speculated is queued
+        blending = self.take(BLENDING_QUEUE)
+        self.assertEqual([job.hairstyle.hairstyle_id for job in blending], [hairstyle_3["hairstyle_id"]])
+
+        run_job(blending[0])
+        self.assertIsNotNone(get_event(eventid).finished_timestamp)
+
+    def test_adopt_queued_blend(self):
+        """Tests that a speculative blend still queued when it is picked is moved to the blending queue"""
+        eventid = self.embed()
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_2])
+
+        # The speculative blend of hairstyle_1 was cancelled and the one of hairstyle_2 promoted
+        self.assertEqual(get_queue(SPECULATIVE_QUEUE).depth().visible, 0)
+        jobs = self.take(BLENDING_QUEUE)
+        self.assertEqual([job.hairstyle.hairstyle_id for job in jobs], [hairstyle_2["hairstyle_id"]])
+
+        blend = get_event(eventid).blend_inferences[0]
+        self.assertFalse(blend.speculative)
+        self.assertEqual(jobs[0].inference_eventid, blend.inference_eventid)
+
+        run_job(jobs[0])
+        self.assertIsNotNone(get_event(eventid).finished_timestamp)
+
+    @override_settings(JOB_RETRIES={"ATTEMPTS": 2, "BASE_DELAY": 0.0})
+    def test_promoted_blend_retry_budget(self):
+        """Tests that a promoted blend gets as many retries as one the user picked before it was speculated"""
+        eventid = self.embed()
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_2])
+        job = self.take(BLENDING_QUEUE)[0]
+
+        post_blend_result({
+            "inference_eventid": job.inference_eventid,
+            "hairchange_eventid": eventid,
+            "result_img_location": "",
+            "errored": True,
+        })
+
+        retried = self.take(BLENDING_QUEUE)
+        self.assertEqual([retried_job.attempt for retried_job in retried], [job.attempt + 1])
+        self.assertIsNone(get_event(eventid).blend_inferences[0].result)
+
+    def test_running_blend_not_promoted(self):
+        """Tests that a picked speculative blend a worker already leased keeps running where it is"""
+        eventid = self.embed()
+        jobs = {job.hairstyle.hairstyle_id: job for job in self.take(SPECULATIVE_QUEUE)}
+        lease = acquire_lease(jobs[hairstyle_2["hairstyle_id"]])
+
+        add_hairstyles(account_identifier=ACCOUNT_IDENTIFIER, eventid=eventid, hairstyles_dict=[hairstyle_2])
+
+        self.assertEqual(get_queue(BLENDING_QUEUE).depth().visible, 0)
+        run_job(jobs[hairstyle_2["hairstyle_id"]], lease_id=lease.lease_id)
+        self.assertIsNotNone(get_event(eventid).finished_timestamp)
+
+    def test_no_speculation_under_load(self):
+        """Tests that nothing is speculated while real work is waiting"""
+        get_queue(BLENDING_QUEUE).send("waiting", "{}")
+        eventid = self.embed()
+
+        self.assertIsNone(get_event(eventid).speculative_inferences)
+        self.assertEqual(get_queue(SPECULATIVE_QUEUE).depth().visible, 0)
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+
+from hairstyle_creation.models import (
+    EVENT_TIMEOUT,
+    InferenceEvent,
+    UploadPicture,
+    create_eventid,
+    get_event,
+    get_store,
+    write_data
+)
+from hairstyle_creation.handlers.client_event_handler import create_new_hairstyle_event
+from hairstyle_creation.handlers.timeout_handler import TimeoutSweeper, get_deadline_index
+
+from hairstyle_creation.tests.test_presets import (
+    embedding_inference_valid,
+    picture_valid
+)
+
+from django.test import TestCase, override_settings
+
+ACCOUNT_IDENTIFIER = "test"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime.now()
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+class TimeoutSweeperTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EVENT_STORE={
+                "BACKEND": "hairstyle_creation.stores.file_store.FileEventStore",
+                "OPTIONS": {"directory": self.directory},
+            },
+            DEADLINE_INDEX_PATH=f"{self.directory}/deadlines.sqlite3",
+        )
+        self.settings_override.enable()
+
+        self.clock = FakeClock()
+        self.sweeper = TimeoutSweeper(index=get_deadline_index(), clock=self.clock)
+
+        self.event_id = create_new_hairstyle_event(account_identifier=ACCOUNT_IDENTIFIER)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+        event.uploaded_picture = UploadPicture(**picture_valid)
+        event.embedding_inference = InferenceEvent(**embedding_inference_valid)
+        write_data(event)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_sweep_before_timeout(self):
+        """Tests that events are left alone until their timeout passes"""
+        self.clock.now += EVENT_TIMEOUT - timedelta(minutes=1)
+
+        self.assertEqual(self.sweeper.sweep(), 0)
+        self.assertEqual(len(self.sweeper.index), 1)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+        self.assertFalse(event.errored)
+
+    def test_sweep_after_timeout(self):
+        """Tests that a timed out event is marked errored and removed from the index"""
+        self.clock.now += EVENT_TIMEOUT + timedelta(minutes=1)
+
+        self.assertEqual(self.sweeper.sweep(), 1)
+        self.assertEqual(len(self.sweeper.index), 0)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER, check_timeout=False)
+        self.assertTrue(event.errored)
+
+        # Sweeping again has nothing left to do
+        self.assertEqual(self.sweeper.sweep(), 0)
+
+    def test_sweep_finished_event(self):
+        """Tests that finished events are dropped from the index without being expired"""
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+        event.finished_timestamp = datetime.now()
+        write_data(event)
+
+        self.clock.now += EVENT_TIMEOUT + timedelta(minutes=1)
+
+        self.assertEqual(self.sweeper.sweep(), 0)
+        self.assertEqual(len(self.sweeper.index), 0)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER, check_timeout=False)
+        self.assertFalse(event.errored)
+
+    def test_get_timed_out_event(self):
+        """Tests that reading a timed out event expires it"""
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER)
+        event.event_timeout = datetime.now() - timedelta(seconds=1)
+        write_data(event)
+
+        self.assertRaises(TimeoutError, get_event, self.event_id, ACCOUNT_IDENTIFIER)
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER, check_timeout=False)
+        self.assertTrue(event.errored)
+
+    def test_sweep_past_failing_event(self):
+        """Tests that an event that can not be expired is kept for the next sweep without holding up the others"""
+        corrupt_id = create_eventid()
+        with open(get_store()._path(corrupt_id), "w") as file:
+            file.write("{")
+        self.sweeper.index.schedule(corrupt_id, datetime.now())
+
+        self.clock.now += EVENT_TIMEOUT + timedelta(minutes=1)
+        # One event per batch, so the failing event is the whole first batch
+        self.sweeper.batch_size = 1
+
+        self.assertEqual(self.sweeper.sweep(), 1)
+        self.assertEqual(len(self.sweeper.index), 1)
+        self.assertEqual(self.sweeper.index.due(self.clock.now), [])
+
+        # It is tried again once the retry delay has passed
+        self.clock.now += timedelta(seconds=self.sweeper.retry_delay)
+        self.assertEqual([eventid for eventid, _ in self.sweeper.index.due(self.clock.now)], [corrupt_id])
+
+        event = get_event(self.event_id, account_identifier=ACCOUNT_IDENTIFIER, check_timeout=False)
+        self.assertTrue(event.errored)
@@ -1,14 +1,24 @@
 from django.urls import path
 
-from .views import client_views, inference_views
+from .views import client_views, inference_views, metrics_views
 
 urlpatterns = [
     path("start/", client_views.start_creation, name="start_creation"),
     path("hairstyle_presets/", client_views.get_hairstyles_presets, name="hairstyles_presets"),
-    path("upload_photo/", client_views.add_uploaded_picture, name="upload_photo"),
+    path("upload_photo/", client_views.add_uploaded_picture_request, name="upload_photo"),
     path("rendering/start/", client_views.start_rendering, name="rendering_start"),
     path("rendering/results/", client_views.get_rendering_results, name="rendering_results"),
+    path("rendering/results/new/", client_views.get_new_rendering_results, name="rendering_new_results"),
+    path("rendering/cancel/", client_views.cancel_rendering, name="rendering_cancel"),
+    path("rendering/wait/", client_views.wait_rendering_results, name="rendering_wait"),
+    path("rendering/stream/", client_views.stream_rendering_results, name="rendering_stream"),
+    path("history/", client_views.get_event_history, name="history"),
     
-    path("aws_results_post/embedding/", inference_views.post_embed_result, name="embed_results"),
-    path("aws_results_post/blending/", inference_views.post_blend_result, name="blend_results"),
+    path("aws_results_post/embedding/", inference_views.embedding_results_request, name="embed_results"),
+    path("aws_results_post/blending/", inference_views.blend_results_request, name="blend_results"),
+    path("aws_results_post/bulk/", inference_views.bulk_results_request, name="bulk_results"),
+    path("aws_jobs/lease/", inference_views.lease_request, name="job_lease"),
+    path("aws_jobs/heartbeat/", inference_views.heartbeat_request, name="job_heartbeat"),
+    
+    path("metrics/", metrics_views.get_metrics, name="metrics"),
 ]
\ No newline at end of file
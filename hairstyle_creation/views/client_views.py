@@ -1,4 +1,4 @@
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from datetime import datetime
@@ -6,15 +6,20 @@ from uuid import uuid4
 import json
 
 from hairstyle_creation.handlers.client_event_handler import (
-    create_new_hairstyle_event,
-    add_hairstyles,
-    get_results,
-    add_uploaded_picture
+    aadd_hairstyles,
+    aadd_uploaded_picture,
+    acreate_new_hairstyle_event,
+    aget_history,
+    aget_new_results,
+    aget_results,
+    wait_for_results,
+    watch_results
     )
+from hairstyle_creation.handlers.cancel_handler import acancel_event
 
-from hairstyle_creation.handlers.inference_handler import (
-    start_embedding_inference
-    )
+"""
+Every view is async, serve them from asgi.py so waiting on the store does not hold a worker thread
+"""
 
 # Links for the hairstyles
 HAIRSTYLE_PRESET_LINKS = [
@@ -34,12 +39,12 @@ hairstyle_rendering_events = {}
 # This is called at the start of the hairstyle creation in order to get the Creation ID
 # Input: None
 # Output: EventID
-def start_creation(request):
+async def start_creation(request):
     if request.method != "GET":
         return HttpResponseBadRequest("Must use a GET request")
     
     # Starts the event
-    eventid = create_new_hairstyle_event(
+    eventid = await acreate_new_hairstyle_event(
         account_identifier=""
     )
     
@@ -49,12 +54,11 @@ def start_creation(request):
 # This supplies the image links and id for all the hairstyle presets
 # Input: EventID
 # Output: List of Hairstyles IDs and links
-def get_hairstyles_presets(request):
+async def get_hairstyles_presets(request):
     if request.method != "GET":
         return HttpResponseBadRequest("Must use a GET request")
 
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
@@ -72,13 +76,12 @@ def get_hairstyles_presets(request):
     return JsonResponse({"Hairstyles": hairstyles})
 
 @csrf_exempt 
-def start_rendering(request):
+async def start_rendering(request):
 
     if request.method != "POST":
         return HttpResponseBadRequest("Must use a POST request")
     
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
@@ -87,20 +90,19 @@ def start_rendering(request):
     
     hairstyles = body["hairstyles"]
     
-    add_hairstyles(account_identifier="", eventid=eventid, hairstyles=hairstyles)
-    start_embedding_inference(account_identifier="", eventid=eventid)
+    # Blending starts by itself once the embedding is done
+    await aadd_hairstyles(account_identifier="", eventid=eventid, hairstyles_dict=hairstyles)
 
     # Returns data
     return JsonResponse({"sucess": True})
 
 @csrf_exempt 
-def add_uploaded_picture_request(request):
+async def add_uploaded_picture_request(request):
 
     if request.method != "POST":
         return HttpResponseBadRequest("Must use a POST request")
     
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
@@ -109,34 +111,151 @@ def add_uploaded_picture_request(request):
     
     picture = body["photo_link"]
     
-    add_uploaded_picture(account_identifier="", eventid=eventid, picture=picture)
-    start_embedding_inference(account_identifier="", eventid=eventid)
+    # Embedding starts as soon as the picture is added
+    await aadd_uploaded_picture(account_identifier="", eventid=eventid, picture=picture)
     
     # Returns data
     return JsonResponse({"sucess": True})
 
+# This cancels an event the user abandoned, so its queued and running jobs stop using the GPUs
+# Input: EventID
+# Output: Whether the event was cancelled, false if it had already finished or errored
+@csrf_exempt
+async def cancel_rendering(request):
+
+    if request.method != "POST":
+        return HttpResponseBadRequest("Must use a POST request")
+    
+    eventid = request.GET.get('eventid')
+    # Valides eventID
+    if eventid == None:
+        return HttpResponseBadRequest("Invalid or missing EventID")
+    
+    cancelled = await acancel_event(eventid, account_identifier="")
+    
+    return JsonResponse({"cancelled": cancelled})
+
 # This returns the image transformation results or its status
 # Will return true after being called 3 or more times
 # Input: EventID
 # Output: custom image id and in_progress boolean
-def get_rendering_results(request):
+async def get_rendering_results(request):
     if request.method != "GET":
         return HttpResponseBadRequest("Must use a GET request")
     
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
     
-    # if the event doesnt exist then invalid request
-    if eventid not in hairstyle_rendering_events:
-        return HttpResponseBadRequest("Event ID does not have a rendering event")
+    results = await aget_results(account_identifier="", eventid=eventid)
     
-    results = get_results(account_identifier="", eventid=eventid)
+    # Returns data
+    return JsonResponse({"results": [result.model_dump(mode="json") for result in results] if results is not None else None})
+
+# This returns the image transformation results finished since the last call, so the first images show before the last is done
+# Input: EventID and the cursor returned with the previous call, none for every result so far
+# Output: status, the new results and the cursor of the next call
+async def get_new_rendering_results(request):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Must use a GET request")
     
-    if isinstance(results, Exception):
-        return 
+    eventid = request.GET.get('eventid')
+    # Valides eventID
+    if eventid == None:
+        return HttpResponseBadRequest("Invalid or missing EventID")
     
-    # Returns data
-    return JsonResponse({"results": results})
\ No newline at end of file
+    try:
+        cursor = int(request.GET['cursor']) if 'cursor' in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+    
+    status, results, next_cursor = await aget_new_results(account_identifier="", eventid=eventid, cursor=cursor)
+    
+    return JsonResponse({
+        "status": status,
+        "results": [result.model_dump(mode="json") for result in results],
+        "next_cursor": next_cursor,
+    })
+
+# This waits for the next image transformation results instead of polling for them (long polling)
+# Input: EventID, the cursor returned with the previous call and optional timeout in seconds
+# Output: status, the results finished since the cursor as soon as there are any or the event ended, and the cursor of the next call
+async def wait_rendering_results(request):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Must use a GET request")
+    
+    eventid = request.GET.get('eventid')
+    # Valides eventID
+    if eventid == None:
+        return HttpResponseBadRequest("Invalid or missing EventID")
+    
+    try:
+        cursor = int(request.GET['cursor']) if 'cursor' in request.GET else None
+        timeout = float(request.GET['timeout']) if 'timeout' in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor or timeout")
+    
+    status, results, next_cursor = await wait_for_results(account_identifier="", eventid=eventid, cursor=cursor, timeout=timeout)
+    
+    return JsonResponse({
+        "status": status,
+        "results": [result.model_dump(mode="json") for result in results],
+        "next_cursor": next_cursor,
+    })
+
+# This streams the image transformation results as server-sent events while they finish
+# Input: EventID, and the cursor to start from as the cursor parameter or the Last-Event-ID a reconnecting client sends
+# Output: a "status" event every time the status changes, and a "results" event with the id of its cursor for every new results
+async def stream_rendering_results(request):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Must use a GET request")
+    
+    eventid = request.GET.get('eventid')
+    # Valides eventID
+    if eventid == None:
+        return HttpResponseBadRequest("Invalid or missing EventID")
+    
+    try:
+        cursor = request.GET.get('cursor', request.headers.get('Last-Event-ID'))
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+    
+    async def events():
+        last_status = None
+        async for status, results, next_cursor in watch_results(account_identifier="", eventid=eventid, cursor=cursor):
+            # New results alone are sent without repeating the status
+            if status != last_status:
+                last_status = status
+                yield f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+            if results:
+                data = json.dumps([result.model_dump(mode='json') for result in results])
+                yield f"id: {next_cursor}\nevent: results\ndata: {data}\n\n"
+    
+    # The client reconnects once the stream ends before the event did
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+# This lists the account's past events for the history screen, newest first
+# Input: optional limit and the cursor returned with the previous page
+# Output: event summaries and the cursor of the next page
+async def get_event_history(request):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Must use a GET request")
+    
+    try:
+        limit = int(request.GET.get('limit', 20))
+        summaries, next_cursor = await aget_history(
+            account_identifier="",
+            limit=limit,
+            cursor=request.GET.get('cursor'),
+        )
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit or cursor")
+    
+    return JsonResponse({
+        "events": [summary.model_dump(mode="json") for summary in summaries],
+        "next_cursor": next_cursor,
+    })
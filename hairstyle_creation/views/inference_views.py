@@ -5,49 +5,107 @@ from datetime import datetime
 from uuid import uuid4
 import json
 
+from pydantic import ValidationError
+
 from hairstyle_creation.handlers.inference_handler import (
-    post_blend_result, 
-    post_embed_result
+    apost_blend_result,
+    apost_embed_result,
+    apost_results
     )
+from hairstyle_creation.handlers.lease_handler import aacquire_lease, arenew_lease
+from hairstyle_creation.models import InferenceJob
 
 """
 Its ok to send full errors here because it is going securly to AWS
 """
 
 @csrf_exempt 
-def blend_results_request(request):
+async def blend_results_request(request):
 
     if request.method != "POST":
         return HttpResponseBadRequest("Must use a POST request")
     
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
     
     body = json.loads(request.body)
     
-    post_blend_result(body)
+    try:
+        rejected = await apost_blend_result(body)
+    except ValidationError as e:
+        return HttpResponseBadRequest(f"Invalid blending result: {e}")
     
-    # Returns data
-    return JsonResponse({"sucess": True})
+    # Returns data, with the results of a coalesced job that were not its own
+    return JsonResponse({"sucess": True, "rejected": rejected} if rejected else {"sucess": True})
 
 @csrf_exempt 
-def embedding_results_request(request):
+async def embedding_results_request(request):
 
     if request.method != "POST":
         return HttpResponseBadRequest("Must use a POST request")
     
     eventid = request.GET.get('eventid')
-    print("EventID: ",eventid)
     # Valides eventID
     if eventid == None:
         return HttpResponseBadRequest("Invalid or missing EventID")
     
     body = json.loads(request.body)
     
-    post_embed_result(body)
+    await apost_embed_result(body)
     
     # Returns data
-    return JsonResponse({"sucess": True})
\ No newline at end of file
+    return JsonResponse({"sucess": True})
+
+# Called by a worker with the results of many jobs at once, each event they belong to is written once
+# Input: A list of {"type": "Embedding" | "Blending", "result": the body of embedding_results_request or blend_results_request}
+# Output: The status of each result in the same order, see inference_handler.post_results
+@csrf_exempt
+async def bulk_results_request(request):
+
+    if request.method != "POST":
+        return HttpResponseBadRequest("Must use a POST request")
+    
+    try:
+        body = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON")
+    
+    if not isinstance(body, list):
+        return HttpResponseBadRequest("Must post a list of results")
+    
+    statuses = await apost_results(body)
+    
+    return JsonResponse({"results": statuses})
+
+# Called by a worker for every job it receives, before running it
+# Input: The InferenceJob
+# Output: The lease to post the results under, or null if the job must be dropped
+@csrf_exempt
+async def lease_request(request):
+
+    if request.method != "POST":
+        return HttpResponseBadRequest("Must use a POST request")
+    
+    job = InferenceJob.model_validate_json(request.body)
+    lease = await aacquire_lease(job)
+    
+    return JsonResponse({"lease": lease.model_dump(mode="json") if lease is not None else None})
+
+# Called by a worker every third of the lease duration while it runs a job
+# Input: lease_id
+# Output: When the lease lapses, or null if it was lost because the job was queued again or its event cancelled
+@csrf_exempt
+async def heartbeat_request(request):
+
+    if request.method != "POST":
+        return HttpResponseBadRequest("Must use a POST request")
+    
+    lease_id = json.loads(request.body).get("lease_id")
+    if lease_id is None:
+        return HttpResponseBadRequest("Invalid or missing lease_id")
+    
+    expires = await arenew_lease(lease_id)
+    
+    return JsonResponse({"expires": expires.isoformat() if expires is not None else None})
@@ -0,0 +1,32 @@
+import hmac
+
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
+
+from hairstyle_creation import metrics
+from hairstyle_creation.models import get_store
+
+"""
+Internal counters of this worker process, used to size caches and queues.
+Only staff users and requests with the `X-Metrics-Token` header set to `settings.METRICS_TOKEN` can read them
+"""
+
+async def _allowed(request) -> bool:
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token and hmac.compare_digest(request.headers.get("X-Metrics-Token", ""), token):
+        return True
+    
+    user = await request.auser()
+    return user.is_active and user.is_staff
+
+async def get_metrics(request):
+    if request.method != "GET":
+        return HttpResponseBadRequest("Must use a GET request")
+    
+    if not await _allowed(request):
+        return HttpResponseForbidden("Metrics are only for staff or with the metrics token")
+    
+    # Makes sure the store (and its cache) is created so its counters are reported
+    get_store()
+    
+    return JsonResponse(metrics.collect())